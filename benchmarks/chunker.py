@@ -0,0 +1,86 @@
+"""
+benchmark do chunking: RecursiveCharacterTextSplitter (contagem por callback) x TokenChunker (offsets)
+
+uso: python -m benchmarks.chunker [--paragraphs 100 1000 5000] [--runs 3]
+"""
+import argparse
+import random
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from orjson import dumps, OPT_INDENT_2
+
+from config import env
+from provider.chunker import TokenChunker
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit proin placerat venenatis pharetra "
+         "pellentesque fringilla dignissim velit quis hendrerit sed in urna nisi nunc massa").split()
+
+
+def document(rng: random.Random, paragraphs: int) -> str:
+    return "\n\n".join(
+        " ".join(
+            " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))).capitalize() + "."
+            for _ in range(rng.randint(2, 8))
+        ) for _ in range(paragraphs)
+    )
+
+
+def measure(split: Callable[[str], List[str]], text: str, runs: int) -> Dict:
+    timings: List[float] = []
+    for _ in range(runs):
+        start = perf_counter()
+        split(text)
+        timings.append((perf_counter() - start) * 1000)
+    return dict(p50_ms=round(median(timings), 3), max_ms=round(max(timings), 3))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    tokenizer = tiktoken.encoding_for_model(model_name=env.OPENAI_EMBEDDING_MODEL)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=100,
+        chunk_overlap=20,
+        length_function=lambda text: len(tokenizer.encode(text=text, disallowed_special=())),
+        separators=["\n\n", "\n", " ", ""]
+    )
+    chunker = TokenChunker(tokenizer, chunk_size=100, chunk_overlap=20)
+    chunker.token_bytes
+
+    rng = random.Random(0)
+    results = []
+    for paragraphs in args.paragraphs:
+        text = document(rng, paragraphs)
+        langchain = measure(splitter.split_text, text, args.runs)
+        native = measure(chunker.split_text, text, args.runs)
+        results.append(dict(
+            characters=len(text),
+            equal=splitter.split_text(text) == chunker.split_text(text),
+            langchain=langchain,
+            native=native,
+            speedup=round(langchain["p50_ms"] / max(native["p50_ms"], 1e-6), 1)
+        ))
+
+    texts = [document(rng, 20) for _ in range(200)]
+    start = perf_counter()
+    for text in texts:
+        chunker.split_text(text)
+    sequential = (perf_counter() - start) * 1000
+    start = perf_counter()
+    chunker.split_texts(texts)
+    batch = (perf_counter() - start) * 1000
+    print(dumps(dict(
+        documents=results,
+        batch=dict(documents=len(texts), sequential_ms=round(sequential, 3), batch_ms=round(batch, 3))
+    ), option=OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
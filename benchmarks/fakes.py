@@ -0,0 +1,882 @@
+"""
+dublês locais e determinísticos dos serviços externos (OpenAI, ElevenLabs, Milvus, Mongo e broker do Celery),
+com latência configurável; cada chamada registra o tempo gasto na etapa correspondente da requisição atual
+"""
+import ast
+import asyncio
+import random
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from datetime import datetime
+from hashlib import md5
+from time import perf_counter, sleep
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, ContextManager, Dict, Iterator, List, Set, Tuple, Union
+
+import numpy as np
+import tiktoken
+from bson import ObjectId
+from celery import Celery
+from kombu.transport import TRANSPORT_ALIASES, memory
+from langchain.schema import AIMessage, BaseMessage
+from langchain.schema.messages import AIMessageChunk
+from orjson import dumps
+from pydantic import BaseModel
+from pymongo import IndexModel
+from pymongo.errors import DuplicateKeyError
+
+from config import env
+from provider.lexical import LexicalIndex
+from provider.mp3 import header
+from provider import MilvusSearch, jingle
+from resources import Resources
+from schemas import MilvusSchema
+from .tokenizer import encoding
+
+STAGES = ["embedding", "milvus", "mongo", "llm", "tts", "broker"]
+
+# etapas da requisição em andamento: etapa -> segundos gastos nos serviços externos
+timings: ContextVar[Union[Dict[str, float], None]] = ContextVar("timings", default=None)
+
+
+class Latency(BaseModel):
+    """
+    latências simuladas em milissegundos (por chamada, salvo indicação)
+    """
+    embedding: float = 40
+    milvus: float = 8
+    mongo: float = 2
+    llm: float = 400            # até o primeiro token
+    llm_token: float = 15       # por token gerado
+    tts: float = 250            # até o primeiro byte
+    tts_chunk: float = 5        # por bloco de 8 KB
+    broker: float = 2
+    jitter: float = 0           # variação uniforme relativa (0.1 = ±10%), sorteada com semente fixa
+    scale: float = 1            # multiplica todas as latências (0 mede só o custo do código)
+
+    def seconds(self, name: str, rng: random.Random = None) -> float:
+        ms = getattr(self, name) * self.scale
+        if self.jitter and rng is not None:
+            ms *= 1 + rng.uniform(-self.jitter, self.jitter)
+        return max(ms, 0) / 1000
+
+
+def record(stage: str, seconds: float) -> None:
+    current = timings.get()
+    if current is not None:
+        current[stage] = current.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, perf_counter() - start)
+
+
+class Service:
+    """
+    base dos dublês: latência (com jitter de semente fixa) e registro da etapa
+    """
+    stage = ""
+
+    def __init__(self, latency: Latency, seed: int = 0):
+        self.latency = latency
+        self.rng = random.Random(f"{self.stage}:{seed}")
+        self.rng_lock = threading.Lock()
+
+    def seconds(self, name: str = None) -> float:
+        with self.rng_lock:
+            return self.latency.seconds(self.stage if name is None else name, self.rng)
+
+    def wait(self, name: str = None) -> None:
+        seconds = self.seconds(name)
+        if seconds > 0:
+            sleep(seconds)
+
+    async def await_(self, name: str = None) -> None:
+        seconds = self.seconds(name)
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+
+# Mongo
+
+def matches(doc: Dict, filter: Dict) -> bool:
+    for key, condition in filter.items():
+        if key == "$or":
+            if not any(matches(doc, f) for f in condition):
+                return False
+            continue
+        if key == "$and":
+            if not all(matches(doc, f) for f in condition):
+                return False
+            continue
+        value = doc.get(key)
+        if isinstance(condition, dict) and condition and all(op.startswith("$") for op in condition):
+            for op, argument in condition.items():
+                if not OPERATORS[op](value, argument):
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+OPERATORS = {
+    "$in": lambda value, argument: value in argument,
+    "$nin": lambda value, argument: value not in argument,
+    "$ne": lambda value, argument: value != argument,
+    "$gt": lambda value, argument: value is not None and value > argument,
+    "$gte": lambda value, argument: value is not None and value >= argument,
+    "$lt": lambda value, argument: value is not None and value < argument,
+    "$lte": lambda value, argument: value is not None and value <= argument,
+    "$exists": lambda value, argument: (value is not None) == bool(argument),
+}
+
+
+def project(doc: Dict, projection: Dict = None) -> Dict:
+    if not projection:
+        return dict(doc)
+    included = [key for key, value in projection.items() if value and key != "_id"]
+    if included:
+        result = {key: doc[key] for key in included if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {key: value for key, value in doc.items() if projection.get(key, 1)}
+
+
+def order(docs: List[Dict], sort: Union[Dict, List[Tuple[str, int]], None]) -> List[Dict]:
+    keys = list(sort.items()) if isinstance(sort, dict) else list(sort or [])
+    for key, direction in reversed(keys):
+        docs = sorted(docs, key=lambda doc: sort_key(doc.get(key)), reverse=direction < 0)
+    return docs
+
+
+def bson(fields: Dict) -> Dict:
+    # datas com a precisão do BSON (milissegundos), como voltam do Mongo
+    return {
+        key: value.replace(microsecond=value.microsecond // 1000 * 1000) if isinstance(value, datetime) else value
+        for key, value in fields.items()
+    }
+
+
+def hashable(value: Any) -> Any:
+    return tuple(value) if isinstance(value, list) else value
+
+
+def sort_key(value: Any) -> Tuple:
+    # ObjectId e str não se comparam: agrupa pelo tipo antes do valor (None primeiro, como no Mongo)
+    return (False, "", 0) if value is None else (True, type(value).__name__, value)
+
+
+class MongoStore:
+    """
+    uma coleção em memória com o subconjunto de operações usado pelo app; create_index monta um índice
+    de igualdade no primeiro campo, usado por filtros com igualdade/$in nesse campo (como no Mongo, sem ele
+    a consulta percorre a coleção inteira)
+    """
+    def __init__(self):
+        self.documents: Dict[Any, Dict] = {}
+        self.lock = threading.RLock()
+        self.indexes: Dict[str, Dict[Any, Set[Any]]] = {}
+
+    def index(self, field: str) -> None:
+        with self.lock:
+            if field == "_id" or field in self.indexes:
+                return
+            entries: Dict[Any, Set[Any]] = {}
+            for id, doc in self.documents.items():
+                entries.setdefault(hashable(doc.get(field)), set()).add(id)
+            self.indexes[field] = entries
+
+    def reindex(self, doc: Dict, add: bool) -> None:
+        for field, entries in self.indexes.items():
+            value = hashable(doc.get(field))
+            if add:
+                entries.setdefault(value, set()).add(doc["_id"])
+            elif value in entries:
+                entries[value].discard(doc["_id"])
+
+    def candidates(self, filter: Dict) -> Union[Set[Any], None]:
+        # _ids que podem satisfazer o filtro, pelos índices; None quando é preciso percorrer tudo
+        if "$or" in filter:
+            branches = [self.candidates(branch) for branch in filter["$or"]]
+            if all(branch is not None for branch in branches):
+                return set().union(*branches)
+        for field, condition in filter.items():
+            if field != "_id" and field not in self.indexes:
+                continue
+            if isinstance(condition, dict) and set(condition) == {"$in"}:
+                values = condition["$in"]
+            elif isinstance(condition, dict) and any(op.startswith("$") for op in condition):
+                continue
+            else:
+                values = [condition]
+            if field == "_id":
+                return {value for value in values if hashable(value) in self.documents}
+            return set().union(*[self.indexes[field].get(hashable(value), set()) for value in values])
+        return None
+
+    def select(self, filter: Dict = None, projection: Dict = None, sort=None,
+               skip: int = 0, limit: int = 0) -> List[Dict]:
+        filter = filter or {}
+        with self.lock:
+            ids = self.candidates(filter)
+            docs = self.documents.values() if ids is None else [self.documents[id] for id in ids]
+            docs = [doc for doc in docs if matches(doc, filter)]
+        docs = order(docs, sort)[skip:]
+        if limit:
+            docs = docs[:limit]
+        return [project(doc, projection) for doc in docs]
+
+    def insert(self, doc: Dict) -> None:
+        with self.lock:
+            doc.setdefault("_id", ObjectId())
+            if doc["_id"] in self.documents:
+                raise DuplicateKeyError(f"E11000 duplicate key error: _id {doc['_id']}")
+            self.documents[doc["_id"]] = bson(doc)
+            self.reindex(self.documents[doc["_id"]], add=True)
+
+    @staticmethod
+    def apply(doc: Dict, update: Union[Dict, List[Dict]], inserted: bool) -> None:
+        for stage in (update if isinstance(update, list) else [update]):
+            for op, fields in stage.items():
+                if op == "$set" or (op == "$setOnInsert" and inserted):
+                    doc.update(bson(fields))
+                elif op == "$inc":
+                    for key, value in fields.items():
+                        doc[key] = doc.get(key, 0) + value
+                elif op == "$unset":
+                    for key in fields:
+                        doc.pop(key, None)
+
+    def update(self, filter: Dict, update: Union[Dict, List[Dict]], upsert: bool = False,
+               many: bool = False, sort=None) -> Tuple[int, Union[Dict, None]]:
+        with self.lock:
+            docs = self.select(filter, sort=sort, limit=0 if many else 1)
+            for doc in docs:
+                stored = self.documents[doc["_id"]]
+                self.reindex(stored, add=False)
+                self.apply(stored, update, inserted=False)
+                self.reindex(stored, add=True)
+            if docs:
+                return len(docs), self.documents[docs[-1]["_id"]]
+            if not upsert:
+                return 0, None
+            doc = {
+                key: value for key, value in filter.items()
+                if not key.startswith("$") and not (isinstance(value, dict) and any(k.startswith("$") for k in value))
+            }
+            self.apply(doc, update, inserted=True)
+            self.insert(doc)
+            return 1, self.documents[doc["_id"]]
+
+    def delete(self, filter: Dict, many: bool = False, sort=None) -> List[Dict]:
+        with self.lock:
+            docs = self.select(filter, sort=sort, limit=0 if many else 1)
+            for doc in docs:
+                self.reindex(self.documents.pop(doc["_id"]), add=False)
+            return docs
+
+
+class MongoCollection(Service):
+    """
+    pymongo.collection.Collection em memória
+    """
+    stage = "mongo"
+
+    def __init__(self, store: MongoStore, latency: Latency, seed: int = 0):
+        super().__init__(latency, seed)
+        self.store = store
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        with timed(self.stage):
+            self.wait()
+            yield
+
+    def find(self, filter: Dict = None, projection: Dict = None, **kwargs) -> "Cursor":
+        return Cursor(self, filter, projection)
+
+    def find_one(self, filter: Dict = None, projection: Dict = None, **kwargs) -> Union[Dict, None]:
+        with self.call():
+            docs = self.store.select(filter, projection, limit=1)
+        return docs[0] if docs else None
+
+    def count_documents(self, filter: Dict, **kwargs) -> int:
+        with self.call():
+            return len(self.store.select(filter, {"_id": 1}))
+
+    def insert_one(self, document: Dict, **kwargs) -> SimpleNamespace:
+        with self.call():
+            self.store.insert(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    def insert_many(self, documents: List[Dict], **kwargs) -> SimpleNamespace:
+        with self.call():
+            for document in documents:
+                self.store.insert(document)
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents])
+
+    def update_one(self, filter: Dict, update: Dict, upsert: bool = False, **kwargs) -> SimpleNamespace:
+        with self.call():
+            count, _ = self.store.update(filter, update, upsert)
+        return SimpleNamespace(modified_count=count)
+
+    def update_many(self, filter: Dict, update: Union[Dict, List[Dict]], upsert: bool = False,
+                    **kwargs) -> SimpleNamespace:
+        with self.call():
+            count, _ = self.store.update(filter, update, upsert, many=True)
+        return SimpleNamespace(modified_count=count)
+
+    def find_one_and_update(self, filter: Dict, update: Dict, upsert: bool = False, sort=None,
+                            **kwargs) -> Union[Dict, None]:
+        # devolve o documento já atualizado (ReturnDocument.AFTER, o único modo usado no app)
+        with self.call():
+            _, doc = self.store.update(filter, update, upsert, sort=sort)
+        return None if doc is None else dict(doc)
+
+    def find_one_and_delete(self, filter: Dict, sort=None, **kwargs) -> Union[Dict, None]:
+        with self.call():
+            docs = self.store.delete(filter, sort=sort)
+        return docs[0] if docs else None
+
+    def delete_one(self, filter: Dict, **kwargs) -> SimpleNamespace:
+        with self.call():
+            return SimpleNamespace(deleted_count=len(self.store.delete(filter)))
+
+    def delete_many(self, filter: Dict, **kwargs) -> SimpleNamespace:
+        with self.call():
+            return SimpleNamespace(deleted_count=len(self.store.delete(filter, many=True)))
+
+    def bulk_write(self, operations: List, ordered: bool = True, **kwargs) -> SimpleNamespace:
+        with self.call():
+            for operation in operations:
+                self.store.update(operation._filter, operation._doc, operation._upsert)
+        return SimpleNamespace(bulk_api_result={"nMatched": len(operations)})
+
+    def create_index(self, keys: List[Tuple[str, int]], **kwargs) -> str:
+        self.store.index(keys[0][0])
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    def create_indexes(self, indexes: List[IndexModel], **kwargs) -> List[str]:
+        # chamada direta: no AsyncMongoCollection, self.create_index seria a versão assíncrona
+        return [MongoCollection.create_index(self, list(index.document["key"].items())) for index in indexes]
+
+
+class AsyncMongoCollection(MongoCollection):
+    """
+    AsyncIOMotorCollection em memória: mesmas operações, com a latência aguardada no event loop
+    """
+    def __getattribute__(self, name: str):
+        attribute = super().__getattribute__(name)
+        if name not in ASYNC_OPERATIONS:
+            return attribute
+
+        async def operation(*args, **kwargs):
+            with timed(self.stage):
+                await self.await_()
+                return attribute(*args, **kwargs)
+        return operation
+
+    def call(self) -> ContextManager[None]:
+        # a latência é aguardada no wrapper assíncrono
+        return nullcontext()
+
+    def find(self, filter: Dict = None, projection: Dict = None, **kwargs) -> "AsyncCursor":
+        return AsyncCursor(self, filter, projection)
+
+
+ASYNC_OPERATIONS = {
+    "find_one", "count_documents", "insert_one", "insert_many", "update_one", "update_many",
+    "find_one_and_update", "find_one_and_delete", "delete_one", "delete_many", "bulk_write", "create_index",
+    "create_indexes"
+}
+
+
+class Cursor:
+    def __init__(self, collection: MongoCollection, filter: Dict = None, projection: Dict = None):
+        self.collection = collection
+        self.filter = filter
+        self.projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, sort) -> "Cursor":
+        self._sort = sort
+        return self
+
+    def skip(self, skip: int) -> "Cursor":
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int) -> "Cursor":
+        self._limit = limit
+        return self
+
+    def fetch(self) -> List[Dict]:
+        return self.collection.store.select(self.filter, self.projection, self._sort, self._skip, self._limit)
+
+    def __iter__(self) -> Iterator[Dict]:
+        with self.collection.call():
+            docs = self.fetch()
+        return iter(docs)
+
+
+class AsyncCursor(Cursor):
+    async def to_list(self, length: Union[int, None] = None) -> List[Dict]:
+        with timed(self.collection.stage):
+            await self.collection.await_()
+        docs = self.fetch()
+        return docs if length is None else docs[:length]
+
+    async def __aiter__(self) -> AsyncIterator[Dict]:
+        for doc in await self.to_list(None):
+            yield doc
+
+
+class Session:
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, *args) -> None:
+        return None
+
+    async def __aenter__(self) -> "Session":
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        return None
+
+    def start_transaction(self) -> "Session":
+        return self
+
+
+class MongoClient:
+    """
+    MongoClient (ou AsyncIOMotorClient, com asynchronous=True) sobre bancos compartilhados em memória
+    """
+    def __init__(self, databases: Dict[str, Dict[str, MongoStore]], latency: Latency, asynchronous: bool = False):
+        self.databases = databases
+        self.latency = latency
+        self.asynchronous = asynchronous
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name: str) -> "MongoDatabase":
+        with self.lock:
+            return MongoDatabase(self, self.databases.setdefault(name, {}))
+
+    def start_session(self):
+        if not self.asynchronous:
+            return Session()
+
+        async def session() -> Session:
+            return Session()
+        return session()
+
+    def close(self) -> None:
+        return None
+
+
+class MongoDatabase:
+    def __init__(self, client: MongoClient, collections: Dict[str, MongoStore]):
+        self.client = client
+        self.collections = collections
+
+    def __getitem__(self, name: str) -> MongoCollection:
+        with self.client.lock:
+            store = self.collections.setdefault(name, MongoStore())
+        collection = AsyncMongoCollection if self.client.asynchronous else MongoCollection
+        return collection(store, self.client.latency)
+
+
+# Milvus
+
+class MilvusCollection(Service):
+    """
+    pymilvus.Collection em memória: busca exata por cosseno (força bruta) filtrada por namespace
+    """
+    stage = "milvus"
+    schema = MilvusSchema
+
+    def __init__(self, latency: Latency, seed: int = 0):
+        super().__init__(latency, seed)
+        self.rows: Dict[str, Tuple[str, str, np.ndarray]] = {}
+        self.matrices: Dict[str, Tuple[List[str], np.ndarray]] = {}
+        self.lock = threading.RLock()
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        with timed(self.stage):
+            self.wait()
+            yield
+
+    @staticmethod
+    def parse(expr: str) -> Dict:
+        expr = expr.strip()
+        if match := re.fullmatch(r"id in (\[.*\])", expr, re.S):
+            return {"id": set(ast.literal_eval(match.group(1)))}
+        # remoção restrita ao namespace (partição)
+        if match := re.fullmatch(r"ns == \"(.*?)\" and id in (\[.*\])", expr, re.S):
+            return {"ns": match.group(1), "id": set(ast.literal_eval(match.group(2)))}
+        if match := re.fullmatch(r"ns == \"(.*)\"", expr):
+            return {"ns": match.group(1)}
+        if expr == "id != \"\"":
+            return {}
+        raise ValueError(f"Unsupported expression: {expr}")
+
+    def select(self, expr: str) -> List[str]:
+        condition = self.parse(expr)
+        with self.lock:
+            if "id" in condition:
+                return [id for id in condition["id"] if id in self.rows
+                        and ("ns" not in condition or self.rows[id][1] == condition["ns"])]
+            if not condition:
+                return list(self.rows)
+            return [id for id, (_, ns, _) in self.rows.items() if ns == condition["ns"]]
+
+    def row(self, id: str, output_fields: List[str]) -> Dict:
+        text, ns, embedding = self.rows[id]
+        values = dict(id=id, text=text, ns=ns, embedding=embedding.tolist())
+        return {field: values[field] for field in output_fields if field in values}
+
+    def load(self) -> None:
+        return None
+
+    def describe(self) -> Dict:
+        # mesmo formato do pymilvus; sem aliases: o nome físico é o configurado
+        return dict(
+            collection_name=env.MILVUS_COLLECTION_NAME,
+            description=self.schema.description,
+            fields=[dict(name=field.name, params=field.params) for field in self.schema.fields]
+        )
+
+    def query(self, expr: str, output_fields: List[str] = None, **kwargs) -> List[Dict]:
+        with self.call():
+            ids = self.select(expr)
+            if output_fields == ["count(*)"]:
+                return [{"count(*)": len(ids)}]
+            with self.lock:
+                return [self.row(id, output_fields or ["id"]) for id in ids if id in self.rows]
+
+    def query_iterator(self, batch_size: int = 1000, expr: str = "", output_fields: List[str] = None,
+                       **kwargs) -> "QueryIterator":
+        return QueryIterator(self, self.select(expr), batch_size, output_fields or ["id"])
+
+    def upsert(self, data: List[List]) -> SimpleNamespace:
+        with self.call():
+            ids, texts, namespaces, embeddings = data
+            with self.lock:
+                for id, text, ns, embedding in zip(ids, texts, namespaces, embeddings):
+                    if id in self.rows:
+                        self.matrices.pop(self.rows[id][1], None)
+                    self.rows[id] = (text, ns, np.asarray(embedding, dtype=np.float32))
+                    self.matrices.pop(ns, None)
+        return SimpleNamespace(succ_count=len(ids), err_count=0, primary_keys=list(ids))
+
+    def delete(self, expr: str) -> SimpleNamespace:
+        with self.call():
+            ids = self.select(expr)
+            with self.lock:
+                for id in ids:
+                    self.matrices.pop(self.rows.pop(id)[1], None)
+        return SimpleNamespace(delete_count=len(ids))
+
+    def matrix(self, ns: str) -> Tuple[List[str], np.ndarray]:
+        with self.lock:
+            if ns not in self.matrices:
+                ids = [id for id, (_, namespace, _) in self.rows.items() if namespace == ns]
+                matrix = np.stack([self.rows[id][2] for id in ids]) if ids else np.zeros((0, 1), dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                norms[norms == 0] = 1
+                self.matrices[ns] = (ids, matrix / norms)
+            return self.matrices[ns]
+
+    def search(self, data: List[List[float]], anns_field: str, param: Dict, limit: int, expr: str = None,
+               output_fields: List[str] = None, **kwargs) -> List[List[SimpleNamespace]]:
+        with self.call():
+            ns = self.parse(expr)["ns"]
+            ids, matrix = self.matrix(ns)
+            results = []
+            for vector in data:
+                if not ids:
+                    results.append([])
+                    continue
+                query = np.asarray(vector, dtype=np.float32)
+                scores = matrix @ (query / (np.linalg.norm(query) or 1))
+                top = np.argsort(-scores, kind="stable")[:limit]
+                with self.lock:
+                    results.append([
+                        SimpleNamespace(id=ids[i], distance=float(scores[i]),
+                                        entity=self.row(ids[i], output_fields or ["id"]))
+                        for i in top if ids[i] in self.rows
+                    ])
+        return results
+
+
+class QueryIterator:
+    def __init__(self, collection: MilvusCollection, ids: List[str], batch_size: int, output_fields: List[str]):
+        self.collection = collection
+        self.ids = ids
+        self.batch_size = batch_size
+        self.output_fields = output_fields
+        self.offset = 0
+
+    def next(self) -> List[Dict]:
+        batch = self.ids[self.offset:self.offset + self.batch_size]
+        self.offset += len(batch)
+        if not batch:
+            return []
+        with self.collection.call(), self.collection.lock:
+            return [self.collection.row(id, self.output_fields) for id in batch if id in self.collection.rows]
+
+    def close(self) -> None:
+        return None
+
+
+# OpenAI
+
+class Embeddings(Service):
+    """
+    OpenAIEmbeddings determinístico: feature hashing dos termos (os mesmos do índice lexical) em 1536 dimensões,
+    para que textos com termos em comum fiquem próximos
+    """
+    stage = "embedding"
+    dim = 1536
+    chunk_size = 1000
+
+    def __init__(self, latency: Latency, seed: int = 0):
+        super().__init__(latency, seed)
+        self.model = env.OPENAI_EMBEDDING_MODEL
+        self.model_kwargs: Dict = {}
+
+    def vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for term, frequency in Counter(LexicalIndex.terms(text) or [text]).items():
+            digest = int.from_bytes(md5(term.encode()).digest()[:8], "little")
+            vector[digest % self.dim] += frequency if (digest >> 32) & 1 else -frequency
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with timed(self.stage):
+            self.wait()
+            return [self.vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        with timed(self.stage):
+            await self.await_()
+            return [self.vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+class ChatModel(Service):
+    """
+    ChatOpenAI determinístico: respostas derivadas da pergunta; quiz=True responde no JSON do GenQuiz
+    """
+    stage = "llm"
+
+    def __init__(self, latency: Latency, seed: int = 0, quiz: bool = False):
+        super().__init__(latency, seed)
+        self.quiz = quiz
+
+    def answer(self, messages: List[BaseMessage]) -> str:
+        prompt = messages[-1].content
+        digest = md5(prompt.encode()).digest()
+        if self.quiz:
+            topic = re.search(r'Topic: """(.*?)"""', prompt, re.S)
+            topic = topic.group(1) if topic else "tema"
+            return dumps(dict(
+                question=f"Qual alternativa descreve melhor {topic}?",
+                truth="abcd"[digest[0] % 4],
+                alternatives=[f"{letter}) {topic} opção {letter.upper()}" for letter in "abcd"]
+            )).decode()
+        words = LexicalIndex.terms(prompt)[:12] or ["nada"]
+        # cumprimenta como o GenBot pede no prompt de sistema (saudação com o nome do usuário)
+        greeting = re.search(r'Greet the user with "(.*?)"', messages[0].content) if len(messages) > 1 else None
+        prefix = f"{greeting.group(1)}! " if greeting else ""
+        return f"{prefix}Sobre {' '.join(words)}: resposta {digest.hex()[:8]}, com base no contexto do namespace."
+
+    @staticmethod
+    def tokens(answer: str) -> List[str]:
+        return re.findall(r"\S+\s*", answer)
+
+    async def ainvoke(self, input: List[BaseMessage], **kwargs) -> AIMessage:
+        with timed(self.stage):
+            answer = self.answer(input)
+            await self.await_()
+            await asyncio.sleep(self.seconds("llm_token") * len(self.tokens(answer)))
+        return AIMessage(content=answer)
+
+    async def astream(self, input: List[BaseMessage], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        answer = self.answer(input)
+        with timed(self.stage):
+            await self.await_()
+        for token in self.tokens(answer):
+            with timed(self.stage):
+                await self.await_("llm_token")
+            yield AIMessageChunk(content=token)
+
+
+# ElevenLabs
+
+class SpeechSession(Service):
+    """
+    aiohttp.ClientSession para a API de voz: devolve MP3 no mesmo formato da vinheta
+    (frames repetidos, ~15 caracteres por segundo de fala), em blocos
+    """
+    stage = "tts"
+
+    def __init__(self, latency: Latency, jingle_frames: bytes, seed: int = 0):
+        super().__init__(latency, seed)
+        self.frames: List[bytes] = []
+        offset = 0
+        while (frame := header(jingle_frames, offset)) is not None and frame.length > 0:
+            self.frames.append(jingle_frames[offset:offset + frame.length])
+            offset += frame.length
+        self.frame_seconds = 1152 / header(jingle_frames, 0).params.sample_rate if self.frames else 1.0
+
+    def audio(self, text: str) -> bytes:
+        if not self.frames:
+            return b""
+        count = max(1, int(len(text) / 15 / self.frame_seconds))
+        return b"".join(self.frames[i % len(self.frames)] for i in range(count))
+
+    def post(self, url: str, json: Dict = None, headers: Dict = None, **kwargs) -> "SpeechResponse":
+        return SpeechResponse(self, self.audio((json or {}).get("text", "")))
+
+    async def close(self) -> None:
+        return None
+
+
+class SpeechResponse:
+    status = 200
+
+    def __init__(self, session: SpeechSession, audio: bytes):
+        self.session = session
+        self.content = self
+        self.audio = audio
+        self.started = False
+
+    async def start(self) -> "SpeechResponse":
+        if not self.started:
+            self.started = True
+            with timed(self.session.stage):
+                await self.session.await_()
+        return self
+
+    def __await__(self):
+        return self.start().__await__()
+
+    async def __aenter__(self) -> "SpeechResponse":
+        return await self.start()
+
+    async def __aexit__(self, *args) -> None:
+        self.release()
+
+    async def iter_chunked(self, size: int) -> AsyncIterator[bytes]:
+        await self.start()
+        for offset in range(0, len(self.audio), size):
+            with timed(self.session.stage):
+                await self.session.await_("tts_chunk")
+            yield self.audio[offset:offset + size]
+
+    def release(self) -> None:
+        return None
+
+
+# Celery
+
+class BrokerChannel(memory.Channel):
+    latency: Union[Latency, None] = None
+
+    def _put(self, queue, message, **kwargs):
+        with timed("broker"):
+            if self.latency is not None:
+                seconds = self.latency.seconds("broker")
+                if seconds > 0:
+                    sleep(seconds)
+            super()._put(queue, message, **kwargs)
+
+
+class Broker(memory.Transport):
+    """
+    transporte em memória do kombu com latência de publicação; broker_url = "offline://"
+    """
+    Channel = BrokerChannel
+
+
+def use_broker(celery: Celery, latency: Latency) -> None:
+    TRANSPORT_ALIASES["offline"] = "benchmarks.fakes:Broker"
+    BrokerChannel.latency = latency
+    celery.conf.broker_url = "offline://"
+
+
+# tiktoken
+
+def use_tokenizer(corpus: str) -> tiktoken.Encoding:
+    tokenizer = encoding(corpus, model=env.OPENAI_EMBEDDING_MODEL)
+    if tokenizer.name == "offline":
+        # MilvusDataStore e GenBot.usage pedem o encoding pelo nome do modelo
+        tiktoken.encoding_for_model = lambda model_name: tokenizer
+    return tokenizer
+
+
+# recursos
+
+class Services:
+    """
+    estado compartilhado dos serviços simulados (o que a API e o worker enxergam em comum)
+    """
+    def __init__(self, latency: Latency, jingle_frames: bytes = b""):
+        self.latency = latency
+        self.databases: Dict[str, Dict[str, MongoStore]] = {}
+        self.collection = MilvusCollection(latency)
+        self.jingle_frames = jingle_frames
+
+
+class OfflineResources(Resources):
+    """
+    Resources com os clientes externos trocados pelos dublês locais
+    """
+    def __init__(self, services: Services):
+        super().__init__()
+        self.services = services
+
+    def open(self) -> "OfflineResources":
+        latency = self.services.latency
+        self.collection = self.services.collection
+        self.embeddings_model = Embeddings(latency)
+        self.milvus = MilvusSearch(collection=self.collection, embeddings_model=self.embeddings_model)
+        self.mongo = MongoClient(self.services.databases, latency)
+        self.chat_llm = ChatModel(latency)
+        self.quiz_llm = ChatModel(latency, quiz=True)
+        self.pool_llm = ChatModel(latency, quiz=True)
+        self.watch()
+        return self
+
+    async def aopen(self) -> "OfflineResources":
+        self.open()
+        self.motor = MongoClient(self.services.databases, self.services.latency, asynchronous=True)
+        self.session = SpeechSession(self.services.latency, self.services.jingle_frames)
+        if env.MONGO_PROVISION_INDEXES:
+            await self.provision()
+        await self.bind()
+        return self
+
+    @staticmethod
+    def load_jingle() -> None:
+        # só os frames: a mixagem por concatenação não precisa decodificar (nem do ffmpeg)
+        jingle.load()
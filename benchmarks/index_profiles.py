@@ -0,0 +1,201 @@
+"""
+perfis de índice do Milvus (schemas/milvus_schema.py) com vetores reais: recall@k contra a busca exata (força bruta
+em numpy, no mesmo namespace da consulta), QPS, latência e memória de cada perfil; precisa de um Milvus de verdade e
+usa uma coleção descartável, removida ao final
+
+uso: python -m benchmarks.index_profiles [--sample 20000] [--queries 200] [--k 3] [--profiles ivf_flat,hnsw]
+                                         [--source COLEÇÃO | --snapshot NOME]
+os vetores vêm da coleção em uso (ou de um snapshot do snapshot.py); as consultas são vetores da amostra deixados de
+fora da coleção descartável. imprime, por perfil, tempo de build, p50/p95 (ms), QPS com --concurrency threads,
+recall@k e memória dos segmentos carregados, em JSON
+"""
+import argparse
+import random
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from orjson import dumps, OPT_INDENT_2
+from pymilvus import Collection, connections, db, utility
+
+from config import env
+from provider.snapshot import Snapshot
+from schemas import INDEX_PROFILES, milvus_index, milvus_partitioning, milvus_schema, search_params
+
+Sample = Tuple[List[str], List[str], np.ndarray]
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+
+
+def from_collection(name: str, size: int, batch: int = 1000) -> Sample:
+    ids: List[str] = []
+    namespaces: List[str] = []
+    embeddings: List[List[float]] = []
+    collection = Collection(name)
+    collection.load()
+    iterator = collection.query_iterator(batch_size=batch, expr='id != ""', output_fields=["id", "ns", "embedding"])
+    try:
+        while len(ids) < size:
+            rows = iterator.next()
+            if not rows:
+                break
+            for row in rows[:size - len(ids)]:
+                ids.append(row["id"])
+                namespaces.append(row["ns"])
+                embeddings.append(row["embedding"])
+    finally:
+        iterator.close()
+    return ids, namespaces, np.asarray(embeddings, dtype=np.float32)
+
+
+def from_snapshot(name: str, size: int) -> Sample:
+    snapshot = Snapshot(Path(env.SNAPSHOT_DIR) / name)
+    rows = min(size, snapshot.rows)
+    return (
+        [id.decode() for id in snapshot.ids[:rows]],
+        [snapshot.manifest["namespace"]] * rows,
+        np.asarray(snapshot.embeddings[:rows], dtype=np.float32)
+    )
+
+
+def ground_truth(base: Sample, queries: Sample, k: int) -> List[List[str]]:
+    """
+    k vizinhos exatos (cosseno) de cada consulta entre os vetores do seu namespace
+    :return:
+    """
+    ids, namespaces, embeddings = base
+    normalized = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    by_namespace: Dict[str, List[int]] = {}
+    for row, namespace in enumerate(namespaces):
+        by_namespace.setdefault(namespace, []).append(row)
+    truth = []
+    for namespace, vector in zip(queries[1], queries[2]):
+        rows = np.asarray(by_namespace.get(namespace, []), dtype=np.int64)
+        scores = normalized[rows] @ (vector / max(float(np.linalg.norm(vector)), 1e-12))
+        top = rows[np.argsort(-scores)[:k]]
+        truth.append([ids[row] for row in top])
+    return truth
+
+
+def build(name: str, base: Sample, profile: str, partitions: int = 0, batch: int = 1000) -> Tuple[Collection, float]:
+    ids, namespaces, embeddings = base
+    collection = Collection(name, schema=milvus_schema(embeddings.shape[1], partitioned=partitions > 0),
+                            **milvus_partitioning(partitions))
+    for start in range(0, len(ids), batch):
+        stop = start + batch
+        collection.insert([ids[start:stop], [""] * len(ids[start:stop]), namespaces[start:stop],
+                           embeddings[start:stop].tolist()])
+    collection.flush()
+    start = perf_counter()
+    collection.create_index(field_name="embedding", index_params=milvus_index(profile))
+    utility.wait_for_index_building_complete(name)
+    elapsed = perf_counter() - start
+    collection.load()
+    return collection, elapsed
+
+
+def measure(collection: Collection, queries: Sample, truth: List[List[str]], profile: str, k: int,
+            concurrency: int) -> Dict:
+    param = search_params(profile, k)
+
+    def search(i: int) -> Tuple[float, List[str]]:
+        start = perf_counter()
+        hits = collection.search(
+            data=[queries[2][i].tolist()], anns_field="embedding", param=param, limit=k,
+            expr=f"ns == \"{queries[1][i]}\""
+        )[0]
+        return perf_counter() - start, [hit.id for hit in hits]
+
+    count = len(queries[0])
+    for i in range(min(count, 10)):
+        search(i)
+    latencies: List[float] = []
+    recall = 0.0
+    for i in range(count):
+        latency, found = search(i)
+        latencies.append(latency)
+        recall += len(set(found) & set(truth[i])) / max(len(truth[i]), 1)
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(search, range(count)))
+    qps = count / (perf_counter() - start)
+
+    # memória dos segmentos carregados nos query nodes
+    memory = sum(segment.mem_size for segment in utility.get_query_segment_info(collection.name))
+    return dict(
+        recall=round(recall / max(count, 1), 4),
+        p50_ms=percentile(latencies, .5),
+        p95_ms=percentile(latencies, .95),
+        qps=round(qps, 1),
+        memory_mib=round(memory / 2 ** 20, 1)
+    )
+
+
+def run(args: argparse.Namespace) -> Dict:
+    if not db.connections.has_connection("default"):
+        connections.connect(alias="default", host=env.MILVUS_HOST, port=env.MILVUS_PORT)
+    db.using_database(env.MILVUS_DB_NAME)
+
+    ids, namespaces, embeddings = (
+        from_snapshot(args.snapshot, args.sample + args.queries) if args.snapshot
+        else from_collection(args.source, args.sample + args.queries)
+    )
+    if len(ids) <= args.queries:
+        raise SystemExit(f"Not enough vectors: {len(ids)} (need more than --queries {args.queries})")
+    # consultas fora da coleção: nenhuma encontra a si mesma
+    order = list(range(len(ids)))
+    random.Random(args.seed).shuffle(order)
+    held, kept = order[:args.queries], order[args.queries:]
+    queries: Sample = ([ids[i] for i in held], [namespaces[i] for i in held], embeddings[held])
+    base: Sample = ([ids[i] for i in kept], [namespaces[i] for i in kept], embeddings[kept])
+    truth = ground_truth(base, queries, args.k)
+
+    results: Dict[str, Dict] = {}
+    for profile in args.profiles:
+        if utility.has_collection(args.collection):
+            utility.drop_collection(args.collection)
+        try:
+            collection, elapsed = build(args.collection, base, profile)
+            results[profile] = dict(
+                build_s=round(elapsed, 2),
+                **measure(collection, queries, truth, profile, args.k, args.concurrency)
+            )
+        finally:
+            utility.drop_collection(args.collection)
+    return dict(
+        config=dict(
+            source=args.snapshot or args.source, vectors=len(base[0]), queries=len(queries[0]),
+            dim=int(embeddings.shape[1]), namespaces=len(set(base[1])), k=args.k, concurrency=args.concurrency,
+            seed=args.seed
+        ),
+        profiles=results
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=env.MILVUS_COLLECTION_NAME,
+                        help="coleção (ou alias) de onde vêm os vetores")
+    parser.add_argument("--snapshot", help="usa os vetores de um snapshot em SNAPSHOT_DIR no lugar da coleção")
+    parser.add_argument("--sample", type=int, default=20000, help="vetores na coleção descartável")
+    parser.add_argument("--queries", type=int, default=200, help="vetores da amostra usados como consultas")
+    parser.add_argument("--k", type=int, default=3, help="limite da busca (a API usa 3)")
+    parser.add_argument("--concurrency", type=int, default=8, help="threads da medição de QPS")
+    parser.add_argument("--profiles", default=",".join(INDEX_PROFILES), help="perfis comparados")
+    parser.add_argument("--collection", default="learn_index_benchmark", help="coleção descartável")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    args.profiles = [profile.strip() for profile in args.profiles.split(",") if profile.strip()]
+    for profile in args.profiles:
+        milvus_index(profile)
+    print(dumps(run(args), option=OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
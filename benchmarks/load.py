@@ -0,0 +1,391 @@
+"""
+teste de carga offline: sobe o app FastAPI no próprio processo, com OpenAI, ElevenLabs, Milvus, Mongo e o broker
+do Celery trocados por dublês locais determinísticos (benchmarks/fakes.py), e dispara cada rota /api/* e a tarefa
+upsert com concorrência controlada; imprime p50/p95/p99, vazão e o tempo por etapa (serviço externo) em JSON
+
+uso: python -m benchmarks.load [--requests 40] [--concurrency 8] [--scenario asking ...]
+                               [--latency llm=800 --latency embedding=60] [--latency-scale 0]
+                               [--baseline benchmarks/baseline.json [--threshold 0.5] [--save-baseline]]
+com --baseline, termina com código 1 se algum cenário piorar além do limite (p50/p95/p99, vazão ou erros);
+a linha de base depende da máquina: regrave com --save-baseline no ambiente em que a comparação roda
+"""
+import os
+import sys
+import tempfile
+
+# o config lê o ambiente na importação: nada aqui pode apontar para serviços reais
+os.environ.update(
+    LEARN_TOKEN="offline",
+    OPENAI_API_KEY="sk-offline",
+    ELEVENLABS_API_KEY="offline",
+    ASKING_VOICE_ID="offline",
+    QUIZ_VOICE_ID="offline",
+    DEBUG="false",
+    AUDIO_CACHE_DIR=tempfile.mkdtemp(prefix="tts-"),
+)
+
+import argparse
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import Context
+from pathlib import Path
+from time import perf_counter
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import httpx
+from loguru import logger
+from orjson import dumps, loads, OPT_INDENT_2
+
+from config import env
+from models import UpsertTasksDocument
+from benchmarks.fakes import STAGES, Latency, OfflineResources, Services, timings, use_broker, use_tokenizer
+
+Sample = Tuple[float, bool, Dict[str, float]]
+
+SYLLABLES = ["ba", "ce", "di", "lo", "mu", "ra", "si", "to", "ve", "za", "pro", "tra", "ção", "ões", "que", "gu",
+             "ne", "pa", "ri", "so"]
+THEMES = ["redes de computadores", "algoritmos de ordenação", "bancos de dados", "sistemas operacionais",
+          "compiladores", "criptografia"]
+
+
+class Corpus:
+    """
+    textos sintéticos com frequência de palavras tipo Zipf; determinísticos pela semente
+    """
+    def __init__(self, seed: int = 7, words: int = 600):
+        self.rng = random.Random(seed)
+        vocabulary = {"".join(self.rng.choices(SYLLABLES, k=self.rng.randint(1, 4))) for _ in range(words * 2)}
+        self.words = sorted(vocabulary)[:words]
+        self.rng.shuffle(self.words)
+        self.weights = [1 / rank for rank in range(1, len(self.words) + 1)]
+
+    def sentence(self, rng: random.Random) -> str:
+        words = rng.choices(self.words, self.weights, k=rng.randint(6, 18))
+        return " ".join(words).capitalize() + rng.choice([".", ".", ",", "!", "?"])
+
+    def document(self, i: int, sentences: Tuple[int, int] = (8, 30)) -> str:
+        rng = random.Random(f"document:{i}")
+        text = ""
+        for _ in range(rng.randint(*sentences)):
+            text += self.sentence(rng) + rng.choice([" ", " ", " ", "\n", "\n\n"])
+        return text.strip()[:4000]
+
+    def query(self, i: int) -> str:
+        rng = random.Random(f"query:{i}")
+        terms = self.document(rng.randrange(1000)).split()
+        start = rng.randrange(max(1, len(terms) - 4))
+        return " ".join(terms[start:start + rng.randint(2, 5)])[:50]
+
+
+class Bench:
+    """
+    app e worker sobre os mesmos serviços simulados
+    """
+    def __init__(self, latency: Latency, documents: int, seed: int):
+        self.corpus = Corpus(seed)
+        self.documents = documents
+        self.services = Services(latency)
+        self.resources = OfflineResources(self.services)
+        self.scratch: Dict[int, List[str]] = {}
+        self.client: httpx.AsyncClient = None
+
+    async def open(self) -> None:
+        use_tokenizer("\n".join(self.corpus.document(i) for i in range(50)))
+
+        from main import app
+        from provider import jingle
+        from tasks import tasks
+
+        self.services.jingle_frames = jingle.load().frames
+        use_broker(tasks.celery, self.services.latency)
+        app.state.resources = await self.resources.aopen()
+        tasks.resources = OfflineResources(self.services).open()
+        tasks.datastore = None
+        self.client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://offline",
+            headers={"Authorization": f"Bearer {env.LEARN_TOKEN}"},
+            timeout=None
+        )
+        await asyncio.to_thread(self.seed)
+
+    def seed(self) -> None:
+        # base inicial (fora da medição): um namespace de consulta e documentos descartáveis para as remoções
+        from tasks import tasks
+
+        datastore = tasks.get_datastore()
+        datastore.warmup()
+        datastore.upsert_batch([
+            UpsertTasksDocument(content=self.corpus.document(i), username=f"author-{i % 20}", namespace="default")
+            for i in range(self.documents)
+        ])
+        datastore.upsert_batch([
+            UpsertTasksDocument(content=f"descartável {i} " + self.corpus.document(10_000 + i, (1, 3)),
+                                username=f"scratch-{i}", namespace="scratch")
+            for i in range(2000)
+        ])
+        vectors = self.services.databases[env.MONGO_DB_NAME]["vectors"].documents.values()
+        for vec in vectors:
+            if vec.get("created_by", "").startswith("scratch-"):
+                self.scratch.setdefault(int(vec["created_by"].split("-")[1]), []).append(vec["id"])
+
+    async def close(self) -> None:
+        await self.client.aclose()
+        await self.resources.aclose()
+
+    async def ok(self, response: Awaitable[httpx.Response]) -> bool:
+        response = await response
+        return response.status_code == 200 and "event: error" not in response.text
+
+    async def page(self, n: int) -> bool:
+        # mesma página do cenário "vectors", alcançada pelos tokens X-Next-After em vez do skip
+        body, response = {"filter": {"namespace": "default"}, "limit": 20}, None
+        for _ in range(n + 1):
+            response = await self.client.post("/api/vectors", json=body)
+            body["after"] = response.headers.get("x-next-after")
+        return response.status_code == 200
+
+    def scenarios(self) -> Dict[str, Callable[[int], Awaitable[bool]]]:
+        client = self.client
+        scenarios = {
+            f"semantic-search:{mode}": (lambda i, mode=mode: self.ok(client.get(
+                "/api/semantic-search", params=dict(q=self.corpus.query(i % 64), ns="default", mode=mode)
+            ))) for mode in ["vector", "lexical", "hybrid"]
+        }
+        scenarios.update({
+            "asking": lambda i: self.ok(client.post(
+                "/api/asking", json=dict(q=self.corpus.query(i % 64), username=f"user-{i}")
+            )),
+            "asking:stream": lambda i: self.ok(client.post(
+                "/api/asking/stream", json=dict(q=self.corpus.query(1000 + i % 64), username=f"user-{i}")
+            )),
+            "text-to-speech": lambda i: self.ok(client.post(
+                "/api/text-to-speech", json=dict(content=f"{self.corpus.query(i)} {i}")
+            )),
+            "text-to-speech:stream": lambda i: self.ok(client.post(
+                "/api/text-to-speech", json=dict(content=f"{self.corpus.query(5000 + i)} {i}", stream=True)
+            )),
+            "questionnaire": lambda i: self.ok(client.post(
+                "/api/questionnaire", json=dict(theme=THEMES[i % len(THEMES)], amount=100 * (1 + i % 3))
+            )),
+            "upsert": lambda i: self.ok(client.post(
+                "/api/upsert", json=dict(content=self.corpus.document(20_000 + i), username=f"user-{i}")
+            )),
+            "upsert:batch": lambda i: self.ok(client.post(
+                "/api/upsert/batch", json=dict(documents=[
+                    dict(content=self.corpus.document(30_000 + i * 10 + j), username=f"user-{i}")
+                    for j in range(10)
+                ])
+            )),
+            "vectors": lambda i: self.ok(client.post(
+                "/api/vectors", json={"filter": {"namespace": "default"}, "skip": (i % 5) * 20, "limit": 20}
+            )),
+            "vectors:after": lambda i: self.page(i % 5),
+            "vectors:export": lambda i: self.ok(client.post(
+                "/api/vectors/export", json=dict(filter={"namespace": "default"}, gzip=i % 2 == 1)
+            )),
+            "vectors:delete": lambda i: self.ok(client.request(
+                "DELETE", "/api/vectors", json=dict(ids=self.scratch.get(i, []))
+            )),
+            "vectors:delete-usernames": lambda i: self.ok(client.request(
+                "DELETE", "/api/vectors/usernames", json=dict(usernames=[f"scratch-{1000 + i}"])
+            )),
+        })
+        return scenarios
+
+    def task_upsert(self, i: int) -> bool:
+        from tasks import upsert
+
+        result = upsert.apply(args=[dict(
+            content=self.corpus.document(40_000 + i), username=f"user-{i}", namespace="ingest"
+        )])
+        return result.successful() and result.result is True
+
+
+async def sample(call: Callable[[int], Awaitable[bool]], i: int) -> Sample:
+    stages: Dict[str, float] = {}
+    timings.set(stages)
+    start = perf_counter()
+    try:
+        ok = await call(i)
+    except Exception as e:
+        logger.error(e)
+        ok = False
+    return perf_counter() - start, ok, stages
+
+
+def sample_sync(call: Callable[[int], bool], i: int) -> Sample:
+    stages: Dict[str, float] = {}
+    timings.set(stages)
+    start = perf_counter()
+    try:
+        ok = call(i)
+    except Exception as e:
+        logger.error(e)
+        ok = False
+    return perf_counter() - start, ok, stages
+
+
+async def drive(call: Callable[[int], Awaitable[bool]], start: int, requests: int,
+                concurrency: int) -> Tuple[List[Sample], float]:
+    indexes = iter(range(start, start + requests))
+    samples: List[Sample] = []
+
+    async def worker() -> None:
+        for i in indexes:
+            samples.append(await sample(call, i))
+
+    began = perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return samples, perf_counter() - began
+
+
+def drive_threads(call: Callable[[int], bool], start: int, requests: int,
+                  concurrency: int) -> Tuple[List[Sample], float]:
+    # como os processos do worker do Celery: cada thread executa uma tarefa por vez
+    began = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(lambda i: Context().run(sample_sync, call, i), range(start, start + requests)))
+    return samples, perf_counter() - began
+
+
+def percentile(values: List[float], q: float) -> float:
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+
+
+def summarize(samples: List[Sample], elapsed: float) -> Dict:
+    latencies = sorted(latency for latency, _, _ in samples)
+    stages = {}
+    for stage in STAGES + ["app"]:
+        if stage == "app":
+            # o que sobra fora dos serviços externos (etapas em paralelo podem somar mais que o total)
+            values = sorted(max(0.0, latency - sum(spent.values())) for latency, _, spent in samples)
+        else:
+            values = sorted(spent.get(stage, 0.0) for _, _, spent in samples)
+        if any(values):
+            stages[stage] = dict(mean_ms=round(sum(values) / len(values) * 1000, 3), p95_ms=percentile(values, .95))
+    return dict(
+        requests=len(samples),
+        errors=sum(1 for _, ok, _ in samples if not ok),
+        throughput_rps=round(len(samples) / elapsed, 3),
+        p50_ms=percentile(latencies, .5),
+        p95_ms=percentile(latencies, .95),
+        p99_ms=percentile(latencies, .99),
+        max_ms=round(latencies[-1] * 1000, 3),
+        stages=stages
+    )
+
+
+def compare(results: Dict, baseline: Dict, threshold: float, slack: float, gates: List[str]) -> List[str]:
+    """
+    piora além de threshold (relativo) + slack (ms, absorve o ruído de latências muito baixas)
+    :param gates: métricas comparadas
+    :return: descrição de cada regressão
+    """
+    regressions: List[str] = []
+    for name, current in results["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        for metric in [gate for gate in gates if gate.endswith("_ms")]:
+            limit = previous[metric] * (1 + threshold) + slack
+            if current[metric] > limit:
+                regressions.append(f"{name}: {metric} {current[metric]} > {limit:.3f} (baseline {previous[metric]})")
+        limit = previous["throughput_rps"] * (1 - threshold)
+        if "throughput_rps" in gates and current["throughput_rps"] < limit:
+            regressions.append(f"{name}: throughput_rps {current['throughput_rps']} < {limit:.3f} "
+                               f"(baseline {previous['throughput_rps']})")
+        if "errors" in gates and current["errors"] > previous["errors"]:
+            regressions.append(f"{name}: errors {current['errors']} > {previous['errors']}")
+    return regressions
+
+
+def latency(args: argparse.Namespace) -> Latency:
+    values = dict(scale=args.latency_scale, jitter=args.jitter)
+    for item in args.latency:
+        stage, _, ms = item.partition("=")
+        if stage not in Latency.model_fields:
+            raise SystemExit(f"unknown latency stage: {stage} (expected one of {', '.join(Latency.model_fields)})")
+        values[stage] = float(ms)
+    return Latency(**values)
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    bench = Bench(latency(args), documents=args.documents, seed=args.seed)
+    await bench.open()
+    results = dict(
+        config=dict(
+            requests=args.requests,
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            documents=args.documents,
+            seed=args.seed,
+            latency=bench.services.latency.model_dump()
+        ),
+        scenarios={}
+    )
+    try:
+        scenarios = bench.scenarios()
+        names = args.scenario or list(scenarios) + ["task:upsert"]
+        for name in names:
+            if name == "task:upsert":
+                await asyncio.to_thread(drive_threads, bench.task_upsert, 0, args.warmup, args.concurrency)
+                samples, elapsed = await asyncio.to_thread(
+                    drive_threads, bench.task_upsert, args.warmup, args.requests, args.concurrency
+                )
+            elif name in scenarios:
+                await drive(scenarios[name], 0, args.warmup, args.concurrency)
+                samples, elapsed = await drive(scenarios[name], args.warmup, args.requests, args.concurrency)
+            else:
+                raise SystemExit(f"unknown scenario: {name} (expected one of {', '.join(scenarios)}, task:upsert)")
+            results["scenarios"][name] = summarize(samples, elapsed)
+            logger.info(f"{name}: {results['scenarios'][name]['p50_ms']} ms p50")
+    finally:
+        await bench.close()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=40, help="requisições medidas por cenário")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=4, help="requisições descartadas antes da medição")
+    parser.add_argument("--documents", type=int, default=200, help="documentos do namespace de consulta")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--scenario", action="append", help="repetível; padrão: todos")
+    parser.add_argument("--latency", action="append", default=[], metavar="STAGE=MS",
+                        help=f"repetível; etapas: {', '.join(name for name in Latency.model_fields)}")
+    parser.add_argument("--latency-scale", type=float, default=1.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--baseline", help="JSON de uma execução anterior")
+    parser.add_argument("--threshold", type=float, default=.5, help="piora relativa tolerada")
+    parser.add_argument("--slack-ms", type=float, default=10.0, help="piora absoluta tolerada, além do threshold")
+    parser.add_argument("--gate", default="p50_ms,p95_ms,throughput_rps,errors",
+                        help="métricas comparadas com a linha de base (o p99 de poucas requisições é só o máximo)")
+    parser.add_argument("--save-baseline", action="store_true", help="grava o resultado em --baseline")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+
+    results = asyncio.run(run(args))
+    if args.baseline and args.save_baseline:
+        Path(args.baseline).write_bytes(dumps(results, option=OPT_INDENT_2) + b"\n")
+    elif args.baseline:
+        baseline = loads(Path(args.baseline).read_bytes())
+        if baseline["config"] != results["config"]:
+            print(dumps(dict(error="baseline config differs", baseline=baseline["config"],
+                             current=results["config"]), option=OPT_INDENT_2).decode())
+            sys.exit(2)
+        results["regressions"] = compare(
+            results, baseline, args.threshold, args.slack_ms, args.gate.split(",")
+        )
+    print(dumps(results, option=OPT_INDENT_2).decode())
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+micro-benchmark do GenQuiz.mix_audio: concatenação por frames MP3 x decode/re-encode (pydub/ffmpeg)
+
+uso: python -m benchmarks.mix_audio [--speech arquivo.mp3] [--runs 20]
+"""
+import argparse
+import shutil
+import tempfile
+from pathlib import Path
+from statistics import median
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from orjson import dumps, OPT_INDENT_2
+from pydub import AudioSegment
+
+from provider.mp3 import Jingle, concat, parse
+
+
+def reencode(jingle: Jingle, absolute_path: str) -> None:
+    comb_sound = jingle.load().segment + AudioSegment.from_file(absolute_path)
+    comb_sound.export(absolute_path, format="mp3")
+
+
+def measure(mix: Callable[[str], object], speech: Path, runs: int) -> Dict:
+    timings: List[float] = []
+    with tempfile.TemporaryDirectory() as directory:
+        for i in range(runs):
+            target = Path(directory) / f"{i}.mp3"
+            shutil.copyfile(speech, target)
+            start = perf_counter()
+            mix(str(target))
+            timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    return dict(
+        runs=runs,
+        p50_ms=round(median(timings), 3),
+        p95_ms=round(timings[min(len(timings) - 1, int(len(timings) * .95))], 3),
+        max_ms=round(timings[-1], 3)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jingle", default="audios/quiz.mp3")
+    parser.add_argument("--speech", help="MP3 da fala; por padrão, 10 s gerados a partir dos frames da vinheta")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    jingle = Jingle(args.jingle)
+    with tempfile.NamedTemporaryFile(suffix=".mp3", delete=False) as file:
+        if args.speech:
+            file.write(Path(args.speech).read_bytes())
+        else:
+            params, frames = parse(Path(args.jingle).read_bytes())
+            seconds = len(frames) * 8 / (params.bitrate * 1000)
+            file.write(frames * max(1, int(10 / seconds)))
+    speech = Path(file.name)
+
+    results = {}
+    try:
+        jingle.load()
+        results["frames"] = measure(lambda path: concat(jingle, path) or reencode(jingle, path), speech, args.runs)
+        results["reencode"] = measure(lambda path: reencode(jingle, path), speech, args.runs)
+        results["speedup"] = round(results["reencode"]["p50_ms"] / max(results["frames"]["p50_ms"], 1e-6), 1)
+    finally:
+        speech.unlink()
+    print(dumps(results, option=OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+latência das consultas que a API e o worker fazem à coleção vectors conforme ela cresce, sem índices e com os
+índices declarados em databases/indexes.py; precisa de um Mongo de verdade (MONGO_DSN) e usa um banco descartável,
+removido ao final
+
+uso: python -m benchmarks.mongo_indexes [--sizes 1000,10000,100000] [--queries 50] [--database learn_benchmark]
+imprime, por tamanho da coleção e consulta, p50/p95 (ms) e documentos examinados (explain) nos dois modos, em JSON
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+from hashlib import md5
+from time import perf_counter
+from typing import Callable, Dict, List
+
+from orjson import dumps, OPT_INDENT_2
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+
+from config import env
+from databases import INDEXES
+
+START = datetime(2024, 1, 1)
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+
+
+class Dataset:
+    """
+    documentos no formato do VectorFactory.upsert, com namespaces e autores em frequência tipo Zipf
+    """
+    def __init__(self, seed: int, namespaces: int = 50, users: int = 2000):
+        self.rng = random.Random(seed)
+        self.namespaces = [f"ns-{i}" for i in range(namespaces)]
+        self.users = [f"user-{i}" for i in range(users)]
+        self.size = 0
+
+    def zipf(self, values: List[str]) -> str:
+        return values[min(int(self.rng.paretovariate(1.1)) - 1, len(values) - 1)]
+
+    def document(self, i: int) -> Dict:
+        return dict(
+            uuid=md5(f"uuid:{i}".encode()).hexdigest(),
+            id=md5(f"chunk:{i}".encode()).hexdigest(),
+            content=" ".join(md5(f"{i}:{j}".encode()).hexdigest()[:8] for j in range(30)),
+            created_by=self.zipf(self.users),
+            namespace=self.zipf(self.namespaces),
+            created_at=START + timedelta(seconds=i)
+        )
+
+    def grow(self, collection: Collection, size: int, batch: int = 5000) -> None:
+        while self.size < size:
+            count = min(batch, size - self.size)
+            collection.insert_many([self.document(i) for i in range(self.size, self.size + count)], ordered=False)
+            self.size += count
+
+
+def queries(collection: Collection, dataset: Dataset, rng: random.Random) -> Dict[str, Callable[[], Cursor]]:
+    def some_ids(k: int) -> List[str]:
+        return [md5(f"chunk:{rng.randrange(dataset.size)}".encode()).hexdigest() for _ in range(k)]
+
+    # namespace e autores de frequência média: nem a coleção inteira, nem um punhado de documentos
+    namespace = lambda: dataset.namespaces[rng.randrange(5, 15)]
+    user = lambda: dataset.users[rng.randrange(5, 50)]
+    return {
+        # /api/vectors (VectorFactory.afind_all): filtro, ordem decrescente de _id, limite 100
+        "vectors:namespace": lambda: collection.find({"namespace": namespace()}).sort({"_id": -1}).limit(100),
+        "vectors:username": lambda: collection.find({"created_by": user()}).sort({"_id": -1}).limit(100),
+        # upsert do worker (UpdateOne por id) e remoção por ids (AsyncMongo.delete)
+        "upsert:id": lambda: collection.find({"id": some_ids(1)[0]}).limit(1),
+        "delete:ids": lambda: collection.find({"id": {"$in": some_ids(100)}}),
+        # páginas do job de remoção (Mongo.pages)
+        "deletion:username": lambda: collection.find(
+            {"created_by": {"$in": [user()]}}, {"_id": 1, "id": 1, "namespace": 1}
+        ).sort({"_id": 1}).limit(1000),
+        "deletion:created_at": lambda: collection.find(
+            {"created_at": {"$gte": START + timedelta(seconds=int(dataset.size * .99))}},
+            {"_id": 1, "id": 1, "namespace": 1}
+        ).sort({"_id": 1}).limit(1000),
+        # carga do índice lexical (LexicalIndex.load)
+        "lexical:namespace": lambda: collection.find({"namespace": namespace()}, {"_id": 0, "id": 1, "content": 1}),
+    }
+
+
+def measure(query: Callable[[], Cursor], count: int) -> Dict:
+    latencies: List[float] = []
+    for _ in range(count):
+        start = perf_counter()
+        list(query())
+        latencies.append(perf_counter() - start)
+    stats = query().explain()["executionStats"]
+    return dict(
+        p50_ms=percentile(latencies, .5),
+        p95_ms=percentile(latencies, .95),
+        docs_examined=stats["totalDocsExamined"],
+        keys_examined=stats["totalKeysExamined"]
+    )
+
+
+def run(args: argparse.Namespace) -> Dict:
+    client = MongoClient(env.MONGO_DSN)
+    client.drop_database(args.database)
+    collection = client[args.database]["vectors"]
+    dataset = Dataset(args.seed)
+    results: Dict[str, Dict] = {}
+    try:
+        for size in args.sizes:
+            collection.drop_indexes()
+            dataset.grow(collection, size)
+            result: Dict[str, Dict] = {}
+            for mode in ["scan", "indexed"]:
+                if mode == "indexed":
+                    collection.create_indexes(INDEXES["vectors"])
+                # mesma sequência de parâmetros nos dois modos
+                for name, query in queries(collection, dataset, random.Random(args.seed)).items():
+                    measure(query, 2)
+                    result.setdefault(name, {})[mode] = measure(query, args.queries)
+            for name, modes in result.items():
+                modes["speedup_p50"] = round(modes["scan"]["p50_ms"] / max(modes["indexed"]["p50_ms"], 1e-3), 1)
+            results[str(size)] = result
+    finally:
+        client.drop_database(args.database)
+        client.close()
+    return dict(config=dict(sizes=args.sizes, queries=args.queries, seed=args.seed), sizes=results)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,100000", help="tamanhos da coleção, crescentes")
+    parser.add_argument("--queries", type=int, default=50, help="execuções medidas por consulta")
+    parser.add_argument("--database", default="learn_benchmark", help="banco descartável (apagado no início e no fim)")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    args.sizes = sorted(int(size) for size in args.sizes.split(","))
+    print(dumps(run(args), option=OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+layout da coleção com muitos namespaces: um só conjunto de partições filtrado por expressão (ns == "...") x ns como
+partition key (MILVUS_NAMESPACE_PARTITIONS); precisa de um Milvus de verdade e usa uma coleção descartável, removida
+ao final
+
+uso: python -m benchmarks.partitions [--synthetic] [--sample 50000] [--namespaces 200] [--queries 400] [--k 3]
+                                     [--partitions 64] [--profile ivf_flat] [--source COLEÇÃO | --snapshot NOME]
+os vetores vêm da coleção em uso (ou de um snapshot); com --synthetic, de clusters gaussianos distribuídos entre
+--namespaces namespaces com tamanhos tipo Zipf. as consultas sorteiam primeiro o namespace e depois um vetor dele
+(deixado de fora da coleção), e os resultados saem separados entre namespaces pequenos e grandes: recall@k contra a
+busca exata, p50/p95 (ms), QPS e memória, em JSON
+"""
+import argparse
+import random
+from typing import Dict, List
+
+import numpy as np
+from orjson import dumps, OPT_INDENT_2
+from pymilvus import connections, db, utility
+
+from config import env
+from schemas import milvus_index
+from .index_profiles import Sample, build, from_collection, from_snapshot, ground_truth, measure
+
+
+def synthetic(size: int, namespaces: int, dim: int, seed: int) -> Sample:
+    """
+    vetores em clusters (alguns por namespace), com namespaces de tamanho tipo Zipf
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    weights = 1 / np.arange(1, namespaces + 1) ** 1.1
+    sizes = np.maximum(1, np.round(weights / weights.sum() * size)).astype(int)
+    ids: List[str] = []
+    names: List[str] = []
+    blocks: List[np.ndarray] = []
+    for i, count in enumerate(sizes):
+        centers = rng.normal(size=(4, dim)).astype(np.float32)
+        block = centers[rng.integers(0, 4, count)] + rng.normal(scale=.6, size=(count, dim)).astype(np.float32)
+        blocks.append(block)
+        names.extend([f"ns-{i}"] * count)
+        ids.extend(f"{i:08x}{row:024x}" for row in range(count))
+    return ids, names, np.concatenate(blocks)
+
+
+def split(sample: Sample, queries: int, seed: int) -> Dict[str, Sample]:
+    """
+    consultas sorteadas por namespace (não por vetor), para os pequenos também serem medidos;
+    separa a coleção (base) e as consultas dos namespaces pequenos e grandes (metade menor e maior dos namespaces)
+    :return:
+    """
+    ids, namespaces, embeddings = sample
+    rows: Dict[str, List[int]] = {}
+    for row, namespace in enumerate(namespaces):
+        rows.setdefault(namespace, []).append(row)
+    # ao menos um vetor fica na coleção
+    candidates = sorted((namespace for namespace in rows if len(rows[namespace]) > 1), key=lambda ns: len(rows[ns]))
+    small = set(candidates[:len(candidates) // 2])
+    rng = random.Random(seed)
+    held: List[int] = []
+    for _ in range(queries):
+        namespace = rng.choice(candidates)
+        if len(rows[namespace]) > 1:
+            held.append(rows[namespace].pop(rng.randrange(len(rows[namespace]))))
+    kept = sorted(row for namespace_rows in rows.values() for row in namespace_rows)
+
+    def subset(selected: List[int]) -> Sample:
+        return [ids[i] for i in selected], [namespaces[i] for i in selected], embeddings[selected]
+
+    return dict(
+        base=subset(kept),
+        small=subset([row for row in held if namespaces[row] in small]),
+        large=subset([row for row in held if namespaces[row] not in small])
+    )
+
+
+def run(args: argparse.Namespace) -> Dict:
+    if not db.connections.has_connection("default"):
+        connections.connect(alias="default", host=env.MILVUS_HOST, port=env.MILVUS_PORT)
+    db.using_database(env.MILVUS_DB_NAME)
+
+    if args.synthetic:
+        sample = synthetic(args.sample + args.queries, args.namespaces, args.dim, args.seed)
+    elif args.snapshot:
+        sample = from_snapshot(args.snapshot, args.sample + args.queries)
+    else:
+        sample = from_collection(args.source, args.sample + args.queries)
+    sets = split(sample, args.queries, args.seed)
+    base = sets["base"]
+    truth = {group: ground_truth(base, sets[group], args.k) for group in ["small", "large"]}
+
+    layouts = {"expression": 0, "partition_key": args.partitions}
+    results: Dict[str, Dict] = {}
+    for layout, partitions in layouts.items():
+        if utility.has_collection(args.collection):
+            utility.drop_collection(args.collection)
+        try:
+            collection, elapsed = build(args.collection, base, args.profile, partitions)
+            results[layout] = dict(partitions=partitions, build_s=round(elapsed, 2), **{
+                group: measure(collection, sets[group], truth[group], args.profile, args.k, args.concurrency)
+                for group in ["small", "large"] if sets[group][0]
+            })
+        finally:
+            utility.drop_collection(args.collection)
+    speedup = {
+        group: round(results["expression"][group]["p50_ms"] / max(results["partition_key"][group]["p50_ms"], 1e-3), 2)
+        for group in ["small", "large"] if group in results["expression"]
+    }
+
+    sizes = np.unique(base[1], return_counts=True)[1]
+    return dict(
+        config=dict(
+            source="synthetic" if args.synthetic else args.snapshot or args.source, vectors=len(base[0]),
+            dim=int(base[2].shape[1]), namespaces=len(sizes), largest_namespace=int(sizes.max()),
+            median_namespace=int(np.median(sizes)), queries=dict(small=len(sets["small"][0]),
+                                                                 large=len(sets["large"][0])),
+            profile=args.profile, k=args.k, concurrency=args.concurrency, seed=args.seed
+        ),
+        layouts=results,
+        speedup_p50=speedup
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=env.MILVUS_COLLECTION_NAME,
+                        help="coleção (ou alias) de onde vêm os vetores")
+    parser.add_argument("--snapshot", help="usa os vetores de um snapshot em SNAPSHOT_DIR no lugar da coleção")
+    parser.add_argument("--synthetic", action="store_true", help="gera os vetores e os namespaces")
+    parser.add_argument("--namespaces", type=int, default=200, help="namespaces do --synthetic")
+    parser.add_argument("--dim", type=int, default=1536, help="dimensão do --synthetic")
+    parser.add_argument("--sample", type=int, default=50000, help="vetores na coleção descartável")
+    parser.add_argument("--queries", type=int, default=400, help="vetores da amostra usados como consultas")
+    parser.add_argument("--k", type=int, default=3, help="limite da busca (a API usa 3)")
+    parser.add_argument("--partitions", type=int, default=max(1, env.MILVUS_NAMESPACE_PARTITIONS),
+                        help="partições do layout com partition key")
+    parser.add_argument("--profile", default=env.MILVUS_INDEX_PROFILE, help="perfil de índice dos dois layouts")
+    parser.add_argument("--concurrency", type=int, default=8, help="threads da medição de QPS")
+    parser.add_argument("--collection", default="learn_partition_benchmark", help="coleção descartável")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    milvus_index(args.profile)
+    print(dumps(run(args), option=OPT_INDENT_2).decode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+benchmark de recuperação: recall@k, MRR e latência de vector x lexical x hybrid (serviços reais: Milvus, Mongo, OpenAI)
+
+uso: python -m benchmarks.retrieval --ns default [--dataset queries.jsonl] [--sample 200] [--k 3]
+dataset: uma linha JSON por consulta, {"q": "...", "relevant": ["<id do chunk>", ...]};
+sem dataset, sorteia chunks do namespace e usa um trecho curto de cada um como consulta (o próprio chunk é o relevante)
+"""
+import argparse
+import asyncio
+import random
+from statistics import median
+from time import perf_counter
+from typing import Dict, List
+
+from orjson import dumps, loads, OPT_INDENT_2
+
+from databases import AsyncMongo
+from resources import Resources
+
+MODES = ["vector", "lexical", "hybrid"]
+
+
+async def sample(resources: Resources, namespace: str, size: int, words: int, seed: int) -> List[Dict]:
+    vectors = AsyncMongo("vectors", client=resources.motor)
+    docs = await vectors.find({"namespace": namespace}, {"_id": 0, "id": 1, "content": 1})
+    rng = random.Random(seed)
+    queries = []
+    for doc in rng.sample(docs, min(size, len(docs))):
+        terms = (doc.get("content") or "").split()
+        if not terms:
+            continue
+        start = rng.randrange(max(1, len(terms) - words + 1))
+        # a rota /api/semantic-search limita a consulta a 50 caracteres
+        queries.append(dict(q=" ".join(terms[start:start + words])[:50], relevant=[doc["id"]]))
+    return queries
+
+
+async def evaluate(resources: Resources, queries: List[Dict], namespace: str, k: int, mode: str) -> Dict:
+    timings: List[float] = []
+    recall = 0.0
+    reciprocal = 0.0
+    for query in queries:
+        start = perf_counter()
+        results = await resources.milvus.asearch(query=query["q"], k=k, ns=namespace, mode=mode)
+        timings.append((perf_counter() - start) * 1000)
+        ids = [result.id for result in results]
+        relevant = set(query["relevant"])
+        recall += len(relevant.intersection(ids)) / len(relevant)
+        reciprocal += next((1 / rank for rank, id in enumerate(ids, start=1) if id in relevant), 0.0)
+    timings.sort()
+    return dict(
+        recall=round(recall / len(queries), 4),
+        mrr=round(reciprocal / len(queries), 4),
+        p50_ms=round(median(timings), 3),
+        p95_ms=round(timings[min(len(timings) - 1, int(len(timings) * .95))], 3)
+    )
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--ns", default="default")
+    parser.add_argument("--dataset")
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--words", type=int, default=4)
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    resources = await Resources().aopen()
+    try:
+        if args.dataset:
+            with open(args.dataset, "rb") as file:
+                queries = [loads(line) for line in file if line.strip()]
+        else:
+            queries = await sample(resources, args.ns, args.sample, args.words, args.seed)
+        if not queries:
+            raise SystemExit(f"No queries for namespace {args.ns}")
+
+        # aquece o índice lexical e o cache de embeddings: mede só a recuperação, igual para os três modos
+        await resources.milvus.asearch(query=queries[0]["q"], k=args.k, ns=args.ns, mode="lexical")
+        for query in queries:
+            await resources.milvus.aembedding(query["q"])
+        results = {mode: await evaluate(resources, queries, args.ns, args.k, mode) for mode in MODES}
+        print(dumps(dict(namespace=args.ns, queries=len(queries), k=args.k, modes=results),
+                    option=OPT_INDENT_2).decode())
+    finally:
+        await resources.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
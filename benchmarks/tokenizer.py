@@ -0,0 +1,46 @@
+"""
+tokenizer tiktoken sem rede: o BPE da OpenAI é baixado no primeiro uso; sem ele, treina um BPE pequeno no corpus
+com o mesmo padrão de pré-tokens do cl100k (usado pelos benchmarks offline e pelos testes do chunker)
+"""
+from collections import Counter
+from typing import List
+
+import regex
+import tiktoken
+
+CL100K_PATTERN = r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+
+
+def train(corpus: str, merges: int = 400) -> tiktoken.Encoding:
+    ranks = {bytes([i]): i for i in range(256)}
+    words = Counter(match.group().encode() for match in regex.finditer(CL100K_PATTERN, corpus))
+    pieces = {word: [bytes([b]) for b in word] for word in words}
+    for _ in range(merges):
+        pairs = Counter()
+        for word, parts in pieces.items():
+            for pair in zip(parts, parts[1:]):
+                pairs[pair] += words[word]
+        if not pairs:
+            break
+        (a, b), _ = pairs.most_common(1)[0]
+        ranks[a + b] = len(ranks)
+        for word, parts in pieces.items():
+            merged: List[bytes] = []
+            for part in parts:
+                if merged and merged[-1] == a and part == b:
+                    merged[-1] = a + b
+                else:
+                    merged.append(part)
+            pieces[word] = merged
+    return tiktoken.Encoding(name="offline", pat_str=CL100K_PATTERN, mergeable_ranks=ranks, special_tokens={})
+
+
+def encoding(corpus: str, merges: int = 400, model: str = None) -> tiktoken.Encoding:
+    """
+    encoding do modelo (cl100k_base sem model); sem acesso ao BPE da OpenAI, um BPE treinado no corpus
+    :return: o encoding treinado tem name "offline"
+    """
+    try:
+        return tiktoken.get_encoding("cl100k_base") if model is None else tiktoken.encoding_for_model(model)
+    except Exception:
+        return train(corpus, merges)
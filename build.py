@@ -3,7 +3,7 @@ from pymilvus import db, connections, Collection, utility
 from dotenv import load_dotenv
 from os import getenv
 
-from schemas.milvus_schema import Schema
+from schemas.milvus_schema import schema, index, partitioning, describe
 
 load_dotenv()
 
@@ -12,6 +12,8 @@ MILVUS_DB_NAME = getenv("MILVUS_DB_NAME")
 MILVUS_COLLECTION_NAME = getenv("MILVUS_COLLECTION_NAME")
 MILVUS_HOST = getenv("MILVUS_HOST")
 MILVUS_PORT = int(getenv("MILVUS_PORT"))
+MILVUS_INDEX_PROFILE = getenv("MILVUS_INDEX_PROFILE", "ivf_flat")
+MILVUS_NAMESPACE_PARTITIONS = int(getenv("MILVUS_NAMESPACE_PARTITIONS", 64))
 
 if not isinstance(MILVUS_HOST, str):
     raise ValueError("MILVUS_HOST is not defined in .env")
@@ -32,19 +34,48 @@ print(f"List databases: {db.list_database()}")
 
 db.using_database("knowledge")
 
-collection = Collection(name=MILVUS_COLLECTION_NAME, schema=Schema)
-collection.create_index(field_name="embedding", index_params={
-    'metric_type': 'COSINE',
-    'index_type': "IVF_FLAT",
-    'params': {"nlist": 128}
-})
+created = not utility.has_collection(MILVUS_COLLECTION_NAME)
+if created:
+    # namespace como partition key: as buscas e remoções por ns só visitam a partição dele
+    collection = Collection(name=MILVUS_COLLECTION_NAME,
+                            schema=schema(partitioned=MILVUS_NAMESPACE_PARTITIONS > 0),
+                            **partitioning(MILVUS_NAMESPACE_PARTITIONS))
+else:
+    # depois de uma migração o nome é um alias de uma coleção com outra dimensão ou layout: abre com o schema dela
+    collection = Collection(MILVUS_COLLECTION_NAME)
+    partitions = describe(collection.describe())["partitions"]
+    if partitions != MILVUS_NAMESPACE_PARTITIONS:
+        print(f"{MILVUS_COLLECTION_NAME} has {partitions} namespace partitions (MILVUS_NAMESPACE_PARTITIONS="
+              f"{MILVUS_NAMESPACE_PARTITIONS}); move it with POST /api/migrations")
 
-if not utility.has_collection(MILVUS_COLLECTION_NAME):
+# troca de perfil (MILVUS_INDEX_PROFILE): o índice antigo é removido e reconstruído
+Index = index(MILVUS_INDEX_PROFILE)
+if collection.has_index():
+    current = collection.index().params
+    if current.get("index_type") != Index["index_type"] or \
+            {k: str(v) for k, v in (current.get("params") or {}).items()} != \
+            {k: str(v) for k, v in Index["params"].items()}:
+        print(f"Rebuilding {current.get('index_type')} index as {MILVUS_INDEX_PROFILE}...")
+        collection.release()
+        collection.drop_index()
+        collection.create_index(field_name="embedding", index_params=Index)
+else:
+    collection.create_index(field_name="embedding", index_params=Index)
+
+if created:
     utility.index_building_progress(MILVUS_COLLECTION_NAME)
     print("Milvus databases created successfully!")
 
 print("Milvus is already built.")
 
+from databases import mongo_client, provision, deduplicate
+
+# bases anteriores ao índice único em vectors.id: remove os chunks duplicados antes de criá-lo
+deduplicate(mongo_client(), "vectors", "id")
+# índices do Mongo (os mesmos criados na subida da API)
+provision(mongo_client())
+print("Mongo indexes created successfully!")
+
 from loguru import logger
 try:
     import provider
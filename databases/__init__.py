@@ -1 +1,3 @@
-from .mongodb import Mongo, AsyncMongo
\ No newline at end of file
+from .mongodb import Mongo, AsyncMongo, mongo_client, motor_client, close_clients
+from .indexes import INDEXES, provision, aprovision, deduplicate
+from .pagination import InvalidPageToken
@@ -0,0 +1,101 @@
+from typing import Dict, List
+
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, IndexModel, MongoClient
+from pymongo.errors import OperationFailure
+
+from config import env
+
+# índices de cada coleção, pelos padrões de acesso da API e do worker
+INDEXES: Dict[str, List[IndexModel]] = {
+    "vectors": [
+        # upsert do worker (um documento por id de chunk) e remoção por ids; único para upserts simultâneos
+        # do mesmo chunk não duplicarem o documento (bases antigas: deduplicate antes, no build.py)
+        IndexModel([("id", ASCENDING)], unique=True),
+        # /api/vectors e índice lexical por namespace (ordenados por _id); remoção de um namespace em páginas
+        IndexModel([("namespace", ASCENDING), ("_id", ASCENDING)]),
+        # /api/vectors e remoção por usuário
+        IndexModel([("created_by", ASCENDING), ("_id", ASCENDING)]),
+        # remoção por intervalo de criação
+        IndexModel([("created_at", ASCENDING)]),
+    ],
+    "namespace_events": [
+        IndexModel([("namespace", ASCENDING), ("version", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=env.NAMESPACE_EVENTS_TTL),
+    ],
+    "embeddings": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "quizzes": [
+        # pop do mais antigo da versão atual do namespace
+        IndexModel([("namespace", ASCENDING), ("theme", ASCENDING), ("amount", ASCENDING), ("version", ASCENDING),
+                    ("created_at", ASCENDING)]),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=env.QUIZ_POOL_TTL),
+    ],
+    "quizzes_demand": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=env.QUIZ_POOL_DEMAND_WINDOW),
+    ],
+    "quizzes_locks": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+}
+
+
+# índice existente com o mesmo nome ou chave e outras opções
+INDEX_CONFLICTS = {85, 86}
+
+
+def provision(client: MongoClient, collections: List[str] = None) -> None:
+    """
+    cria os índices declarados em INDEXES (idempotente: índices existentes são mantidos);
+    um conflito com um índice antigo é registrado sem impedir os das demais coleções
+    :param collections: padrão todas
+    :return:
+    """
+    for collection in INDEXES.keys() if collections is None else collections:
+        try:
+            names = client[env.MONGO_DB_NAME][collection].create_indexes(INDEXES[collection])
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICTS:
+                raise
+            logger.error(f"Indexes of {collection} conflict with existing ones (run build.py): {e}")
+            continue
+        logger.debug(f"Indexes of {collection}: {names}")
+
+
+async def aprovision(client: AsyncIOMotorClient, collections: List[str] = None) -> None:
+    for collection in INDEXES.keys() if collections is None else collections:
+        try:
+            names = await client[env.MONGO_DB_NAME][collection].create_indexes(INDEXES[collection])
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICTS:
+                raise
+            logger.error(f"Indexes of {collection} conflict with existing ones (run build.py): {e}")
+            continue
+        logger.debug(f"Indexes of {collection}: {names}")
+
+
+def deduplicate(client: MongoClient, collection: str, key: str) -> int:
+    """
+    migração pontual para um índice único em key numa coleção que já existia sem ele: remove os documentos
+    repetidos, mantendo o de menor _id (o que o UpdateOne por key atualizava), e o índice antigo não único;
+    não faz nada quando o índice único já existe
+    :return: documentos removidos
+    """
+    target = client[env.MONGO_DB_NAME][collection]
+    indexes = target.index_information()
+    existing = [name for name, spec in indexes.items() if spec["key"] == [(key, ASCENDING)]]
+    if any(indexes[name].get("unique") for name in existing):
+        return 0
+
+    removed = 0
+    for group in target.aggregate([
+        {"$group": {"_id": f"${key}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True):
+        removed += target.delete_many({"_id": {"$in": sorted(group["ids"])[1:]}}).deleted_count
+    for name in existing:
+        target.drop_index(name)
+    logger.info(f"Duplicated {key} removed from {collection}: {removed} documents.")
+    return removed
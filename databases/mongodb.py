@@ -1,23 +1,123 @@
-from typing import List, Dict, Union
+import os
+from threading import Lock
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Dict, Tuple, Union
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorCollection
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne, monitoring
+from pymongo.results import BulkWriteResult
 from pymongo.collection import Collection
 
 from config import env
+from metrics import MongoCommandMetrics
+from tracing import MongoCommandSpans
+from . import pagination
+
+# duração de cada comando na etapa mongo das métricas (e o span dele no trace atual);
+# vale para os clientes criados daqui em diante
+monitoring.register(MongoCommandMetrics())
+monitoring.register(MongoCommandSpans())
+
+# um cliente (e um pool de conexões) de cada tipo por processo
+clients: Dict[type, Union[MongoClient, AsyncIOMotorClient]] = {}
+owner: int = os.getpid()
+lock = Lock()
+
+
+def shared(cls: type) -> Union[MongoClient, AsyncIOMotorClient]:
+    global owner
+    with lock:
+        if owner != os.getpid():
+            # processo filho (fork do pool do worker): as conexões do pai não podem ser reaproveitadas
+            clients.clear()
+            owner = os.getpid()
+        client = clients.get(cls)
+        if client is None:
+            client = clients[cls] = cls(
+                env.MONGO_DSN,
+                maxPoolSize=env.MONGO_MAX_POOL_SIZE,
+                minPoolSize=env.MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=env.MONGO_MAX_IDLE_TIME_MS,
+                serverSelectionTimeoutMS=env.MONGO_SERVER_SELECTION_TIMEOUT_MS
+            )
+    return client
+
+
+def mongo_client() -> MongoClient:
+    return shared(MongoClient)
+
+
+def motor_client() -> AsyncIOMotorClient:
+    return shared(AsyncIOMotorClient)
+
+
+def close_clients() -> None:
+    with lock:
+        for client in clients.values():
+            client.close()
+        clients.clear()
+
 
 class Mongo:
-    def __init__(self, collection: str):
-        self.client = MongoClient(env.MONGO_DSN)
+    def __init__(self, collection: str, client: MongoClient = None):
+        self.client = mongo_client() if client is None else client
         self.collection: Collection = self.client[env.MONGO_DB_NAME][collection]
 
     def insert(self, documents: List[dict]) -> None:
-        with self.client.start_session() as s:
-            self.collection.insert_many(documents, session=s)
+        self.collection.insert_many(documents)
+
+    def insert_one(self, document: dict) -> None:
+        self.collection.insert_one(document)
+
+    def count(self, filter: dict = None) -> int:
+        return self.collection.count_documents({} if filter is None else filter)
+
+    def find(self, filter: dict = None, projection: dict = None) -> List[Dict]:
+        return list(self.collection.find({} if filter is None else filter, projection))
+
+    def increment(self, filter: dict, field: str, value: int = 1) -> int:
+        doc = self.collection.find_one_and_update(
+            filter, {"$inc": {field: value}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc[field]
+
+    def delete_one(self, filter: dict) -> None:
+        self.collection.delete_one(filter)
+
+    def delete_many(self, filter: dict) -> int:
+        return self.collection.delete_many(filter).deleted_count
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False) -> None:
+        self.collection.update_one(filter, update, upsert=upsert)
+
+    def pages(self, filter: dict = None, projection: dict = None, size: int = 1000,
+              after: Any = None) -> Iterator[List[Dict]]:
+        """
+        percorre os documentos do filtro em páginas pelo _id (keyset): sem skip, e estável
+        mesmo com os documentos das páginas anteriores sendo removidos
+        :param after: começa depois deste _id (checkpoint de um job retomado)
+        :return:
+        """
+        filter = {} if filter is None else filter
+        last = after
+        while True:
+            query = filter if last is None else {**filter, "_id": {"$gt": last}}
+            page = list(self.collection.find(query, projection).sort({"_id": 1}).limit(size))
+            if not page:
+                return
+            yield page
+            last = page[-1]["_id"]
+
+    def bulk_write(self, operations: List[UpdateOne]) -> Union[BulkWriteResult, None]:
+        if not operations:
+            return None
+        return self.collection.bulk_write(operations, ordered=False)
+
+    def create_index(self, keys: List[tuple], **kwargs) -> str:
+        return self.collection.create_index(keys, **kwargs)
 
 
 class AsyncMongo:
-    def __init__(self, collection: str):
-        self.client = AsyncIOMotorClient(env.MONGO_DSN)
+    def __init__(self, collection: str, client: AsyncIOMotorClient = None):
+        self.client = motor_client() if client is None else client
         self.collection: AsyncIOMotorCollection = self.client[env.MONGO_DB_NAME][collection]
 
     async def all(self, filter: dict = None, sort: dict = None, skip: int = 0, limit: int = 100) -> List[Dict]:
@@ -26,39 +126,87 @@ class AsyncMongo:
         if sort is None:
             sort = {"_id": -1}
         result: List[dict] = []
-        async with await self.client.start_session() as s:
-            async for doc in self.collection.find(filter, session=s).sort(
-                sort
-            ).skip(skip).limit(limit):
-                result.append(doc)
+        async for doc in self.collection.find(filter).sort(
+            sort
+        ).skip(skip).limit(limit):
+            result.append(doc)
         return result
 
+    async def page(self, filter: dict = None, sort: dict = None, after: str = None, skip: int = 0,
+                   limit: int = 100, keyset: Iterable[str] = ("_id",)) -> Tuple[List[Dict], Union[str, None]]:
+        """
+        uma página do filtro e o token da próxima; com after (token da página anterior) a consulta continua
+        do último documento pelo índice, sem o custo O(skip) no servidor
+        :param keyset: chaves de ordenação que aceitam cursor (ver pagination.keyset)
+        :return: documentos e token (None na última página ou quando a ordenação não aceita cursor)
+        """
+        filter = {} if filter is None else filter
+        keys = pagination.keyset(sort, keyset)
+        if keys is None:
+            if after is not None:
+                raise pagination.InvalidPageToken(
+                    f"Cursor pagination requires sorting by a single key among: {', '.join(keyset)}"
+                )
+            return await self.all(filter, sort, skip, limit), None
+
+        if after is not None:
+            filter, skip = pagination.after(filter, keys, pagination.decode(keys, after)), 0
+        docs = await self.collection.find(filter).sort(keys).skip(skip).limit(limit).to_list(limit)
+        return docs, pagination.encode(keys, docs[-1]) if docs and len(docs) == limit else None
+
+    async def iterate(self, filter: dict = None, projection: dict = None, sort: dict = None) -> AsyncIterator[Dict]:
+        # documento a documento, direto do cursor (lotes do servidor), sem montar a lista
+        async for doc in self.collection.find({} if filter is None else filter, projection).sort(
+            {"_id": 1} if sort is None else sort
+        ):
+            yield doc
+
+    async def find(self, filter: dict = None, projection: dict = None) -> List[Dict]:
+        return await self.collection.find({} if filter is None else filter, projection).to_list(None)
+
+    async def count(self, filter: dict = None) -> int:
+        return await self.collection.count_documents({} if filter is None else filter)
+
+    async def increment(self, filter: dict, field: str, value: int = 1, on_insert: dict = None) -> int:
+        update = {"$inc": {field: value}} if on_insert is None else {"$inc": {field: value}, "$setOnInsert": on_insert}
+        doc = await self.collection.find_one_and_update(
+            filter, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc[field]
+
     async def select(self, filter: dict = None) -> Union[Dict, None]:
         if filter is None:
             filter = {}
-        async with await self.client.start_session() as s:
-            return await self.collection.find_one(filter, session=s)
+        return await self.collection.find_one(filter)
 
     async def insert(self, documents: List[dict]) -> None:
-        async with await self.client.start_session() as s:
-            await self.collection.insert_many(documents, session=s)
+        await self.collection.insert_many(documents)
 
     async def update(self, documents: List[dict], filter: dict = None) -> None:
         if filter is None:
             filter = {}
-        async with await self.client.start_session() as s:
-            await self.collection.update_many(
-                filter, update=[{"$set": doc} for doc in documents], upsert=True, session=s)
-
-    async def delete(self, ids: List[str]) -> None:
-        async with await self.client.start_session() as s:
-            async with s.start_transaction():
-                for id in ids:
-                    await self.collection.delete_one(
-                        {
-                            "$or":[
-                                {"id": id},
-                                {"_id": id}
-                            ]
-                        }
-                    )
+        await self.collection.update_many(filter, update=[{"$set": doc} for doc in documents], upsert=True)
+
+    async def pop(self, filter: dict, sort: List[tuple] = None) -> Union[Dict, None]:
+        return await self.collection.find_one_and_delete(filter, sort=sort)
+
+    async def upsert_one(self, filter: dict, document: dict) -> None:
+        await self.collection.update_one(filter, {"$set": document}, upsert=True)
+
+    async def delete_many(self, filter: dict) -> int:
+        result = await self.collection.delete_many(filter)
+        return result.deleted_count
+
+    async def create_index(self, keys: List[tuple], **kwargs) -> str:
+        return await self.collection.create_index(keys, **kwargs)
+
+    async def delete(self, ids: List[str]) -> int:
+        result = await self.collection.delete_many(
+            {
+                "$or":[
+                    {"id": {"$in": ids}},
+                    {"_id": {"$in": ids}}
+                ]
+            }
+        )
+        return result.deleted_count
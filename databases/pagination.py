@@ -0,0 +1,56 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from typing import Any, Dict, Iterable, List, Tuple, Union
+
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def keyset(sort: Union[Dict, None], fields: Iterable[str]) -> Union[List[Tuple[str, int]], None]:
+    """
+    chaves da paginação por cursor: a chave de ordenação mais o _id como desempate (valores repetidos
+    não se perdem entre páginas)
+    :param fields: chaves aceitas; precisam existir em todos os documentos, com um só tipo
+    (no Mongo, $gt/$lt não alcançam null nem valores de outro tipo)
+    :return: None quando a ordenação não serve para cursor (só skip)
+    """
+    keys = list((sort or {"_id": DESCENDING}).items())
+    if len(keys) != 1 or keys[0][0] not in fields or keys[0][1] not in (ASCENDING, DESCENDING):
+        return None
+    field, direction = keys[0]
+    return [(field, direction)] if field == "_id" else [(field, direction), ("_id", direction)]
+
+
+def encode(keys: List[Tuple[str, int]], doc: Dict) -> str:
+    # opaco para o cliente: ordenação e valores do último documento da página (extended JSON, preserva ObjectId e datas)
+    payload = json_util.dumps({"sort": keys, "values": [doc.get(field) for field, _ in keys]})
+    return urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode(keys: List[Tuple[str, int]], token: str) -> List[Any]:
+    try:
+        payload = json_util.loads(urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        sort, values = payload["sort"], payload["values"]
+    except Exception:
+        raise InvalidPageToken("Invalid page token")
+    if [list(key) for key in keys] != sort or len(values) != len(keys):
+        raise InvalidPageToken("Page token does not match the sort of the request")
+    return values
+
+
+def after(filter: Dict, keys: List[Tuple[str, int]], values: List[Any]) -> Dict:
+    """
+    documentos depois do último da página anterior, na ordem de keys:
+    (a, _id) > (va, vid)  <=>  a > va  ou  (a = va e _id > vid)
+    :return:
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(keys):
+        clause = {key: value for (key, _), value in zip(keys[:i], values)}
+        clause[field] = {"$gt" if direction == ASCENDING else "$lt": values[i]}
+        clauses.append(clause)
+    condition = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+    return condition if not filter else {"$and": [filter, condition]}
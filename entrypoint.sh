@@ -11,6 +11,9 @@ if [ "$app_type" = "app" ]; then
 elif [ "$app_type" = "worker" ]; then
   # shellcheck disable=SC2086
   echo "waiting 15 seconds..."
+  # métricas dos processos do pool (prefork) agregadas pelo processo principal
+  export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus}"
+  rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
   sleep 15 && celery -A tasks.tasks worker --loglevel=INFO --concurrency=$CONCURRENCY
 
 fi
\ No newline at end of file
@@ -1 +1,5 @@
-from .vector import VectorFactory
\ No newline at end of file
+from .vector import VectorFactory
+from .namespace import NamespaceFactory
+from .deletion import DeletionJobFactory
+from .snapshot import SnapshotJobFactory
+from .migration import MigrationFactory
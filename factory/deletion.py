@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Dict, Union
+from uuid import uuid4
+
+from databases import AsyncMongo, Mongo
+from models import VectorDeleteFilter, VectorDeleteJob
+
+
+class DeletionJobFactory:
+    """
+    estado e progresso dos jobs de remoção de vetores: criados pela API (PENDING)
+    e atualizados pelo worker a cada lote removido
+    """
+    def __init__(self, asyncmongo: AsyncMongo = None, mongo: Mongo = None):
+        self.asyncmongo = AsyncMongo('deletion_jobs') if asyncmongo is None else asyncmongo
+        self.mongo = Mongo('deletion_jobs') if mongo is None else mongo
+
+    @staticmethod
+    def load(job: Dict) -> VectorDeleteJob:
+        return VectorDeleteJob(job_id=job["_id"], **{k: v for k, v in job.items() if k != "_id"})
+
+    async def acreate(self, filter: VectorDeleteFilter) -> str:
+        job_id = uuid4().hex
+        await self.asyncmongo.insert([
+            dict(
+                _id=job_id,
+                state="PENDING",
+                filter=filter.model_dump(exclude_none=True, mode="json"),
+                deleted=0,
+                batches=0,
+                created_at=datetime.utcnow()
+            )
+        ])
+        return job_id
+
+    async def aget(self, job_id: str) -> Union[VectorDeleteJob, None]:
+        job = await self.asyncmongo.select({"_id": job_id})
+        return None if job is None else self.load(job)
+
+    def start(self, job_id: str, total: int) -> None:
+        self.mongo.update_one(
+            {"_id": job_id},
+            {"$set": {"state": "RUNNING", "started_at": datetime.utcnow()}, "$unset": {"error": ""}},
+            upsert=True
+        )
+        # total da primeira tentativa; um retry só encontra o que ainda falta remover
+        self.mongo.update_one({"_id": job_id, "total": {"$exists": False}}, {"$set": {"total": total}})
+
+    def progress(self, job_id: str, deleted: int) -> None:
+        self.mongo.update_one({"_id": job_id}, {"$inc": {"deleted": deleted, "batches": 1}})
+
+    def finish(self, job_id: str) -> None:
+        self.mongo.update_one({"_id": job_id}, {"$set": {"state": "SUCCESS", "finished_at": datetime.utcnow()}})
+
+    def fail(self, job_id: str, error: str, final: bool = True) -> None:
+        self.mongo.update_one({"_id": job_id}, {"$set": {"state": "FAILURE" if final else "RETRY", "error": error}})
@@ -0,0 +1,96 @@
+from datetime import datetime
+from typing import Dict, Union
+from uuid import uuid4
+
+from bson import ObjectId
+
+from databases import AsyncMongo, Mongo
+from models import Migration
+
+# estados em que a migração ainda pode gravar na coleção nova
+ACTIVE = ["PENDING", "RUNNING", "SWITCHING"]
+
+
+class MigrationFactory:
+    """
+    estado, checkpoint e progresso das migrações de modelo de embedding: criadas pela API (PENDING)
+    e atualizadas pelo worker a cada página re-embedada; os processos consultam a migração em andamento
+    para gravar também na coleção nova (dual-write)
+    """
+    def __init__(self, asyncmongo: AsyncMongo = None, mongo: Mongo = None):
+        self.asyncmongo = AsyncMongo('embedding_migrations') if asyncmongo is None else asyncmongo
+        self.mongo = Mongo('embedding_migrations') if mongo is None else mongo
+
+    @staticmethod
+    def load(migration: Dict) -> Migration:
+        checkpoint = migration.get("checkpoint")
+        return Migration(
+            migration_id=migration["_id"],
+            **{k: v for k, v in migration.items() if k not in ("_id", "checkpoint")},
+            checkpoint=None if checkpoint is None else str(checkpoint)
+        )
+
+    async def acreate(self, model: str, dim: int, partitions: int = 0) -> str:
+        migration_id = uuid4().hex
+        await self.asyncmongo.insert([
+            dict(
+                _id=migration_id,
+                state="PENDING",
+                target=dict(model=model, dim=dim, partitions=partitions),
+                done=0,
+                tokens=0,
+                cost=0.0,
+                created_at=datetime.utcnow()
+            )
+        ])
+        return migration_id
+
+    async def aget(self, migration_id: str) -> Union[Migration, None]:
+        migration = await self.asyncmongo.select({"_id": migration_id})
+        return None if migration is None else self.load(migration)
+
+    async def aactive(self) -> Union[Migration, None]:
+        migration = await self.asyncmongo.select({"state": {"$in": ACTIVE}})
+        return None if migration is None else self.load(migration)
+
+    def get(self, migration_id: str) -> Union[Dict, None]:
+        found = self.mongo.find({"_id": migration_id})
+        return found[0] if found else None
+
+    def running(self) -> Union[Dict, None]:
+        # só depois de a coleção nova existir (start)
+        found = self.mongo.find({"state": {"$in": ["RUNNING", "SWITCHING"]}})
+        return found[0] if found else None
+
+    def start(self, migration_id: str, source: Dict, target: Dict, total: int) -> None:
+        self.mongo.update_one(
+            {"_id": migration_id},
+            {
+                "$set": {"state": "RUNNING", "source": source, "target": target, "total": total,
+                         "started_at": datetime.utcnow()},
+                "$unset": {"error": ""}
+            }
+        )
+
+    def checkpoint(self, migration_id: str, last: ObjectId, rows: int, tokens: int, cost: float,
+                   rows_per_second: float) -> None:
+        self.mongo.update_one(
+            {"_id": migration_id},
+            {
+                "$set": {"checkpoint": last, "rows_per_second": round(rows_per_second, 1)},
+                "$inc": {"done": rows, "tokens": tokens, "cost": cost}
+            }
+        )
+
+    def switching(self, migration_id: str) -> None:
+        self.mongo.update_one({"_id": migration_id}, {"$set": {"state": "SWITCHING"}})
+
+    def switched(self, migration_id: str) -> None:
+        self.mongo.update_one({"_id": migration_id}, {"$set": {"switched_at": datetime.utcnow()}})
+
+    def finish(self, migration_id: str) -> None:
+        self.mongo.update_one({"_id": migration_id}, {"$set": {"state": "SUCCESS", "finished_at": datetime.utcnow()}})
+
+    def fail(self, migration_id: str, error: str) -> None:
+        # o checkpoint é mantido: a migração continua de onde parou quando for retomada
+        self.mongo.update_one({"_id": migration_id}, {"$set": {"state": "FAILURE", "error": error}})
@@ -0,0 +1,54 @@
+from datetime import datetime
+from typing import Dict, List
+
+from databases import AsyncMongo, Mongo, provision
+
+
+class NamespaceFactory:
+    """
+    versão de cada namespace (incrementada a cada alteração) e o log de eventos de upsert/remoção
+    com os ids alterados, usado pelos caches dos processos da API para se atualizarem incrementalmente
+    """
+    def __init__(self, asyncmongo: AsyncMongo = None, mongo: Mongo = None):
+        self.asyncmongo = AsyncMongo('namespaces') if asyncmongo is None else asyncmongo
+        self.mongo = Mongo('namespaces') if mongo is None else mongo
+        self.asyncevents = AsyncMongo('namespace_events', client=self.asyncmongo.client)
+        self.events = Mongo('namespace_events', client=self.mongo.client)
+
+    @staticmethod
+    def event(namespace: str, version: int, upserted: List[str], deleted: List[str]) -> Dict:
+        return dict(
+            namespace=namespace,
+            version=version,
+            upserted=upserted,
+            deleted=deleted,
+            created_at=datetime.utcnow()
+        )
+
+    def publish(self, namespace: str, upserted: List[str] = None, deleted: List[str] = None) -> int:
+        version = self.mongo.increment({"_id": namespace}, "version")
+        self.events.insert_one(self.event(namespace, version, upserted or [], deleted or []))
+        return version
+
+    async def apublish(self, namespace: str, upserted: List[str] = None, deleted: List[str] = None) -> int:
+        version = await self.asyncmongo.increment({"_id": namespace}, "version")
+        await self.asyncevents.insert([self.event(namespace, version, upserted or [], deleted or [])])
+        return version
+
+    def version(self, namespace: str) -> int:
+        found = self.mongo.find({"_id": namespace})
+        return found[0].get("version", 0) if found else 0
+
+    async def aversion(self, namespace: str) -> int:
+        doc = await self.asyncmongo.select({"_id": namespace})
+        return 0 if doc is None else doc.get("version", 0)
+
+    async def aevents(self, namespace: str, after: int, limit: int = 1000) -> List[Dict]:
+        return await self.asyncevents.all(
+            filter={"namespace": namespace, "version": {"$gt": after}},
+            sort={"version": 1},
+            limit=limit
+        )
+
+    def setup(self) -> None:
+        provision(self.mongo.client, ["namespace_events"])
@@ -0,0 +1,57 @@
+from datetime import datetime
+from typing import Dict, Union
+from uuid import uuid4
+
+from databases import AsyncMongo, Mongo
+from models import SnapshotJob
+
+
+class SnapshotJobFactory:
+    """
+    estado e progresso dos jobs de exportação/importação de snapshots: criados pela API (PENDING)
+    e atualizados pelo worker a cada intervalo de progresso
+    """
+    def __init__(self, asyncmongo: AsyncMongo = None, mongo: Mongo = None):
+        self.asyncmongo = AsyncMongo('snapshot_jobs') if asyncmongo is None else asyncmongo
+        self.mongo = Mongo('snapshot_jobs') if mongo is None else mongo
+
+    @staticmethod
+    def load(job: Dict) -> SnapshotJob:
+        return SnapshotJob(job_id=job["_id"], **{k: v for k, v in job.items() if k != "_id"})
+
+    async def acreate(self, kind: str, name: str, namespace: str = None, dtype: str = None) -> str:
+        job_id = uuid4().hex
+        await self.asyncmongo.insert([
+            dict(
+                _id=job_id,
+                kind=kind,
+                state="PENDING",
+                name=name,
+                namespace=namespace,
+                dtype=dtype,
+                done=0,
+                created_at=datetime.utcnow()
+            )
+        ])
+        return job_id
+
+    async def aget(self, job_id: str) -> Union[SnapshotJob, None]:
+        job = await self.asyncmongo.select({"_id": job_id})
+        return None if job is None else self.load(job)
+
+    def start(self, job_id: str) -> None:
+        self.mongo.update_one(
+            {"_id": job_id}, {"$set": {"state": "RUNNING", "started_at": datetime.utcnow()}}, upsert=True
+        )
+
+    def progress(self, job_id: str, done: int, total: int, rows_per_second: float) -> None:
+        self.mongo.update_one(
+            {"_id": job_id},
+            {"$set": {"done": done, "total": total, "rows_per_second": round(rows_per_second, 1)}}
+        )
+
+    def finish(self, job_id: str) -> None:
+        self.mongo.update_one({"_id": job_id}, {"$set": {"state": "SUCCESS", "finished_at": datetime.utcnow()}})
+
+    def fail(self, job_id: str, error: str) -> None:
+        self.mongo.update_one({"_id": job_id}, {"$set": {"state": "FAILURE", "error": error}})
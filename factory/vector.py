@@ -1,17 +1,30 @@
-from typing import Dict, Union, List
+import zlib
+from typing import AsyncIterator, Dict, Tuple, Union, List
+
+from orjson import dumps, OPT_APPEND_NEWLINE
+
+from pymongo import UpdateOne
 
 from models import (
     Vector, SelectVectorFactoryRequest, AllVectorFactoryRequest,
     AllDeleteVectorFactoryRequest
 )
 
-from databases import AsyncMongo, Mongo
+from databases import AsyncMongo, Mongo, provision
+from .namespace import NamespaceFactory
 
 class VectorFactory:
-    def __init__(self):
+    # ordenações com paginação por cursor: campos presentes em todo vetor (created_at e id vêm do upsert)
+    KEYSET = ("_id", "id", "created_at")
+
+    def __init__(self, asyncmongo: AsyncMongo = None, mongo: Mongo = None):
         self.vector = Vector()
-        self.asyncmongo = AsyncMongo('vectors')
-        self.mongo = Mongo('vectors')
+        self.asyncmongo = AsyncMongo('vectors') if asyncmongo is None else asyncmongo
+        self.mongo = Mongo('vectors') if mongo is None else mongo
+        self.namespaceFactory = NamespaceFactory(
+            asyncmongo=AsyncMongo('namespaces', client=self.asyncmongo.client),
+            mongo=Mongo('namespaces', client=self.mongo.client)
+        )
 
     def dump(self) -> Dict:
         return self.vector.model_dump()
@@ -36,11 +49,67 @@ class VectorFactory:
         )
         return [self.load(vec) for vec in result]
 
+    async def afind_page(self, request: AllVectorFactoryRequest) -> Tuple[List[Vector], Union[str, None]]:
+        result, after = await self.asyncmongo.page(
+            filter=request.filter,
+            sort=request.sort,
+            after=request.after,
+            skip=request.skip,
+            limit=request.limit,
+            keyset=self.KEYSET
+        )
+        return [self.load(vec) for vec in result], after
+
+    async def aexport(self, filter: dict = None, compress: bool = False,
+                      chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """
+        vetores do filtro em NDJSON (um por linha), direto do cursor e sem passar pelo modelo Vector;
+        entregues em blocos de ~chunk_size bytes
+        :param compress: gzip
+        :return:
+        """
+        gzip = zlib.compressobj(wbits=31) if compress else None  # wbits=31: cabeçalho e trailer gzip
+        projection = {"_id": 0, **{field: 1 for field in Vector.model_fields}}
+        buffer = bytearray()
+        async for vec in self.asyncmongo.iterate(filter, projection):
+            buffer += dumps(vec, option=OPT_APPEND_NEWLINE)
+            if len(buffer) >= chunk_size:
+                chunk = bytes(buffer) if gzip is None else gzip.compress(bytes(buffer))
+                buffer.clear()
+                if chunk:
+                    yield chunk
+        chunk = bytes(buffer) if gzip is None else gzip.compress(bytes(buffer)) + gzip.flush()
+        if chunk:
+            yield chunk
+
     async def adelete_all(self, request: AllDeleteVectorFactoryRequest) -> None:
+        namespaces: Dict[str, List[str]] = {}
+        for vec in await self.asyncmongo.find({"id": {"$in": request.ids}}, {"_id": 0, "id": 1, "namespace": 1}):
+            namespaces.setdefault(vec.get("namespace"), []).append(vec.get("id"))
         await self.asyncmongo.delete(request.ids)
+        # invalida os caches (respostas, índice lexical, índice em memória) dos namespaces alterados
+        for namespace, ids in namespaces.items():
+            await self.namespaceFactory.apublish(namespace, deleted=ids)
 
     async def acreate(self, request: List[Vector]) -> None:
         await self.asyncmongo.insert(documents=[vec.model_dump() for vec in request])
 
     def create(self, request: List[Vector]) -> None:
         self.mongo.insert(documents=[vec.model_dump() for vec in request])
+
+    def upsert(self, request: List[Vector]) -> None:
+        # um documento por id de chunk: textos já conhecidos só trocam de dono/namespace
+        self.mongo.bulk_write([
+            UpdateOne(
+                {"id": vec.id},
+                {
+                    "$set": {"created_by": vec.created_by, "namespace": vec.namespace},
+                    "$setOnInsert": vec.model_dump(exclude={"created_by", "namespace"})
+                },
+                upsert=True
+            ) for vec in request
+        ])
+
+    def setup(self) -> None:
+        provision(self.mongo.client, ["vectors"])
+        self.namespaceFactory.setup()
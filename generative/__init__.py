@@ -1,2 +1,4 @@
+from .answer_cache import AnswerCache, answer_cache
 from .gen_bot import GenBot
-from .gen_quiz import GenQuiz
\ No newline at end of file
+from .gen_quiz import GenQuiz
+from .quiz_pool import QuizPool
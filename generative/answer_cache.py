@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from hashlib import md5
+from time import monotonic
+from typing import List, Dict, Tuple, Union
+
+import numpy as np
+from loguru import logger
+from orjson import dumps
+
+from config import env
+from databases import AsyncMongo
+from metrics import CACHE
+
+
+class AnswerCache:
+    """
+    cache semântico de respostas do /api/asking: perguntas com embedding próximo
+    (cosseno >= limiar) no mesmo namespace e com as mesmas configurações reaproveitam a resposta;
+    até max_entries respostas por chave e max_keys chaves, descartando a usada há mais tempo
+    """
+    GREETING = "\x00greeting\x00"
+
+    def __init__(self, threshold: float = None, ttl: int = None, max_entries: int = None, max_keys: int = None):
+        self.threshold: float = env.ANSWER_CACHE_THRESHOLD if threshold is None else threshold
+        self.ttl: int = env.ANSWER_CACHE_TTL if ttl is None else ttl
+        self.max_entries: int = env.ANSWER_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.max_keys: int = env.ANSWER_CACHE_MAX_KEYS if max_keys is None else max_keys
+        self.entries: OrderedDict[Tuple[str, str], List[Dict]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.saved_tokens: int = 0
+        self.saved_cost: float = 0.0
+        self._mongo: Union[AsyncMongo, None] = None
+
+    @property
+    def mongo(self) -> AsyncMongo:
+        if self._mongo is None:
+            self._mongo = AsyncMongo("namespaces")
+        return self._mongo
+
+    def use(self, mongo: AsyncMongo) -> None:
+        self._mongo = mongo
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    @property
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return dict(
+            size=sum(len(entries) for entries in self.entries.values()),
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=(self.hits / total) if total > 0 else 0.0,
+            saved_tokens=self.saved_tokens,
+            saved_cost=self.saved_cost
+        )
+
+    @staticmethod
+    def settings(personality: str = None, swear_words: List[str] = None, informal_greeting: List[str] = None) -> str:
+        return md5(dumps([personality, swear_words, informal_greeting])).hexdigest()
+
+    @staticmethod
+    def normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    async def version(self, namespace: str) -> int:
+        # incrementado pelo worker a cada upsert no namespace
+        try:
+            doc = await self.mongo.select({"_id": namespace})
+        except Exception as e:
+            logger.error(e)
+            return -1
+        return 0 if doc is None else doc.get("version", 0)
+
+    def lookup(self, namespace: str, settings: str, version: int, embedding: List[float]) -> Union[Dict, None]:
+        if not env.ANSWER_CACHE_ENABLED or version < 0:
+            return None
+
+        now = monotonic()
+        key = (namespace, settings)
+        entries = [
+            entry for entry in self.entries.get(key, [])
+            if entry["version"] == version and entry["expires"] > now
+        ]
+        if entries:
+            self.entries[key] = entries
+            self.entries.move_to_end(key)
+        else:
+            self.entries.pop(key, None)
+        if not entries:
+            self.misses += 1
+            CACHE.labels(cache="answer", result="miss").inc()
+            return None
+
+        scores = np.stack([entry["embedding"] for entry in entries]) @ self.normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            CACHE.labels(cache="answer", result="miss").inc()
+            return None
+
+        entry = entries[best]
+        self.hits += 1
+        CACHE.labels(cache="answer", result="hit").inc()
+        self.saved_tokens += entry["tokens"]
+        self.saved_cost += entry["cost"]
+        logger.info(f"Answer cache hit (similarity {scores[best]:.4f}); hit rate {self.stats['hit_rate']:.2%}; "
+                    f"saved tokens {self.saved_tokens}; saved US${self.saved_cost:.5f}")
+        return entry
+
+    def store(self, namespace: str, settings: str, version: int, embedding: List[float],
+              answer: str, greeting: str, tokens: int = 0, cost: float = 0.0, username: str = None) -> None:
+        if not env.ANSWER_CACHE_ENABLED or version < 0:
+            return
+        # a saudação depende do horário e do usuário; é re-renderizada em cada acerto
+        template = answer.replace(greeting, self.GREETING) if greeting else answer
+        if (greeting and greeting not in answer) or (username and username in template):
+            # o modelo citou o usuário fora da saudação exata: a resposta não serve para outro usuário
+            return
+        key = (namespace, settings)
+        entries = self.entries.setdefault(key, [])
+        self.entries.move_to_end(key)
+        entries.append(
+            dict(
+                embedding=self.normalize(embedding),
+                template=template,
+                version=version,
+                tokens=tokens,
+                cost=cost,
+                expires=monotonic() + self.ttl
+            )
+        )
+        if len(entries) > self.max_entries:
+            del entries[0]
+        while len(self.entries) > self.max_keys:
+            self.entries.popitem(last=False)
+
+    def render(self, entry: Dict, greeting: str) -> str:
+        return entry["template"].replace(self.GREETING, greeting)
+
+
+answer_cache = AnswerCache()
@@ -1,31 +1,33 @@
 from datetime import datetime
-from typing import List
+from typing import List, Dict, Tuple, Union, AsyncIterator
 
+import tiktoken
 from langchain_community.callbacks import get_openai_callback
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from langchain_community.callbacks.openai_info import get_openai_token_cost_for_model
+from langchain_openai import ChatOpenAI
 
 from langchain.schema import (
+    BaseMessage,
     SystemMessage,
     HumanMessage,
 )
 
 from loguru import logger
 from config import env
+from metrics import stage, usage
 from provider import MilvusSearch
 from config import bot
+from .answer_cache import answer_cache
 
 
 class GenBot:
-    def __init__(self, username: str):
-        self.embeddings_model = OpenAIEmbeddings(
-            model=env.OPENAI_EMBEDDING_MODEL,
-            openai_api_key=env.OPENAI_API_KEY
-        )
+    def __init__(self, username: str, milvus: MilvusSearch = None, llm: ChatOpenAI = None):
         self.username: str = username
-        self.milvus = MilvusSearch()
+        self.milvus = MilvusSearch() if milvus is None else milvus
+        self.llm = llm
 
-    async def context(self, q: str, namespace: str = "default", k: int = 2) -> str:
-        fetch = await self.milvus.asearch(query=q, k=k, ns=namespace)
+    async def context(self, q: str, namespace: str = "default", k: int = 2, embedding: List[float] = None) -> str:
+        fetch = await self.milvus.asearch(query=q, k=k, ns=namespace, embedding=embedding)
         if len(fetch) == 0:
             return ""
         return ("The paragraphs in the context are separated by C<index>: <<context>>; "
@@ -76,10 +78,24 @@ class GenBot:
                 return ""
         return result
 
-    async def generate(self, q: str, namespace: str = "default", personality: str = None,
-                       swear_words: List[str] = None, informal_greeting: List[str] = None) -> str:
-
-        messages = [
+    def greeting(self, ig_list: List[str] = None) -> str:
+        if ig_list is not None and len(ig_list) == 0:
+            return ""
+        return self.current_time()
+
+    async def embed(self, q: str, namespace: str = "default") -> Tuple[Union[List[float], None], int]:
+        version = await answer_cache.version(namespace)
+        try:
+            return await self.milvus.aembedding(q), version
+        except Exception as e:
+            # sem embedding não há cache; a busca de contexto trata a falha
+            logger.error(e)
+            return None, -1
+
+    async def messages(self, q: str, namespace: str = "default", personality: str = None,
+                       swear_words: List[str] = None, informal_greeting: List[str] = None,
+                       embedding: List[float] = None) -> List[BaseMessage]:
+        return [
             SystemMessage(
                 content=f"""{bot.bot_personality if personality is None else personality}
 
@@ -89,7 +105,7 @@ class GenBot:
 
 Use context to create an answer to the question.
 Only use the context that is related to the user's question.
-Context: \"\"\"{await self.context(q, namespace, 2)}\"\"\"
+Context: \"\"\"{await self.context(q, namespace, 2, embedding)}\"\"\"
 
 context language: {bot.bot_lang_context}.
 language: {bot.bot_lang_language}.
@@ -99,8 +115,84 @@ Output with a maximum of 3 sentences."""
             ),
             HumanMessage(content=q),
         ]
-        llm = self.llmChatOpenAI(temperature=.1)
-        with get_openai_callback() as cb:
+
+    @staticmethod
+    def usage(messages: List[BaseMessage], answer: str) -> Dict:
+        # o streaming não devolve token_usage; estimado com o tokenizer do modelo
+        try:
+            encoding = tiktoken.encoding_for_model(env.OPENAI_CHAT_MODEL)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+        prompt_tokens = 3 + sum(
+            4 + len(encoding.encode(message.content, disallowed_special=())) for message in messages
+        )
+        completion_tokens = len(encoding.encode(answer, disallowed_special=()))
+        try:
+            cost = (get_openai_token_cost_for_model(env.OPENAI_CHAT_MODEL, prompt_tokens) +
+                    get_openai_token_cost_for_model(env.OPENAI_CHAT_MODEL, completion_tokens, is_completion=True))
+        except ValueError:
+            cost = 0.0
+        return dict(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+            total_cost=cost
+        )
+
+    async def generate(self, q: str, namespace: str = "default", personality: str = None,
+                       swear_words: List[str] = None, informal_greeting: List[str] = None) -> str:
+        settings = answer_cache.settings(personality, swear_words, informal_greeting)
+        embedding, version = await self.embed(q, namespace)
+        cached = answer_cache.lookup(namespace, settings, version, embedding)
+        if cached is not None:
+            return answer_cache.render(cached, self.current_time())
+
+        messages = await self.messages(q, namespace, personality, swear_words, informal_greeting, embedding)
+        llm = self.llmChatOpenAI(temperature=.1) if self.llm is None else self.llm
+        with get_openai_callback() as cb, stage("llm"):
             response = await llm.ainvoke(input=messages)
             logger.info(f"LLM({env.OPENAI_CHAT_MODEL}); Cost US$%.5f; Tokens {cb.total_tokens}" % cb.total_cost)
+        usage(env.OPENAI_CHAT_MODEL, cb.prompt_tokens, cb.completion_tokens, cb.total_cost)
+
+        answer_cache.store(
+            namespace, settings, version, embedding, response.content,
+            greeting=self.greeting(informal_greeting),
+            tokens=cb.total_tokens,
+            cost=cb.total_cost,
+            username=self.username
+        )
         return response.content
+
+    async def astream(self, q: str, namespace: str = "default", personality: str = None,
+                      swear_words: List[str] = None, informal_greeting: List[str] = None
+                      ) -> AsyncIterator[Tuple[str, Dict]]:
+        settings = answer_cache.settings(personality, swear_words, informal_greeting)
+        embedding, version = await self.embed(q, namespace)
+        cached = answer_cache.lookup(namespace, settings, version, embedding)
+        if cached is not None:
+            yield "token", {"content": answer_cache.render(cached, self.current_time())}
+            yield "usage", {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                            "total_cost": 0.0, "cached": True}
+            return
+
+        messages = await self.messages(q, namespace, personality, swear_words, informal_greeting, embedding)
+        llm = self.llmChatOpenAI(temperature=.1) if self.llm is None else self.llm
+        answer = ""
+        with stage("llm"):
+            async for chunk in llm.astream(input=messages):
+                if chunk.content:
+                    answer += chunk.content
+                    yield "token", {"content": chunk.content}
+
+        tokens = self.usage(messages, answer)
+        logger.info(f"LLM({env.OPENAI_CHAT_MODEL}); Cost US$%.5f; Tokens {tokens['total_tokens']}" % tokens["total_cost"])
+        usage(env.OPENAI_CHAT_MODEL, tokens["prompt_tokens"], tokens["completion_tokens"], tokens["total_cost"])
+
+        answer_cache.store(
+            namespace, settings, version, embedding, answer,
+            greeting=self.greeting(informal_greeting),
+            tokens=tokens["total_tokens"],
+            cost=tokens["total_cost"],
+            username=self.username
+        )
+        yield "usage", dict(tokens, cached=False)
@@ -1,17 +1,17 @@
 import asyncio
 import re
-import aiofiles
-import shutil
 from typing import Dict, Union, List
 from aiohttp import ClientSession
 from langchain_community.callbacks import get_openai_callback
 from langchain_openai import ChatOpenAI
 from loguru import logger
 from config import env
-from models import GenQuizResponse
+from metrics import stage, usage
+from models import GenQuizResponse, TextToVoiceRequest
 from langchain.schema import SystemMessage
 from json import loads
-from provider import MilvusSearch
+from provider import MilvusSearch, Voice, audio_cache, jingle
+from provider.mp3 import concat
 from random import shuffle
 from pydub import AudioSegment
 from pathlib import Path
@@ -19,10 +19,13 @@ from config import bot
 
 
 class GenQuiz:
-    def __init__(self, theme: str, amount: int):
+    def __init__(self, theme: str, amount: int, milvus: MilvusSearch = None,
+                 llm: ChatOpenAI = None, session: ClientSession = None):
         self.theme = theme
         self.amount = amount
-        self.milvus = MilvusSearch()
+        self.milvus = MilvusSearch() if milvus is None else milvus
+        self.llm = llm
+        self.session = session
 
 
     async def context(self, q: str, namespace: str = "default", k: int = 2) -> str:
@@ -113,11 +116,16 @@ class GenQuiz:
 
     @staticmethod
     def mix_audio(absolute_path: str) -> Path:
-        sm_sound = AudioSegment.from_file("audios/quiz.mp3")
-        gen_sound = AudioSegment.from_file(absolute_path)
-        comb_sound = sm_sound + gen_sound
-        comb_sound.export(absolute_path, format="mp3")
-        return Path(absolute_path)
+        with stage("mixing"):
+            # mesmo formato MP3 (taxa, canais e bitrate): junta os frames sem recodificar
+            if concat(jingle, absolute_path):
+                return Path(absolute_path)
+
+            sm_sound = jingle.load().segment
+            gen_sound = AudioSegment.from_file(absolute_path)
+            comb_sound = sm_sound + gen_sound
+            comb_sound.export(absolute_path, format="mp3")
+            return Path(absolute_path)
 
     async def voice(self, quiz: dict) -> Union[str, None]:
         alternatives: List[str] = quiz.get('alternatives', [])
@@ -131,30 +139,26 @@ Resposta C, {alternatives[2]}.
 Resposta D, {alternatives[3]}.""".replace("\n", " ")
 
         presentation = " ".join(presentation.split())
-        async with ClientSession() as sess:
-            async with sess.post(f"https://api.elevenlabs.io/v1/text-to-speech/{env.QUIZ_VOICE_ID}/stream", json={
-                "model_id": "eleven_multilingual_v2",
-                "text": presentation,
-                "voice_settings": {
-                    "similarity_boost": 1,
-                    "stability": 1,
-                    "style": 1,
-                    "use_speaker_boost": True
-                }
-            }, headers={"Content-Type": "application/json", "xi-api-key": env.ELEVENLABS_API_KEY}) as response:
-                if response.status == 200:
-                    chunk_size = 8192 # 8 KB
-                    chunk: bytes
-                    async with aiofiles.tempfile.NamedTemporaryFile(delete=False) as temp_file:
-                        async with aiofiles.open(temp_file.name, "wb") as file:
-                            async for chunk in response.content.iter_chunked(chunk_size):
-                                await file.write(chunk)
-                            await file.close()
-                        await temp_file.close()
-                    file_mp3 = f"{temp_file.name}.mp3"
-                    shutil.move(temp_file.name, file_mp3)
-                    sound: Path = await asyncio.to_thread(self.mix_audio, file_mp3)
-                    return f"{env.LEARN_FRONT_END}/files/{sound.absolute().name.split('/')[-1]}"
+        # o texto da apresentação passa do limite do TextToVoiceRequest da API
+        voice = Voice(
+            TextToVoiceRequest.model_construct(content=presentation),
+            session=self.session,
+            voice_id=env.QUIZ_VOICE_ID
+        )
+
+        # o áudio guardado no cache já é o mixado com a vinheta
+        key = voice.cache_key(variant="quiz")
+        if audio_cache.get(key) is not None:
+            return audio_cache.url(key)
+
+        audio = await voice.text_to_voice(cache=False)
+        if audio.absolute_path is None:
+            return None
+        sound: Path = await asyncio.to_thread(self.mix_audio, audio.absolute_path)
+        if not env.AUDIO_CACHE_ENABLED:
+            return f"{env.LEARN_FRONT_END}/files/{sound.absolute().name.split('/')[-1]}"
+        await asyncio.to_thread(audio_cache.put, key, sound)
+        return audio_cache.url(key)
 
     async def generate(self, namespace: str = "default") -> GenQuizResponse:
         messages = [
@@ -186,10 +190,11 @@ Alternatives in language: {bot.quiz_lang_alternatives}.
 
 Output in JSON.""")
         ]
-        llm = self.llmChatOpenAI(temperature=0)
-        with get_openai_callback() as cb:
+        llm = self.llmChatOpenAI(temperature=0) if self.llm is None else self.llm
+        with get_openai_callback() as cb, stage("llm"):
             response = await llm.ainvoke(input=messages)
             logger.info(f"LLM({env.OPENAI_QUIZ_MODEL}); Cost US$%.5f; Tokens {cb.total_tokens}" % cb.total_cost)
+        usage(env.OPENAI_QUIZ_MODEL, cb.prompt_tokens, cb.completion_tokens, cb.total_cost)
 
         quiz = await asyncio.to_thread(self.marshal, response.content)
         quiz_parsed: dict = await asyncio.to_thread(self.build, quiz)
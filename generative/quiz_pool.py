@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from typing import Dict, Union
+
+from pymongo.errors import DuplicateKeyError
+
+from config import env
+from databases import AsyncMongo, Mongo, provision
+from factory import NamespaceFactory
+from metrics import CACHE
+from models import GenQuizResponse
+
+
+class QuizPool:
+    """
+    estoque de quizzes prontos (pergunta, alternativas, resposta e áudio) por (namespace, tema, valor);
+    a API consome com pop atômico e o worker repõe em segundo plano. cada quiz guarda a versão do namespace
+    em que foi gerado: depois de um upsert ou remoção no namespace ele não é mais servido
+    """
+    def __init__(self, asyncmongo: AsyncMongo = None, mongo: Mongo = None, locks: Mongo = None,
+                 demand: AsyncMongo = None, namespaces: NamespaceFactory = None):
+        self.asyncmongo = AsyncMongo("quizzes") if asyncmongo is None else asyncmongo
+        self.mongo = Mongo("quizzes") if mongo is None else mongo
+        self.locks = Mongo("quizzes_locks", client=self.mongo.client) if locks is None else locks
+        self.demand = AsyncMongo("quizzes_demand", client=self.asyncmongo.client) if demand is None else demand
+        self.namespaces = NamespaceFactory(
+            asyncmongo=AsyncMongo("namespaces", client=self.asyncmongo.client),
+            mongo=Mongo("namespaces", client=self.mongo.client)
+        ) if namespaces is None else namespaces
+
+    @staticmethod
+    def key(namespace: str, theme: str, amount: int) -> Dict:
+        return {
+            "namespace": namespace,
+            "theme": " ".join(theme.split()).casefold(),
+            "amount": amount
+        }
+
+    @classmethod
+    def id(cls, namespace: str, theme: str, amount: int) -> str:
+        key = cls.key(namespace, theme, amount)
+        return f"{key['namespace']}:{key['theme']}:{key['amount']}"
+
+    async def apop(self, namespace: str, theme: str, amount: int) -> Union[GenQuizResponse, None]:
+        # quizzes de versões anteriores do namespace ficam para a reposição (ou o TTL) remover
+        version = await self.namespaces.aversion(namespace)
+        quiz = await self.asyncmongo.pop(dict(self.key(namespace, theme, amount), version=version),
+                                         sort=[("created_at", 1)])
+        if quiz is None:
+            CACHE.labels(cache="quiz_pool", result="miss").inc()
+            return None
+        CACHE.labels(cache="quiz_pool", result="hit").inc()
+        return GenQuizResponse(
+            question=quiz.get("question"),
+            alternatives=quiz.get("alternatives", []),
+            truth=quiz.get("truth", -1),
+            voice_url=quiz.get("voice_url")
+        )
+
+    async def awanted(self, namespace: str, theme: str, amount: int, hit: bool) -> bool:
+        """
+        se a chave merece reposição: houve um hit, ou ela foi pedida QUIZ_POOL_MIN_REQUESTS vezes dentro
+        de QUIZ_POOL_DEMAND_WINDOW; temas avulsos não geram quizzes que nunca seriam servidos
+        :return:
+        """
+        if hit:
+            return True
+        requests = await self.demand.increment(
+            {"_id": self.id(namespace, theme, amount)}, "requests", on_insert={"created_at": datetime.utcnow()}
+        )
+        return requests >= env.QUIZ_POOL_MIN_REQUESTS
+
+    def version(self, namespace: str) -> int:
+        return self.namespaces.version(namespace)
+
+    def prune(self, namespace: str, theme: str, amount: int, version: int) -> int:
+        # remove os quizzes gerados antes da última alteração do namespace
+        return self.mongo.delete_many(dict(self.key(namespace, theme, amount), version={"$ne": version}))
+
+    def count(self, namespace: str, theme: str, amount: int, version: int) -> int:
+        return self.mongo.count(dict(self.key(namespace, theme, amount), version=version))
+
+    def push(self, namespace: str, theme: str, amount: int, quiz: GenQuizResponse, version: int) -> None:
+        self.mongo.insert([
+            dict(
+                self.key(namespace, theme, amount),
+                version=version,
+                question=quiz.question,
+                alternatives=quiz.alternatives,
+                truth=quiz.truth,
+                voice_url=str(quiz.voice_url) if quiz.voice_url is not None else None,
+                created_at=datetime.utcnow()
+            )
+        ])
+
+    def setup(self) -> None:
+        provision(self.mongo.client, ["quizzes", "quizzes_locks", "quizzes_demand"])
+
+    def lock(self, namespace: str, theme: str, amount: int) -> bool:
+        # impede reposições simultâneas do mesmo estoque; expira sozinho se o worker morrer
+        id = self.id(namespace, theme, amount)
+        # o monitor de TTL do Mongo roda a cada minuto; remove já um lock vencido
+        self.locks.delete_one({"_id": id, "expires_at": {"$lt": datetime.utcnow()}})
+        try:
+            self.locks.insert_one(
+                {
+                    "_id": id,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=env.QUIZ_POOL_LOCK_TTL)
+                }
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def unlock(self, namespace: str, theme: str, amount: int) -> None:
+        self.locks.delete_one({"_id": self.id(namespace, theme, amount)})
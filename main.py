@@ -1,16 +1,36 @@
-from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from config import env
 
+from metrics import PrometheusMiddleware, QueueCollector, registry
+from resources import Resources
 from routes import api
+from security import validate_token
+from tasks import celery
+from tracing import TracingMiddleware, setup, shutdown
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup("api")
+    app.state.resources = await Resources().aopen()
+    yield
+    await app.state.resources.aclose()
+    shutdown()
 
 app = FastAPI(
     title="Learn API",
     docs_url="/docs",
-    debug=env.DEBUG
+    debug=env.DEBUG,
+    lifespan=lifespan
 )
 
+app.add_middleware(PrometheusMiddleware)
+app.add_middleware(TracingMiddleware)
+app.mount("/files/tts", app=StaticFiles(directory=env.AUDIO_CACHE_DIR), name="tts")
 app.mount("/files", app=StaticFiles(directory="/tmp"),  name="tmp")
 app.include_router(api)
 
@@ -23,3 +43,10 @@ async def root() -> ORJSONResponse:
         }
     )
 
+if env.METRICS_ENABLED:
+    metrics_registry = registry(QueueCollector(celery))
+
+    @app.get("/metrics", include_in_schema=False, dependencies=[Depends(validate_token)])
+    def metrics() -> Response:
+        return Response(generate_latest(metrics_registry), media_type=CONTENT_TYPE_LATEST)
+
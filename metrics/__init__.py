@@ -0,0 +1,5 @@
+from .middleware import PrometheusMiddleware
+from .prometheus import (
+    REQUEST_LATENCY, STAGE_LATENCY, TOKENS, COST, CACHE, ERRORS, TASK_LATENCY, TASKS_IN_PROGRESS,
+    MongoCommandMetrics, QueueCollector, stage, error, usage, registry, mark_process_dead
+)
@@ -0,0 +1,39 @@
+from time import perf_counter
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .prometheus import REQUEST_LATENCY
+
+
+class PrometheusMiddleware:
+    """
+    latência por rota (o template, ex. /api/vectors, não o caminho com parâmetros), medida até o fim
+    do corpo da resposta, o que inclui os streams (asking/stream, text-to-speech)
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = perf_counter()
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            REQUEST_LATENCY.labels(
+                method=scope["method"],
+                # arquivos estáticos e 404: agrupados, para não criar uma série por caminho
+                route=route.path if route is not None else scope.get("root_path") or "other",
+                status=str(status)
+            ).observe(perf_counter() - start)
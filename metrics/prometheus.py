@@ -0,0 +1,179 @@
+import os
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterator, List, Tuple, Union
+
+from celery import Celery
+from loguru import logger
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from pymongo import monitoring
+
+from config import env
+from tracing import span
+
+# de chamadas de cache (ms) a respostas completas do LLM e sínteses de voz (dezenas de segundos)
+BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    "learn_http_request_duration_seconds",
+    "Latência das requisições HTTP por rota (até o último byte da resposta)",
+    ["method", "route", "status"],
+    buckets=BUCKETS
+)
+STAGE_LATENCY = Histogram(
+    "learn_stage_duration_seconds",
+    "Latência por etapa: split, embedding, milvus_search, milvus_query, milvus_upsert, lexical_search, mongo, "
+    "llm, tts, tts_first_byte, mixing",
+    ["stage"],
+    buckets=BUCKETS
+)
+TOKENS = Counter(
+    "learn_tokens_total",
+    "Tokens consumidos por modelo e tipo (prompt, completion, embedding)",
+    ["model", "kind"]
+)
+COST = Counter(
+    "learn_cost_dollars_total",
+    "Custo estimado em US$ por modelo",
+    ["model"]
+)
+CACHE = Counter(
+    "learn_cache_lookups_total",
+    "Consultas aos caches (embedding, answer, audio, hot_index, quiz_pool) por resultado",
+    ["cache", "result"]
+)
+ERRORS = Counter(
+    "learn_errors_total",
+    "Erros por componente e tipo",
+    ["component", "type"]
+)
+TASK_LATENCY = Histogram(
+    "learn_celery_task_duration_seconds",
+    "Duração das tarefas do worker por estado final",
+    ["task", "state"],
+    buckets=BUCKETS
+)
+TASKS_IN_PROGRESS = Gauge(
+    "learn_celery_tasks_in_progress",
+    "Tarefas em execução no worker",
+    ["task"],
+    multiprocess_mode="livesum"
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    cronometra uma etapa e abre o span dela no trace atual: with stage("llm"): ...
+    :return:
+    """
+    with span(name), STAGE_LATENCY.labels(stage=name).time():
+        yield
+
+
+def error(component: str, e: Union[BaseException, str]) -> None:
+    ERRORS.labels(component=component, type=e if isinstance(e, str) else type(e).__name__).inc()
+
+
+def usage(model: str, prompt_tokens: int = 0, completion_tokens: int = 0, cost: float = 0.0) -> None:
+    TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+    TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
+    COST.labels(model=model).inc(cost)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    duração de cada comando enviado ao Mongo (pymongo e Motor), registrada como a etapa mongo
+    """
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        return None
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        STAGE_LATENCY.labels(stage="mongo").observe(event.duration_micros / 1e6)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        STAGE_LATENCY.labels(stage="mongo").observe(event.duration_micros / 1e6)
+        error("mongo", event.failure.get("codeName") or "CommandFailed")
+
+
+class QueueCollector(Collector):
+    """
+    profundidade das filas do Celery, lida do broker no momento da coleta (com cache curto,
+    para vários scrapes não abrirem uma conexão cada)
+    """
+    def __init__(self, celery: Celery, ttl: float = None):
+        self.celery = celery
+        self.ttl: float = env.METRICS_QUEUE_CACHE_SECONDS if ttl is None else ttl
+        self.lock = Lock()
+        self.checked_at = float("-inf")
+        self.depths: Dict[str, Tuple[int, int]] = {}
+
+    def queues(self) -> List[str]:
+        queues = self.celery.conf.task_queues
+        return [queue.name for queue in queues] if queues else [self.celery.conf.task_default_queue]
+
+    def measure(self) -> Dict[str, Tuple[int, int]]:
+        depths: Dict[str, Tuple[int, int]] = {}
+        with self.celery.connection_for_read() as connection:
+            connection.ensure_connection(max_retries=1)
+            channel = connection.default_channel
+            for queue in self.queues():
+                try:
+                    _, messages, consumers = channel.queue_declare(queue=queue, passive=True)
+                except Exception as e:
+                    # fila ainda não declarada: nenhum worker nem mensagem
+                    logger.debug(e)
+                    messages, consumers = 0, 0
+                    channel = connection.channel()
+                depths[queue] = (messages, consumers)
+        return depths
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        with self.lock:
+            if monotonic() - self.checked_at >= self.ttl:
+                try:
+                    self.depths = self.measure()
+                except Exception as e:
+                    logger.warning(f"Unable to read Celery queue depth: {e}")
+                    error("broker", e)
+                    self.depths = {}
+                self.checked_at = monotonic()
+            depths = dict(self.depths)
+
+        messages = GaugeMetricFamily("learn_celery_queue_messages", "Mensagens aguardando na fila do Celery",
+                                     labels=["queue"])
+        consumers = GaugeMetricFamily("learn_celery_queue_consumers", "Consumidores conectados à fila do Celery",
+                                      labels=["queue"])
+        for queue, (count, consumer_count) in depths.items():
+            messages.add_metric([queue], count)
+            consumers.add_metric([queue], consumer_count)
+        yield messages
+        yield consumers
+
+    def describe(self) -> List:
+        # sem describe a coleta não roda no registro (evita conectar ao broker na importação)
+        return []
+
+
+def registry(*collectors: Collector) -> CollectorRegistry:
+    """
+    registro exposto: o padrão do processo ou, com PROMETHEUS_MULTIPROC_DIR (worker prefork,
+    vários workers do uvicorn), o agregado de todos os processos
+    :return:
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    for collector in collectors:
+        registry.register(collector)
+    return registry
+
+
+def mark_process_dead(pid: int) -> None:
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
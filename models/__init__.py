@@ -3,10 +3,13 @@ from .api import (
     AnswerResponse, AnswerRequest, TextToVoiceRequest,
     TextToVoiceResponse, GenQuizRequest, GenQuizResponse,
     VectorFilterRequest, VectorDeleteRequest, VectorDeleteResponse,
-    VectorUsernamesDeleteRequest, VectorUsernamesDeleteResponse
+    VectorUsernamesDeleteRequest, VectorUsernamesDeleteResponse, UpsertBatchRequest,
+    UpsertBatchResponse, VectorDeleteFilter, VectorDeleteJobResponse, VectorDeleteJob,
+    VectorExportRequest, SnapshotExportRequest, SnapshotRestoreRequest, SnapshotJobResponse,
+    SnapshotJob, SnapshotInfo, MigrationRequest, MigrationResponse, Migration
 )
 from .documents import Document
-from .tasks import UpsertTasksDocument, DocumentTasksSearch
+from .tasks import UpsertTasksDocument, DocumentTasksSearch, ChunkTasksDocument
 from .voice import Audio
 from .gen_quiz import GenQuizResponse
 from .vector import (
@@ -1,5 +1,6 @@
-from typing import Optional, List
-from pydantic import BaseModel, Field, AnyUrl
+from datetime import datetime
+from typing import Literal, Optional, List
+from pydantic import BaseModel, Field, AnyUrl, model_validator
 
 
 class UpsertResponse(BaseModel):
@@ -10,6 +11,13 @@ class UpsertRequest(BaseModel):
     username: Optional[str] = Field(None, max_length=56)
     namespace: Optional[str] = Field("default", max_length=32)
 
+class UpsertBatchRequest(BaseModel):
+    documents: List[UpsertRequest] = Field(..., min_length=1, max_length=1000)
+
+class UpsertBatchResponse(BaseModel):
+    success: Optional[bool] = True
+    job_id: Optional[str] = None
+
 class QueryResponse(BaseModel):
     success: Optional[bool] = True
     responses: Optional[List[dict]] = []
@@ -20,6 +28,8 @@ class AnswerResponse(BaseModel):
 
 class TextToVoiceRequest(BaseModel):
     content: Optional[str] = Field(..., max_length=256)
+    stream: Optional[bool] = False
+    save: Optional[bool] = False
 
 class TextToVoiceResponse(BaseModel):
     success: Optional[bool] = True
@@ -51,6 +61,12 @@ class VectorFilterRequest(BaseModel):
     sort: Optional[dict] = {"_id": -1}
     skip: Optional[int] = 0
     limit: Optional[int] = 100
+    # token X-Next-After da página anterior (substitui skip)
+    after: Optional[str] = None
+
+class VectorExportRequest(BaseModel):
+    filter: dict = {}
+    gzip: Optional[bool] = False
 
 class VectorDeleteRequest(BaseModel):
     ids: List[str]
@@ -63,3 +79,119 @@ class VectorUsernamesDeleteRequest(BaseModel):
 
 class VectorUsernamesDeleteResponse(BaseModel):
     success: Optional[bool] = True
+    job_id: Optional[str] = None
+
+class VectorDeleteFilter(BaseModel):
+    usernames: Optional[List[str]] = None
+    namespace: Optional[str] = Field(None, max_length=32)
+    ids: Optional[List[str]] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+
+    @model_validator(mode="after")
+    def not_empty(self) -> "VectorDeleteFilter":
+        # sem nenhum critério a remoção apagaria a base inteira
+        if not any(value is not None for value in self.model_dump().values()):
+            raise ValueError("At least one filter is required")
+        return self
+
+    def query(self) -> dict:
+        query = {}
+        if self.usernames is not None:
+            query["created_by"] = {"$in": self.usernames}
+        if self.namespace is not None:
+            query["namespace"] = self.namespace
+        if self.ids is not None:
+            query["id"] = {"$in": self.ids}
+        if self.created_after is not None or self.created_before is not None:
+            query["created_at"] = {}
+            if self.created_after is not None:
+                query["created_at"]["$gte"] = self.created_after
+            if self.created_before is not None:
+                query["created_at"]["$lt"] = self.created_before
+        return query
+
+class VectorDeleteJobResponse(BaseModel):
+    success: Optional[bool] = True
+    job_id: Optional[str] = None
+
+class VectorDeleteJob(BaseModel):
+    job_id: str
+    state: str
+    filter: dict = {}
+    total: Optional[int] = None
+    deleted: int = 0
+    batches: int = 0
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class SnapshotExportRequest(BaseModel):
+    namespace: Optional[str] = Field("default", max_length=32)
+    # padrão <namespace>-<data e hora>
+    name: Optional[str] = Field(None, pattern=r"^[\w-][\w.-]{0,63}$")
+    dtype: Optional[Literal["float32", "float16"]] = "float32"
+
+class SnapshotRestoreRequest(BaseModel):
+    # padrão o namespace exportado
+    namespace: Optional[str] = Field(None, max_length=32)
+
+class SnapshotJobResponse(BaseModel):
+    success: Optional[bool] = True
+    job_id: Optional[str] = None
+    name: Optional[str] = None
+
+class SnapshotJob(BaseModel):
+    job_id: str
+    kind: str
+    state: str
+    name: str
+    namespace: Optional[str] = None
+    dtype: Optional[str] = None
+    total: Optional[int] = None
+    done: int = 0
+    rows_per_second: Optional[float] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class SnapshotInfo(BaseModel):
+    name: str
+    namespace: str
+    model: str
+    dim: int
+    dtype: str
+    rows: int
+    bytes: int
+    created_at: Optional[datetime] = None
+
+class MigrationRequest(BaseModel):
+    model: str = Field(..., pattern=r"^[\w.-]{1,64}$")
+    # padrão a dimensão nativa do modelo
+    dim: Optional[int] = Field(None, gt=0, le=32768)
+    # partições por namespace da coleção nova (0: uma só, filtrada por expressão);
+    # padrão MILVUS_NAMESPACE_PARTITIONS
+    partitions: Optional[int] = Field(None, ge=0, le=4096)
+
+class MigrationResponse(BaseModel):
+    success: Optional[bool] = True
+    migration_id: Optional[str] = None
+
+class Migration(BaseModel):
+    migration_id: str
+    state: str
+    source: Optional[dict] = None
+    target: dict
+    checkpoint: Optional[str] = None
+    total: Optional[int] = None
+    done: int = 0
+    rows_per_second: Optional[float] = None
+    tokens: int = 0
+    cost: float = 0.0
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    switched_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -11,3 +11,10 @@ class DocumentTasksSearch(BaseModel):
     id: str
     text: str
     namespace: str
+
+class ChunkTasksDocument(BaseModel):
+    id: str
+    text: str
+    namespace: str
+    username: Optional[str] = None
+    tokens: int = 0
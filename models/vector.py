@@ -32,6 +32,7 @@ class AllVectorFactoryRequest(BaseModel):
     sort: dict = {}
     skip: Optional[int] = 0
     limit: Optional[int] = 100
+    after: Optional[str] = None
 
 class AllDeleteVectorFactoryRequest(BaseModel):
     ids: List[str]
@@ -5,3 +5,4 @@ from pydantic import BaseModel
 class Audio(BaseModel):
     success: Optional[bool] = False
     absolute_path: Optional[str] = None
+    url: Optional[str] = None
@@ -1,2 +1,16 @@
+from .chunker import TokenChunker
+from .embeddings import dimensions, embeddings_model
+from .coalescer import EmbeddingCoalescer
+from .embedding_cache import EmbeddingCache, embedding_cache
+from .hot_index import HotIndex, hot_index
+from .lexical import LexicalIndex, lexical_index
 from .milvus import MilvusDataStore, MilvusSearch
+from .deletion import VectorDeletion, delete_batches
+from .progress import Progress
+from .snapshot import NamespaceSnapshots, Snapshot
+from .migration import (
+    ActiveCollection, DualWrite, EmbeddingMigration, MilvusCatalog, active_collection, dual_write
+)
+from .audio_cache import AudioCache, audio_cache
 from .voice import Voice
+from .mp3 import Jingle, jingle
@@ -0,0 +1,137 @@
+import os
+import shutil
+from hashlib import sha256
+from pathlib import Path
+from time import monotonic
+from typing import Dict, List, Tuple, Union
+from uuid import uuid4
+
+from loguru import logger
+from orjson import dumps, OPT_SORT_KEYS
+
+from config import env
+from metrics import CACHE
+
+
+class AudioCache:
+    """
+    cache de áudios endereçado por conteúdo: hash(voz, modelo, configurações, texto normalizado);
+    os arquivos ficam em AUDIO_CACHE_DIR (servido em /files/tts) com limite de tamanho e remoção LRU
+    """
+    def __init__(self, directory: str = None, max_bytes: int = None, resync: float = 60.0):
+        self.directory = Path(env.AUDIO_CACHE_DIR if directory is None else directory)
+        self.max_bytes: int = env.AUDIO_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.hits: int = 0
+        self.misses: int = 0
+        # total em bytes dos áudios, medido no primeiro uso e mantido a cada put; áudios gravados por outros
+        # processos no mesmo diretório entram na conta quando o diretório é medido de novo (numa remoção,
+        # ou a cada resync segundos)
+        self._bytes: Union[int, None] = None
+        self.resync = resync
+        self.measured_at = float("-inf")
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=(self.hits / total) if total > 0 else 0.0,
+            bytes=self.bytes
+        )
+
+    @property
+    def bytes(self) -> int:
+        if self._bytes is None or monotonic() - self.measured_at >= self.resync:
+            self._bytes = sum(size for _, size, _ in self.files())
+            self.measured_at = monotonic()
+        return self._bytes
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split())
+
+    def key(self, voice_id: str, payload: dict, variant: str = "") -> str:
+        return sha256(dumps(
+            [
+                voice_id,
+                payload.get("model_id"),
+                payload.get("voice_settings"),
+                self.normalize(payload.get("text", "")),
+                variant
+            ],
+            option=OPT_SORT_KEYS
+        )).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.mp3"
+
+    @staticmethod
+    def url(key: str) -> str:
+        return f"{env.LEARN_FRONT_END}/files/tts/{key}.mp3"
+
+    def temporary(self, key: str) -> Path:
+        # no mesmo diretório do destino, para a publicação ser um rename atômico
+        return self.directory / f"{key}.{uuid4().hex}.part"
+
+    def get(self, key: str) -> Union[Path, None]:
+        if not env.AUDIO_CACHE_ENABLED:
+            return None
+        path = self.path(key)
+        try:
+            # o mtime marca o último acesso, usado na remoção LRU
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            CACHE.labels(cache="audio", result="miss").inc()
+            return None
+        self.hits += 1
+        CACHE.labels(cache="audio", result="hit").inc()
+        return path
+
+    def put(self, key: str, source: Union[str, Path]) -> Path:
+        path = self.path(key)
+        total = self.bytes
+        try:
+            total -= path.stat().st_size
+        except FileNotFoundError:
+            pass
+        shutil.move(source, path)
+        self._bytes = total + path.stat().st_size
+        # o diretório só é listado quando o contador passa do limite
+        if self._bytes > self.max_bytes:
+            self.evict()
+        return path
+
+    def files(self) -> List[Tuple[float, int, Path]]:
+        files = []
+        for path in self.directory.glob("*.mp3"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def evict(self) -> None:
+        files = self.files()
+        total = sum(size for _, size, _ in files)
+        self._bytes = total
+        self.measured_at = monotonic()
+        if total <= self.max_bytes:
+            return
+        files.sort()
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+                total -= size
+            except FileNotFoundError:
+                continue
+        self._bytes = total
+        logger.info(f"Audio cache evicted to {total} bytes (limit {self.max_bytes}).")
+
+
+audio_cache = AudioCache()
@@ -0,0 +1,225 @@
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import regex
+from tiktoken import Encoding
+
+
+class TokenizedText:
+    """
+    documento tokenizado uma única vez: offset de caractere de cada token e fronteiras
+    dos pré-tokens do tiktoken (o BPE nunca cruza essas fronteiras)
+    """
+    def __init__(self, chunker: "TokenChunker", text: str, tokens: List[int]):
+        self.chunker = chunker
+        self.text = text
+        self.code_points = np.frombuffer(text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+        self.offsets = chunker.offsets(self.code_points, tokens)
+        self.boundaries = chunker.boundaries(text)
+        self.aligned = np.zeros(len(text) + 1, dtype=bool)
+        self.aligned[self.boundaries] = True
+        # cópias em lista para as buscas pontuais (bisect é mais barato que np.searchsorted escalar)
+        self.offset_list: List[int] = self.offsets.tolist()
+        self.boundary_list: List[int] = self.boundaries.tolist()
+
+    def tokens(self, start: int, end: int) -> int:
+        return bisect_left(self.offset_list, end) - bisect_left(self.offset_list, start)
+
+    def count(self, start: int, end: int) -> int:
+        """
+        quantidade de tokens de text[start:end] tokenizado isoladamente
+        :return: len(tokenizer.encode(text[start:end]))
+        """
+        total = 0
+        if not self.aligned[start]:
+            # início no meio de um pré-token: tokeniza até reencontrar uma fronteira do documento
+            for match in self.chunker.pattern.finditer(self.text, start, end):
+                if match.start() > start and self.aligned[match.start()]:
+                    start = match.start()
+                    break
+                total += self.chunker.piece(match.group())
+            else:
+                return total
+
+        # entre fronteiras a contagem é aditiva; só o último pré-token pode mudar com o corte
+        # (fim no meio dele, ou espaço no fim, que muda o pré-token "\s+(?!\S)")
+        i = bisect_right(self.boundary_list, end) - 1
+        last = self.boundary_list[i]
+        if last == end and (end == len(self.text) or not self.text[end - 1].isspace()):
+            return total + self.tokens(start, end)
+        if last == end:
+            last = self.boundary_list[i - 1] if i > 0 else start
+        last = max(last, start)
+        return total + self.tokens(start, last) + self.chunker.piece(self.text[last:end])
+
+    def counts(self, cuts: List[int]) -> List[int]:
+        """
+        contagem de cada pedaço [cuts[i], cuts[i + 1]), vetorizada no caso aditivo
+        :return: lista com len(cuts) - 1 contagens
+        """
+        positions = np.asarray(cuts, dtype=np.int64)
+        additive = np.diff(np.searchsorted(self.offsets, positions)).tolist()
+        aligned = self.aligned[positions].tolist()
+        text = self.text
+        return [
+            additive[i] if aligned[i] and aligned[i + 1] and (b == len(text) or not text[b - 1].isspace())
+            else self.count(cuts[i], b)
+            for i, b in enumerate(cuts[1:])
+        ]
+
+
+class TokenChunker:
+    """
+    mesmo resultado do RecursiveCharacterTextSplitter(keep_separator=True) com
+    length_function de tokens, mas trabalhando sobre offsets do documento tokenizado uma vez
+    """
+    max_pieces = 65536
+    def __init__(self, tokenizer: Encoding, chunk_size: int = 100, chunk_overlap: int = 20,
+                 separators: List[str] = None):
+        self.tokenizer = tokenizer
+        self.pattern = regex.compile(tokenizer._pat_str)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = ["\n\n", "\n", " ", ""] if separators is None else separators
+        self._token_bytes: Union[np.ndarray, None] = None
+        # tokens de cada pré-token avulso (cortes no meio de pré-tokens), limitado a max_pieces
+        self._pieces: Dict[str, int] = {}
+
+    @property
+    def token_bytes(self) -> np.ndarray:
+        # tamanho em bytes de cada token do vocabulário, calculado uma vez por processo
+        if self._token_bytes is None:
+            sizes = np.zeros(self.tokenizer.n_vocab, dtype=np.int64)
+            for token in range(self.tokenizer.n_vocab):
+                try:
+                    sizes[token] = len(self.tokenizer.decode_single_token_bytes(token))
+                except KeyError:
+                    continue
+            self._token_bytes = sizes
+        return self._token_bytes
+
+    def offsets(self, code_points: np.ndarray, tokens: List[int]) -> np.ndarray:
+        # offset de caractere em que cada token começa (o que decode_with_offsets faz, vetorizado)
+        if not tokens:
+            return np.zeros(0, dtype=np.int64)
+        char_bytes = np.zeros(len(code_points) + 1, dtype=np.int64)
+        np.cumsum(
+            1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000),
+            out=char_bytes[1:]
+        )
+        sizes = self.token_bytes[np.asarray(tokens, dtype=np.int64)]
+        starts = np.cumsum(sizes) - sizes
+        return np.searchsorted(char_bytes, starts, side="right") - 1
+
+    def boundaries(self, text: str) -> np.ndarray:
+        # os pré-tokens cobrem o texto inteiro: as fronteiras saem da soma acumulada dos tamanhos
+        sizes = np.fromiter(map(len, self.pattern.findall(text)), dtype=np.int64)
+        if sizes.sum() != len(text):
+            return np.asarray([match.start() for match in self.pattern.finditer(text)] + [len(text)], dtype=np.int64)
+        boundaries = np.zeros(len(sizes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=boundaries[1:])
+        return boundaries
+
+    def piece(self, text: str) -> int:
+        count = self._pieces.get(text)
+        if count is None:
+            if len(self._pieces) >= self.max_pieces:
+                self._pieces.clear()
+            count = self._pieces[text] = len(self.tokenizer.encode_ordinary(text))
+        return count
+
+    def tokenize(self, text: str) -> TokenizedText:
+        return TokenizedText(self, text, self.tokenizer.encode_ordinary(text))
+
+    def tokenize_batch(self, texts: List[str]) -> List[TokenizedText]:
+        return [
+            TokenizedText(self, text, tokens)
+            for text, tokens in zip(texts, self.tokenizer.encode_ordinary_batch(texts))
+        ]
+
+    def split_text(self, text: str) -> List[str]:
+        return [chunk for chunk, _ in self.split(self.tokenize(text))]
+
+    def split_texts(self, texts: List[str]) -> List[List[Tuple[str, int]]]:
+        """
+        modo em lote: tokeniza todos os documentos com encode_ordinary_batch
+        :return: por documento, lista de (chunk, tokens do chunk)
+        """
+        return [self.split(document) for document in self.tokenize_batch(texts)]
+
+    def split(self, document: TokenizedText) -> List[Tuple[str, int]]:
+        chunks: List[Tuple[str, int]] = []
+        for start, end in self._split(document, 0, len(document.text), self.separators):
+            text = document.text[start:end]
+            stripped = text.strip()
+            if stripped == "":
+                continue
+            start += len(text) - len(text.lstrip())
+            chunks.append((stripped, document.count(start, start + len(stripped))))
+        return chunks
+
+    @staticmethod
+    def cuts(document: TokenizedText, start: int, end: int, separator: str) -> List[int]:
+        # como re.split com o separador mantido no início de cada pedaço
+        if separator == "":
+            return list(range(start, end + 1))
+        if len(separator) == 1:
+            positions = np.flatnonzero(document.code_points[start:end] == ord(separator)) + start
+            cuts = [start] + positions.tolist() + [end]
+        else:
+            cuts = [start]
+            position = document.text.find(separator, start, end)
+            while position != -1:
+                cuts.append(position)
+                position = document.text.find(separator, position + len(separator), end)
+            cuts.append(end)
+        return [cut for i, cut in enumerate(cuts) if i == 0 or cut > cuts[i - 1]]
+
+    def _split(self, document: TokenizedText, start: int, end: int,
+               separators: List[str]) -> List[Tuple[int, int]]:
+        text = document.text
+        separator = separators[-1]
+        new_separators: List[str] = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = candidate
+                break
+            if text.find(candidate, start, end) != -1:
+                separator = candidate
+                new_separators = separators[i + 1:]
+                break
+
+        spans: List[Tuple[int, int]] = []
+        good: List[Tuple[int, int, int]] = []
+        cuts = self.cuts(document, start, end, separator)
+        for a, b, length in zip(cuts, cuts[1:], document.counts(cuts)):
+            if length < self.chunk_size:
+                good.append((a, b, length))
+                continue
+            if good:
+                spans.extend(self.merge(good))
+                good = []
+            if not new_separators:
+                spans.append((a, b))
+            else:
+                spans.extend(self._split(document, a, b, new_separators))
+        if good:
+            spans.extend(self.merge(good))
+        return spans
+
+    def merge(self, pieces: List[Tuple[int, int, int]]) -> List[Tuple[int, int]]:
+        # pedaços contíguos: cada chunk é o intervalo do primeiro ao último pedaço da janela
+        spans: List[Tuple[int, int]] = []
+        first = 0
+        total = 0
+        for i, (_, _, length) in enumerate(pieces):
+            if total + length > self.chunk_size:
+                if i > first:
+                    spans.append((pieces[first][0], pieces[i - 1][1]))
+                    while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                        total -= pieces[first][2]
+                        first += 1
+            total += length
+        spans.append((pieces[first][0], pieces[-1][1]))
+        return spans
@@ -0,0 +1,81 @@
+import asyncio
+from typing import Dict, List, Tuple, Union
+
+from langchain_openai import OpenAIEmbeddings
+from loguru import logger
+
+from config import env
+
+
+class EmbeddingCoalescer:
+    """
+    agrupa consultas de embedding que chegam dentro de uma janela curta
+    em uma única chamada em lote ao provedor
+    """
+    def __init__(self, embeddings_model: OpenAIEmbeddings, window: float = None, max_items: int = None,
+                 timeout: float = None):
+        self.embeddings_model = embeddings_model
+        self.window: float = (env.EMBEDDING_COALESCE_WINDOW_MS if window is None else window) / 1000
+        self.max_items: int = env.EMBEDDING_COALESCE_MAX_ITEMS if max_items is None else max_items
+        self.timeout: float = env.EMBEDDING_COALESCE_TIMEOUT if timeout is None else timeout
+        self.queue: List[Tuple[str, asyncio.Future]] = []
+        self.flusher: Union[asyncio.TimerHandle, None] = None
+        self.tasks: set = set()
+        self.batches: int = 0
+        self.items: int = 0
+
+    @property
+    def model(self) -> str:
+        return self.embeddings_model.model
+
+    @property
+    def model_kwargs(self) -> Dict:
+        return self.embeddings_model.model_kwargs
+
+    async def aembed_query(self, query: str) -> List[float]:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append((query, future))
+        if len(self.queue) >= self.max_items:
+            self.flush()
+        elif self.flusher is None:
+            self.flusher = asyncio.get_running_loop().call_later(self.window, self.flush)
+        # shield: o timeout de uma requisição não cancela o lote dos demais
+        return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+
+    def flush(self) -> None:
+        if self.flusher is not None:
+            self.flusher.cancel()
+            self.flusher = None
+        if not self.queue:
+            return
+        batch, self.queue = self.queue, []
+        task = asyncio.create_task(self.embed(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def embed(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            embeddings = await self.embeddings_model.aembed_documents([query for query, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self.resolve(batch[0][1], exception=e)
+                return
+            # isola o erro: reenvia individualmente para que só a entrada inválida falhe
+            logger.warning(f"Coalesced embedding batch of {len(batch)} failed ({e}); retrying individually.")
+            await asyncio.gather(*[self.embed([item]) for item in batch])
+            return
+        for (_, future), embedding in zip(batch, embeddings):
+            self.resolve(future, result=embedding)
+
+    @staticmethod
+    def resolve(future: asyncio.Future, result: List[float] = None, exception: Exception = None) -> None:
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+            # quem aguardava pode já ter desistido por timeout
+            future.exception()
+        else:
+            future.set_result(result)
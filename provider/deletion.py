@@ -0,0 +1,74 @@
+from typing import Dict, List
+
+from loguru import logger
+from pymilvus import Collection
+
+from config import env
+from factory import DeletionJobFactory, VectorFactory
+from metrics import stage
+from models import VectorDeleteFilter
+from .migration import dual_write
+
+
+def delete_batches(collection: Collection, ids: List[str], size: int = None, ns: str = None) -> None:
+    # expressões "id in [...]" limitadas a DELETE_BATCH_SIZE ids cada; com o namespace conhecido,
+    # a remoção fica restrita à partição dele
+    size = env.DELETE_BATCH_SIZE if size is None else size
+    scope = "" if ns is None else f"ns == \"{ns}\" and "
+    for i in range(0, len(ids), size):
+        batch = ids[i:i + size]
+        with stage("milvus_delete"):
+            result = collection.delete(expr=f"{scope}id in {str(batch)}")
+            # ids gravados no Milvus em outro namespace (ex.: upsert interrompido antes do Mongo): sem o escopo
+            if scope and result.delete_count < len(batch):
+                collection.delete(expr=f"id in {str(batch)}")
+
+
+class VectorDeletion:
+    """
+    remoção por filtro (usuários, namespace, ids, intervalo de created_at) sem limite de quantidade:
+    os ids saem do Mongo em páginas e cada página é removida do Milvus e depois do Mongo,
+    de modo que uma falha no meio deixa o restante para o retry encontrar
+    """
+    def __init__(self, collection: Collection, vector_factory: VectorFactory = None,
+                 jobs: DeletionJobFactory = None, batch_size: int = None):
+        self.collection = collection
+        self.vectorFactory = VectorFactory() if vector_factory is None else vector_factory
+        self.jobs = DeletionJobFactory() if jobs is None else jobs
+        self.batch_size: int = env.DELETE_BATCH_SIZE if batch_size is None else batch_size
+
+    def delete_page(self, page: List[Dict]) -> int:
+        namespaces: Dict[str, List[str]] = {}
+        for vec in page:
+            if vec.get("id") is not None:
+                namespaces.setdefault(vec.get("namespace"), []).append(vec["id"])
+        for namespace, ids in namespaces.items():
+            delete_batches(self.collection, ids, self.batch_size, namespace)
+            dual_write.delete(ids, namespace)
+        deleted = self.vectorFactory.mongo.delete_many({"_id": {"$in": [vec["_id"] for vec in page]}})
+
+        # invalida os caches (respostas, índice lexical, índice em memória) dos namespaces alterados
+        for namespace, namespace_ids in namespaces.items():
+            self.vectorFactory.namespaceFactory.publish(namespace, deleted=namespace_ids)
+        return deleted
+
+    def run(self, job_id: str, filter: VectorDeleteFilter) -> int:
+        """
+        executa o job de remoção, registrando o progresso a cada página
+        :return: quantidade de vetores removidos nesta execução
+        """
+        query = filter.query()
+        self.jobs.start(job_id, self.vectorFactory.mongo.count(query))
+
+        deleted = 0
+        for page in self.vectorFactory.mongo.pages(
+            query, {"_id": 1, "id": 1, "namespace": 1}, size=self.batch_size
+        ):
+            count = self.delete_page(page)
+            deleted += count
+            self.jobs.progress(job_id, count)
+
+        self.jobs.finish(job_id)
+        logger.info(f"[{job_id}] Deletion finished; filter: {filter.model_dump(exclude_none=True)}; "
+                    f"vectors: {deleted}")
+        return deleted
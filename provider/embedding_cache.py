@@ -0,0 +1,179 @@
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from hashlib import md5
+from time import monotonic
+from typing import List, Dict, Tuple, Union
+
+from langchain_openai import OpenAIEmbeddings
+from loguru import logger
+
+from config import env
+from databases import INDEXES, AsyncMongo
+from metrics import CACHE, error, stage
+from .coalescer import EmbeddingCoalescer
+from .embeddings import signature
+
+
+class EmbeddingCache:
+    """
+    cache de embeddings de consultas em dois níveis:
+    LRU em memória (por processo) + coleção compartilhada no Mongo (todos os workers)
+    """
+    def __init__(self, model: str = None, maxsize: int = None, ttl: int = None, collection: str = "embeddings"):
+        self.model: str = env.OPENAI_EMBEDDING_MODEL if model is None else model
+        self.maxsize: int = env.EMBEDDING_CACHE_SIZE if maxsize is None else maxsize
+        self.ttl: int = env.EMBEDDING_CACHE_TTL if ttl is None else ttl
+        self.collection = collection
+        self.entries: OrderedDict[str, Tuple[float, List[float]]] = OrderedDict()
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.hits: int = 0
+        self.shared_hits: int = 0
+        self.misses: int = 0
+        self._mongo: Union[AsyncMongo, None] = None
+        self._ready: bool = False
+
+    @property
+    def mongo(self) -> AsyncMongo:
+        # criado sob demanda, para não abrir conexões antes do fork dos workers
+        if self._mongo is None:
+            self._mongo = AsyncMongo(self.collection)
+        return self._mongo
+
+    def use(self, mongo: AsyncMongo) -> None:
+        self._mongo = mongo
+        self._ready = False
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.split()).casefold()
+
+    def key(self, query: str) -> str:
+        return md5(f"{self.model}:{self.normalize(query)}".encode()).hexdigest()
+
+    @property
+    def stats(self) -> Dict:
+        total = self.hits + self.shared_hits + self.misses
+        return dict(
+            model=self.model,
+            size=len(self.entries),
+            hits=self.hits,
+            shared_hits=self.shared_hits,
+            misses=self.misses,
+            hit_rate=((self.hits + self.shared_hits) / total) if total > 0 else 0.0
+        )
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def invalidate(self, model: str) -> None:
+        logger.info(f"Embedding model changed ({self.model} -> {model}); invalidating query embedding cache.")
+        self.model = model
+        self.clear()
+        self._ready = False
+
+    async def setup(self) -> None:
+        if self._ready:
+            return
+        self._ready = True
+        try:
+            # a coleção do cache é configurável; os índices são os declarados para "embeddings"
+            await self.mongo.collection.create_indexes(INDEXES["embeddings"])
+            deleted = await self.mongo.delete_many({"model": {"$ne": self.model}})
+            if deleted > 0:
+                logger.info(f"Embedding cache: {deleted} entries from other models removed.")
+        except Exception as e:
+            logger.error(e)
+
+    def get_local(self, key: str) -> Union[List[float], None]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, embedding = entry
+        if expires < monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return embedding
+
+    def set_local(self, key: str, embedding: List[float]) -> None:
+        self.entries[key] = (monotonic() + self.ttl, embedding)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    async def get_shared(self, key: str) -> Union[List[float], None]:
+        try:
+            doc = await self.mongo.select({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+        except Exception as e:
+            logger.error(e)
+            error("embedding_cache", e)
+            return None
+        if doc is None:
+            return None
+        return doc.get("embedding")
+
+    async def set_shared(self, key: str, query: str, embedding: List[float]) -> None:
+        try:
+            await self.mongo.upsert_one(
+                {"_id": key},
+                {
+                    "model": self.model,
+                    "query": self.normalize(query),
+                    "embedding": embedding,
+                    "expires_at": datetime.utcnow() + timedelta(seconds=self.ttl)
+                }
+            )
+        except Exception as e:
+            logger.error(e)
+            error("embedding_cache", e)
+
+    async def aembed_query(self, query: str,
+                           embeddings_model: Union[OpenAIEmbeddings, EmbeddingCoalescer]) -> List[float]:
+        if not env.EMBEDDING_CACHE_ENABLED:
+            with stage("embedding"):
+                return await embeddings_model.aembed_query(query)
+
+        if signature(embeddings_model) != self.model:
+            self.invalidate(signature(embeddings_model))
+        await self.setup()
+
+        key = self.key(query)
+        embedding = self.get_local(key)
+        if embedding is not None:
+            self.hits += 1
+            CACHE.labels(cache="embedding", result="hit").inc()
+            return embedding
+
+        # consultas idênticas simultâneas aguardam o mesmo embedding
+        if key in self.pending:
+            self.hits += 1
+            CACHE.labels(cache="embedding", result="hit").inc()
+            return await asyncio.shield(self.pending[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = future
+        try:
+            embedding = await self.get_shared(key)
+            if embedding is not None:
+                self.shared_hits += 1
+                CACHE.labels(cache="embedding", result="shared_hit").inc()
+            else:
+                self.misses += 1
+                CACHE.labels(cache="embedding", result="miss").inc()
+                with stage("embedding"):
+                    embedding = await embeddings_model.aembed_query(query)
+                await self.set_shared(key, query, embedding)
+            self.set_local(key, embedding)
+            future.set_result(embedding)
+            return embedding
+        except Exception as e:
+            future.set_exception(e)
+            # evita "Future exception was never retrieved" quando ninguém aguardava
+            future.exception()
+            raise
+        finally:
+            del self.pending[key]
+
+
+embedding_cache = EmbeddingCache()
@@ -0,0 +1,75 @@
+from typing import Dict, Iterator, List, Union
+
+from langchain_openai import OpenAIEmbeddings
+
+from config import env
+from models import ChunkTasksDocument
+
+# dimensão nativa de cada modelo; os text-embedding-3-* também geram vetores menores (parâmetro dimensions)
+DIMENSIONS: Dict[str, int] = {
+    "text-embedding-ada-002": 1536,
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+}
+# US$ por 1K tokens (o langchain só conhece os preços dos modelos de chat)
+PRICES: Dict[str, float] = {
+    "text-embedding-ada-002": 0.0001,
+    "text-embedding-3-small": 0.00002,
+    "text-embedding-3-large": 0.00013,
+}
+
+
+def dimensions(model: str, dim: int = None) -> int:
+    """
+    dimensão dos embeddings do modelo: a nativa ou dim, se o modelo aceitar reduzi-la
+    :return:
+    """
+    native = DIMENSIONS.get(model)
+    if dim is None:
+        if native is None:
+            raise ValueError(f"Unknown dimension for embedding model {model}; set dim")
+        return native
+    if native is not None and dim != native and (not model.startswith("text-embedding-3") or dim > native):
+        raise ValueError(f"{model} does not produce {dim}-dim embeddings (native: {native})")
+    return dim
+
+
+def embeddings_model(model: str = None, dim: int = None) -> OpenAIEmbeddings:
+    model = env.OPENAI_EMBEDDING_MODEL if model is None else model
+    return OpenAIEmbeddings(
+        model=model,
+        openai_api_key=env.OPENAI_API_KEY,
+        # o parâmetro só vai para a API quando a dimensão não é a nativa
+        model_kwargs={} if dim is None or dim == DIMENSIONS.get(model) else {"dimensions": dim}
+    )
+
+
+def signature(embeddings_model: OpenAIEmbeddings) -> str:
+    # o mesmo modelo em outra dimensão gera vetores de outro espaço
+    dim = embeddings_model.model_kwargs.get("dimensions")
+    return embeddings_model.model if dim is None else f"{embeddings_model.model}:{dim}"
+
+
+def cost(model: str, tokens: int) -> float:
+    return tokens / 1000 * PRICES.get(model, 0.0)
+
+
+def embedding_batches(chunks: List[ChunkTasksDocument],
+                      max_inputs: Union[int, None] = None) -> Iterator[List[ChunkTasksDocument]]:
+    """
+    lotes de até EMBEDDING_BATCH_MAX_INPUTS textos e EMBEDDING_BATCH_MAX_TOKENS tokens
+    :param max_inputs: limite menor (chunk_size do cliente), para cada lote virar uma única requisição
+    :return:
+    """
+    max_inputs = env.EMBEDDING_BATCH_MAX_INPUTS if max_inputs is None else min(env.EMBEDDING_BATCH_MAX_INPUTS,
+                                                                               max_inputs)
+    batch: List[ChunkTasksDocument] = []
+    tokens = 0
+    for chunk in chunks:
+        if batch and (len(batch) >= max_inputs or tokens + chunk.tokens > env.EMBEDDING_BATCH_MAX_TOKENS):
+            yield batch
+            batch, tokens = [], 0
+        batch.append(chunk)
+        tokens += chunk.tokens
+    if batch:
+        yield batch
@@ -0,0 +1,260 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic
+from typing import Dict, List, Set, Union
+
+import numpy as np
+from loguru import logger
+from pymilvus import Collection
+
+from config import env
+from factory import NamespaceFactory
+from metrics import CACHE
+from models import DocumentTasksSearch
+from .incremental import IncrementalIndex
+
+
+class NamespaceMatrix:
+    """
+    embeddings normalizados de um namespace numa matriz float32 contígua (com folga para crescer),
+    mais ids e textos na mesma ordem das linhas
+    """
+    def __init__(self, version: int, dim: int, capacity: int = 64):
+        self.version = version
+        self.checked_at = monotonic()
+        self.gap_since: Union[float, None] = None
+        self.matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self.size = 0
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.rows: Dict[str, int] = {}
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes + sum(len(text) for text in self.texts) + 64 * len(self.ids)
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def upsert(self, ids: List[str], texts: List[str], embeddings: List[List[float]]) -> None:
+        if not ids:
+            return
+        vectors = self.normalize(np.asarray(embeddings, dtype=np.float32))
+        for id, text, vector in zip(ids, texts, vectors):
+            row = self.rows.get(id)
+            if row is None:
+                if self.size == len(self.matrix):
+                    matrix = np.zeros((len(self.matrix) * 2, self.matrix.shape[1]), dtype=np.float32)
+                    matrix[:self.size] = self.matrix[:self.size]
+                    self.matrix = matrix
+                row = self.size
+                self.size += 1
+                self.rows[id] = row
+                self.ids.append(id)
+                self.texts.append(text)
+            else:
+                self.texts[row] = text
+            self.matrix[row] = vector
+
+    def delete(self, ids: List[str]) -> None:
+        for id in ids:
+            row = self.rows.pop(id, None)
+            if row is None:
+                continue
+            # remove trocando pela última linha, mantendo a matriz contígua
+            last = self.size - 1
+            if row != last:
+                self.matrix[row] = self.matrix[last]
+                self.ids[row] = self.ids[last]
+                self.texts[row] = self.texts[last]
+                self.rows[self.ids[row]] = row
+            self.ids.pop()
+            self.texts.pop()
+            self.size -= 1
+
+    def search(self, embedding: List[float], k: int) -> List[int]:
+        if self.size == 0 or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        scores = self.matrix[:self.size] @ (query / norm if norm > 0 else query)
+        if self.size > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(self.size)
+        return top[np.argsort(-scores[top], kind="stable")].tolist()
+
+
+class HotIndex(IncrementalIndex):
+    """
+    índice em memória para namespaces pequenos: top-k por cosseno com um produto matriz-vetor,
+    sem ida ao Milvus (que continua sendo a fonte da verdade e atende os namespaces grandes);
+    atualizado incrementalmente pelos eventos de upsert/remoção do namespace
+    """
+    def __init__(self, max_vectors: int = None, max_bytes: int = None, refresh: float = None):
+        self.max_vectors: int = env.HOT_INDEX_MAX_VECTORS if max_vectors is None else max_vectors
+        self.max_bytes: int = env.HOT_INDEX_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.refresh: float = env.HOT_INDEX_REFRESH_SECONDS if refresh is None else refresh
+        self.indexes: OrderedDict[str, NamespaceMatrix] = OrderedDict()
+        # namespaces grandes demais, com o instante em que foram medidos (revistos de tempos em tempos)
+        self.cold: Dict[str, float] = {}
+        self.loading: Set[str] = set()
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.tasks: Set[asyncio.Task] = set()
+        self.collection: Union[Collection, None] = None
+        self.namespaceFactory: Union[NamespaceFactory, None] = None
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def use(self, collection: Collection, namespace_factory: NamespaceFactory) -> None:
+        self.collection = collection
+        self.namespaceFactory = namespace_factory
+        self.clear()
+
+    def clear(self) -> None:
+        self.indexes.clear()
+        self.cold.clear()
+
+    @property
+    def stats(self) -> Dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            bytes=sum(index.nbytes for index in self.indexes.values()),
+            namespaces={
+                namespace: dict(vectors=index.size, bytes=index.nbytes, version=index.version)
+                for namespace, index in self.indexes.items()
+            }
+        )
+
+    def fetch(self, expr: str) -> List[Dict]:
+        rows: List[Dict] = []
+        iterator = self.collection.query_iterator(
+            batch_size=1000, expr=expr, output_fields=["id", "text", "ns", "embedding"]
+        )
+        try:
+            while batch := iterator.next():
+                rows.extend(batch)
+        finally:
+            iterator.close()
+        return rows
+
+    def count(self, namespace: str) -> int:
+        result = self.collection.query(expr=f"ns == \"{namespace}\"", output_fields=["count(*)"])
+        return result[0]["count(*)"] if result else 0
+
+    def load(self, namespace: str, version: int) -> Union[NamespaceMatrix, None]:
+        if self.count(namespace) > self.max_vectors:
+            return None
+        rows = self.fetch(f"ns == \"{namespace}\"")
+        # pela dimensão gravada: o schema do objeto Collection não muda quando o alias troca de coleção
+        dim = len(rows[0]["embedding"]) if rows else next(
+            field.params["dim"] for field in self.collection.schema.fields if field.name == "embedding"
+        )
+        index = NamespaceMatrix(version, dim=dim, capacity=max(64, len(rows)))
+        index.upsert([row["id"] for row in rows], [row["text"] for row in rows], [row["embedding"] for row in rows])
+        return index
+
+    async def aload(self, namespace: str) -> None:
+        try:
+            version = await self.namespaceFactory.aversion(namespace)
+            index = await asyncio.to_thread(self.load, namespace, version)
+            if index is None:
+                self.cold[namespace] = monotonic()
+                logger.info(f"Namespace {namespace} exceeds {self.max_vectors} vectors; served by Milvus.")
+                return
+            self.indexes[namespace] = index
+            self.evict()
+            logger.info(f"Hot index for namespace {namespace} loaded; vectors: {index.size}; "
+                        f"memory: {index.nbytes / 1024 / 1024:.1f} MB; version: {version}")
+        except Exception as e:
+            logger.error(e)
+        finally:
+            self.loading.discard(namespace)
+
+    def evict(self) -> None:
+        total = sum(index.nbytes for index in self.indexes.values())
+        while total > self.max_bytes and len(self.indexes) > 1:
+            namespace, index = self.indexes.popitem(last=False)
+            total -= index.nbytes
+            logger.info(f"Hot index for namespace {namespace} evicted ({index.nbytes} bytes).")
+
+    async def reload(self, namespace: str, version: int) -> Union[NamespaceMatrix, None]:
+        return await asyncio.to_thread(self.load, namespace, version)
+
+    async def patch(self, namespace: str, index: NamespaceMatrix, upserted: Set[str],
+                    deleted: Set[str]) -> Union[NamespaceMatrix, None]:
+        """
+        aplica à matriz os vetores gravados (lidos do Milvus) e removidos pelos eventos
+        :return: None quando o namespace deve sair do índice em memória
+        """
+        if upserted:
+            rows = await asyncio.to_thread(self.fetch, f"id in {str(sorted(upserted))}")
+            rows = [row for row in rows if row["ns"] == namespace]
+            index.upsert([row["id"] for row in rows], [row["text"] for row in rows], [row["embedding"] for row in rows])
+        index.delete(list(deleted))
+        if index.size > self.max_vectors:
+            self.cold[namespace] = monotonic()
+            return None
+        return index
+
+    async def refresh_namespace(self, namespace: str, index: NamespaceMatrix) -> None:
+        lock = self.locks.setdefault(namespace, asyncio.Lock())
+        if lock.locked():
+            return
+        async with lock:
+            try:
+                updated = await self.apply(namespace, index)
+            except Exception as e:
+                logger.error(e)
+                return
+            if updated is None:
+                self.indexes.pop(namespace, None)
+            else:
+                self.indexes[namespace] = updated
+
+    def schedule(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def asearch(self, embedding: List[float], k: int = 3,
+                      ns: str = "default") -> Union[List[DocumentTasksSearch], None]:
+        """
+        busca no índice em memória
+        :return: None quando o namespace não está carregado (a busca segue para o Milvus)
+        """
+        if not env.HOT_INDEX_ENABLED or self.collection is None:
+            return None
+
+        index = self.indexes.get(ns)
+        if index is None:
+            self.misses += 1
+            CACHE.labels(cache="hot_index", result="miss").inc()
+            if ns not in self.loading and monotonic() - self.cold.get(ns, float("-inf")) > self.refresh * 30:
+                # carrega em segundo plano; esta consulta vai ao Milvus
+                self.loading.add(ns)
+                self.schedule(self.aload(ns))
+            return None
+
+        if monotonic() - index.checked_at >= self.refresh:
+            await self.refresh_namespace(ns, index)
+            index = self.indexes.get(ns)
+            if index is None:
+                self.misses += 1
+                CACHE.labels(cache="hot_index", result="miss").inc()
+                return None
+
+        self.indexes.move_to_end(ns)
+        self.hits += 1
+        CACHE.labels(cache="hot_index", result="hit").inc()
+        return [
+            DocumentTasksSearch(id=index.ids[row], text=index.texts[row], namespace=ns)
+            for row in index.search(embedding, k)
+        ]
+
+
+hot_index = HotIndex()
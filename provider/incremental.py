@@ -0,0 +1,57 @@
+from time import monotonic
+from typing import Any, Set, Union
+
+from factory import NamespaceFactory
+
+
+class IncrementalIndex:
+    """
+    base dos índices em memória por namespace (hot_index e lexical) atualizados incrementalmente pelos eventos
+    de upsert/remoção do namespace (namespace_events); os índices guardam version, checked_at e gap_since
+    e as subclasses implementam reload (monta o namespace inteiro) e patch (aplica ids gravados e removidos)
+    """
+    namespaceFactory: NamespaceFactory
+    refresh: float
+
+    async def reload(self, namespace: str, version: int) -> Union[Any, None]:
+        raise NotImplementedError
+
+    async def patch(self, namespace: str, index: Any, upserted: Set[str], deleted: Set[str]) -> Union[Any, None]:
+        raise NotImplementedError
+
+    async def apply(self, namespace: str, index: Any) -> Union[Any, None]:
+        """
+        aplica em ordem os eventos posteriores à versão do índice; um buraco na sequência
+        (evento ainda não gravado) espera a próxima verificação e, se persistir, recarrega o namespace
+        :return: None quando o namespace deve sair do índice em memória
+        """
+        version = await self.namespaceFactory.aversion(namespace)
+        index.checked_at = monotonic()
+        if version == index.version:
+            return index
+
+        upserted: Set[str] = set()
+        deleted: Set[str] = set()
+        applied = index.version
+        for event in await self.namespaceFactory.aevents(namespace, after=index.version):
+            if event["version"] != applied + 1:
+                break
+            applied = event["version"]
+            upserted.difference_update(event.get("deleted", []))
+            deleted.update(event.get("deleted", []))
+            deleted.difference_update(event.get("upserted", []))
+            upserted.update(event.get("upserted", []))
+
+        if applied == index.version:
+            if index.gap_since is None:
+                index.gap_since = monotonic()
+            elif monotonic() - index.gap_since > self.refresh * 10:
+                # evento perdido (ou expirado): recarrega tudo
+                return await self.reload(namespace, version)
+            return index
+        index.gap_since = None
+
+        index = await self.patch(namespace, index, upserted, deleted)
+        if index is not None:
+            index.version = applied
+        return index
@@ -0,0 +1,291 @@
+import asyncio
+import re
+import unicodedata
+from collections import Counter, OrderedDict
+from math import log
+from time import monotonic
+from typing import Dict, List, Set, Tuple, Union
+
+import numpy as np
+from loguru import logger
+
+from config import env
+from databases import AsyncMongo, Mongo
+from factory import NamespaceFactory
+from metrics import error, stage
+from models import DocumentTasksSearch
+from .incremental import IncrementalIndex
+
+
+class NamespaceIndex:
+    """
+    índice invertido BM25 de um namespace: postings (linha do documento -> frequência) por termo, atualizados
+    documento a documento; os arrays usados na busca são montados por termo e refeitos só quando o termo muda
+    """
+    def __init__(self, version: int, documents: Dict[str, str]):
+        self.version = version
+        self.checked_at = monotonic()
+        self.gap_since: Union[float, None] = None
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.counts: List[Counter] = []
+        self.sizes: List[int] = []
+        self.total = 0
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._lengths: Union[np.ndarray, None] = None
+        self.upsert(documents)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        if self._lengths is None:
+            self._lengths = np.asarray(self.sizes, dtype=np.float32)
+        return self._lengths
+
+    @property
+    def average(self) -> float:
+        return self.total / len(self.ids) if self.ids else 0.0
+
+    def posting(self, term: str) -> Union[Tuple[np.ndarray, np.ndarray], None]:
+        posting = self.arrays.get(term)
+        if posting is None:
+            rows = self.postings.get(term)
+            if rows is None:
+                return None
+            posting = (
+                np.fromiter(rows.keys(), dtype=np.int32, count=len(rows)),
+                np.fromiter(rows.values(), dtype=np.float32, count=len(rows))
+            )
+            self.arrays[term] = posting
+        return posting
+
+    def link(self, row: int, terms: Counter) -> None:
+        self.counts[row] = terms
+        self.sizes[row] = sum(terms.values())
+        self.total += self.sizes[row]
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[row] = frequency
+            self.arrays.pop(term, None)
+
+    def unlink(self, row: int) -> None:
+        for term in self.counts[row]:
+            rows = self.postings[term]
+            del rows[row]
+            if not rows:
+                del self.postings[term]
+            self.arrays.pop(term, None)
+        self.total -= self.sizes[row]
+
+    def upsert(self, documents: Dict[str, str]) -> None:
+        for id, text in documents.items():
+            row = self.rows.get(id)
+            if row is None:
+                row = len(self.ids)
+                self.rows[id] = row
+                self.ids.append(id)
+                self.texts.append(text)
+                self.counts.append(Counter())
+                self.sizes.append(0)
+            else:
+                self.unlink(row)
+                self.texts[row] = text
+            self.link(row, Counter(LexicalIndex.terms(text)))
+        self._lengths = None
+
+    def delete(self, ids: List[str]) -> None:
+        for id in ids:
+            row = self.rows.pop(id, None)
+            if row is None:
+                continue
+            self.unlink(row)
+            # remove trocando pela última linha, como o índice em memória (hot_index)
+            last = len(self.ids) - 1
+            if row != last:
+                for term, frequency in self.counts[last].items():
+                    rows = self.postings[term]
+                    del rows[last]
+                    rows[row] = frequency
+                    self.arrays.pop(term, None)
+                self.ids[row] = self.ids[last]
+                self.texts[row] = self.texts[last]
+                self.counts[row] = self.counts[last]
+                self.sizes[row] = self.sizes[last]
+                self.rows[self.ids[row]] = row
+            self.ids.pop()
+            self.texts.pop()
+            self.counts.pop()
+            self.sizes.pop()
+        self._lengths = None
+
+    def search(self, terms: List[str], k: int, k1: float, b: float) -> List[Tuple[int, float]]:
+        if not self.ids or not terms:
+            return []
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        lengths = self.lengths
+        for term in set(terms):
+            posting = self.posting(term)
+            if posting is None:
+                continue
+            positions, frequencies = posting
+            idf = log(1 + (len(self.ids) - len(positions) + .5) / (len(positions) + .5))
+            norm = k1 * (1 - b + b * lengths[positions] / self.average)
+            scores[positions] += idf * frequencies * (k1 + 1) / (frequencies + norm)
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [(int(i), float(scores[i])) for i in candidates]
+
+
+class LexicalIndex(IncrementalIndex):
+    """
+    busca lexical (BM25) por namespace, em memória, montada a partir da coleção vectors do Mongo e
+    atualizada incrementalmente pelos eventos de upsert/remoção do namespace (namespace_events);
+    namespaces com mais de max_documents documentos ficam de fora (a busca segue só pelo vetor)
+    """
+    k1 = 1.2
+    b = 0.75
+    pattern = re.compile(r"\w+")
+
+    def __init__(self, max_namespaces: int = None, refresh: float = None, max_documents: int = None):
+        self.max_namespaces: int = env.LEXICAL_INDEX_MAX_NAMESPACES if max_namespaces is None else max_namespaces
+        self.refresh: float = env.LEXICAL_INDEX_REFRESH_SECONDS if refresh is None else refresh
+        self.max_documents: int = env.LEXICAL_INDEX_MAX_DOCUMENTS if max_documents is None else max_documents
+        self.indexes: OrderedDict[str, NamespaceIndex] = OrderedDict()
+        # namespaces grandes demais, com o instante em que foram medidos (revistos de tempos em tempos)
+        self.cold: Dict[str, float] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self._vectors: Union[AsyncMongo, None] = None
+        self._namespaceFactory: Union[NamespaceFactory, None] = None
+
+    @property
+    def vectors(self) -> AsyncMongo:
+        if self._vectors is None:
+            self._vectors = AsyncMongo("vectors")
+        return self._vectors
+
+    @property
+    def namespaceFactory(self) -> NamespaceFactory:
+        if self._namespaceFactory is None:
+            self._namespaceFactory = NamespaceFactory(
+                asyncmongo=AsyncMongo("namespaces", client=self.vectors.client),
+                mongo=Mongo("namespaces")
+            )
+        return self._namespaceFactory
+
+    def use(self, vectors: AsyncMongo, namespace_factory: NamespaceFactory) -> None:
+        self._vectors = vectors
+        self._namespaceFactory = namespace_factory
+        self.indexes.clear()
+        self.cold.clear()
+
+    @property
+    def stats(self) -> Dict:
+        return dict(
+            namespaces=len(self.indexes),
+            documents=sum(len(index.ids) for index in self.indexes.values()),
+            terms=sum(len(index.postings) for index in self.indexes.values())
+        )
+
+    @classmethod
+    def terms(cls, text: str) -> List[str]:
+        # sem acentos e sem caixa: "Ação" e "acao" são o mesmo termo
+        text = unicodedata.normalize("NFKD", text.casefold())
+        text = "".join(c for c in text if not unicodedata.combining(c))
+        return cls.pattern.findall(text)
+
+    async def version(self, namespace: str) -> int:
+        return await self.namespaceFactory.aversion(namespace)
+
+    async def documents(self, filter: Dict) -> Dict[str, str]:
+        documents: Dict[str, str] = {}
+        for doc in await self.vectors.find(filter, {"_id": 0, "id": 1, "content": 1}):
+            if doc.get("id") is not None:
+                documents[doc["id"]] = doc.get("content") or ""
+        return documents
+
+    async def load(self, namespace: str, version: int) -> Union[NamespaceIndex, None]:
+        if await self.vectors.count({"namespace": namespace}) > self.max_documents:
+            return None
+        documents = await self.documents({"namespace": namespace})
+        index = await asyncio.to_thread(NamespaceIndex, version, documents)
+        logger.info(f"Lexical index for namespace {namespace} built; documents: {len(index.ids)}; "
+                    f"terms: {len(index.postings)}; version: {version}")
+        return index
+
+    async def reload(self, namespace: str, version: int) -> Union[NamespaceIndex, None]:
+        return await self.load(namespace, version)
+
+    async def patch(self, namespace: str, index: NamespaceIndex, upserted: Set[str],
+                    deleted: Set[str]) -> Union[NamespaceIndex, None]:
+        """
+        aplica ao índice os documentos gravados e removidos pelos eventos
+        :return: None quando o namespace passou de max_documents
+        """
+        documents = await self.documents({"namespace": namespace, "id": {"$in": sorted(upserted)}}) \
+            if upserted else {}
+        # ids que já saíram do namespace (movidos por um evento posterior ainda não aplicado)
+        deleted.update(upserted - documents.keys())
+        index.upsert(documents)
+        index.delete(list(deleted))
+        if len(index.ids) > self.max_documents:
+            return None
+        return index
+
+    async def index(self, namespace: str) -> Union[NamespaceIndex, None]:
+        """
+        índice do namespace, atualizado a cada refresh segundos
+        :return: None quando o namespace tem mais de max_documents documentos
+        """
+        index = self.indexes.get(namespace)
+        if index is not None and monotonic() - index.checked_at < self.refresh:
+            self.indexes.move_to_end(namespace)
+            return index
+        if index is None and monotonic() - self.cold.get(namespace, float("-inf")) < self.refresh * 30:
+            return None
+
+        lock = self.locks.setdefault(namespace, asyncio.Lock())
+        async with lock:
+            index = self.indexes.get(namespace)
+            if index is not None and monotonic() - index.checked_at < self.refresh:
+                return index
+            if index is None:
+                index = await self.load(namespace, await self.version(namespace))
+            else:
+                index = await self.apply(namespace, index)
+            if index is None:
+                self.indexes.pop(namespace, None)
+                self.cold[namespace] = monotonic()
+                logger.info(f"Namespace {namespace} exceeds {self.max_documents} documents; "
+                            f"lexical search disabled, served by vector search.")
+                return None
+            self.cold.pop(namespace, None)
+            self.indexes[namespace] = index
+            self.indexes.move_to_end(namespace)
+            while len(self.indexes) > self.max_namespaces:
+                self.indexes.popitem(last=False)
+        return index
+
+    async def asearch(self, query: str, k: int = 3, ns: str = "default") -> Union[List[DocumentTasksSearch], None]:
+        """
+        busca BM25 no namespace
+        :return: None quando o namespace é grande demais para o índice lexical (a busca segue pelo vetor)
+        """
+        try:
+            with stage("lexical_search"):
+                index = await self.index(ns)
+                if index is None:
+                    return None
+                return [
+                    DocumentTasksSearch(id=index.ids[i], text=index.texts[i], namespace=ns)
+                    for i, _ in index.search(self.terms(query), k, self.k1, self.b)
+                ]
+        except Exception as err:
+            logger.error(err)
+            error("lexical", err)
+            return []
+
+
+lexical_index = LexicalIndex()
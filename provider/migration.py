@@ -0,0 +1,498 @@
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+from typing import Callable, Dict, List, Tuple, Union
+
+import tiktoken
+from bson import ObjectId
+from langchain_openai import OpenAIEmbeddings
+from loguru import logger
+from pymilvus import Collection, CollectionSchema, utility
+
+from config import env
+from factory import MigrationFactory, VectorFactory
+from metrics import COST, TOKENS, error, stage
+from models import ChunkTasksDocument
+from schemas import describe_collection, milvus_index, milvus_partitioning, milvus_schema
+from .embeddings import DIMENSIONS, cost, dimensions, embedding_batches, embeddings_model
+from .progress import Progress
+
+
+def collection_name(model: str, dim: int, partitions: int = 0) -> str:
+    # coleção física de cada modelo/dimensão/partições; MILVUS_COLLECTION_NAME é o alias para a ativa
+    name = f"{env.MILVUS_COLLECTION_NAME}_{re.sub(r'[^0-9A-Za-z]', '_', model)}_{dim}"
+    return f"{name}_p{partitions}" if partitions else name
+
+
+def same_embeddings(source: Dict, target: Dict) -> bool:
+    # só o layout muda: os vetores da coleção antiga são copiados, sem re-embedar
+    return source["model"] == target["model"] and source["dim"] == target["dim"]
+
+
+def stored_embeddings(collection: Collection, ids: List[str]) -> Dict[str, List[float]]:
+    found: Dict[str, List[float]] = {}
+    size = env.MILVUS_UPSERT_BATCH_SIZE
+    for i in range(0, len(ids), size):
+        with stage("milvus_query"):
+            rows = collection.query(expr=f"id in {str(ids[i:i + size])}", output_fields=["id", "embedding"])
+        found.update({row["id"]: list(row["embedding"]) for row in rows})
+    return found
+
+
+class ActiveCollection:
+    """
+    coleção física por trás do alias MILVUS_COLLECTION_NAME, com o modelo e a dimensão dos embeddings dela,
+    relida a cada MIGRATION_REFRESH_SECONDS: quando uma migração troca o alias, o processo passa a gerar
+    os embeddings com o modelo da coleção nova sem reiniciar
+    """
+    def __init__(self, refresh: float = None):
+        self.refresh: float = env.MIGRATION_REFRESH_SECONDS if refresh is None else refresh
+        self.collection: Union[Collection, None] = None
+        self.name: Union[str, None] = None
+        # coleções anteriores à migração não registram o modelo: valem OPENAI_EMBEDDING_MODEL e a dimensão nativa
+        self.model: str = env.OPENAI_EMBEDDING_MODEL
+        self.dim: Union[int, None] = DIMENSIONS.get(self.model)
+        self.checked_at = float("-inf")
+        self.listeners: List[Callable[["ActiveCollection"], None]] = []
+        self.lock = threading.Lock()
+
+    def use(self, collection: Collection) -> None:
+        self.collection = collection
+        self.name = None
+        self.model = env.OPENAI_EMBEDDING_MODEL
+        self.dim = DIMENSIONS.get(self.model)
+        self.checked_at = float("-inf")
+
+    def subscribe(self, listener: Callable[["ActiveCollection"], None]) -> None:
+        self.listeners.append(listener)
+
+    @property
+    def stale(self) -> bool:
+        return monotonic() - self.checked_at >= self.refresh
+
+    def embeddings(self) -> OpenAIEmbeddings:
+        return embeddings_model(self.model, self.dim if self.model in DIMENSIONS else None)
+
+    def read(self) -> Union[Dict, None]:
+        try:
+            return describe_collection(self.collection.describe())
+        except Exception as e:
+            logger.error(e)
+            error("milvus", e)
+            return None
+        finally:
+            self.checked_at = monotonic()
+
+    def apply(self, info: Union[Dict, None]) -> bool:
+        """
+        registra a coleção lida e avisa os inscritos quando o modelo ou a dimensão mudaram
+        (no thread de quem consulta: os inscritos mexem em estruturas do event loop)
+        :return: True quando mudaram
+        """
+        if info is None:
+            return False
+        with self.lock:
+            previous = (self.name, self.model, self.dim)
+            self.name, self.model = info["collection"], info["model"] or env.OPENAI_EMBEDDING_MODEL
+            self.dim = info["dim"]
+        changed = self.model != previous[1] or (previous[2] is not None and self.dim != previous[2])
+        if not changed:
+            return False
+        logger.info(f"Collection {env.MILVUS_COLLECTION_NAME} -> {self.name}; embedding model "
+                    f"{previous[1]} ({previous[2]} dims) -> {self.model} ({self.dim} dims)")
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                logger.error(e)
+        return True
+
+    def check(self, force: bool = False) -> bool:
+        if self.collection is None or not (force or self.stale):
+            return False
+        return self.apply(self.read())
+
+    async def acheck(self, force: bool = False) -> bool:
+        if self.collection is None or not (force or self.stale):
+            return False
+        # as consultas seguintes não disparam outra leitura enquanto esta está em andamento
+        self.checked_at = monotonic()
+        return self.apply(await asyncio.to_thread(self.read))
+
+
+class MilvusCatalog:
+    """
+    coleções e aliases do Milvus usados pela migração (utility do pymilvus, conexão default)
+    """
+    @staticmethod
+    def exists(name: str) -> bool:
+        return utility.has_collection(name)
+
+    @staticmethod
+    def get(name: str) -> Collection:
+        # uma coleção (ou alias) existente usa o schema do servidor: outro modelo, dimensão ou layout de partições
+        if utility.has_collection(name):
+            return Collection(name=name)
+        # o índice (perfil MILVUS_INDEX_PROFILE) é criado pelo build.py
+        partitions = env.MILVUS_NAMESPACE_PARTITIONS
+        return Collection(name=name, schema=milvus_schema(partitioned=partitions > 0),
+                          **milvus_partitioning(partitions))
+
+    @staticmethod
+    def open(name: str) -> Collection:
+        collection = Collection(name=name)
+        collection.load()
+        return collection
+
+    @staticmethod
+    def create(name: str, schema: CollectionSchema, partitions: int = 0) -> Collection:
+        collection = Collection(name=name, schema=schema, **milvus_partitioning(partitions))
+        collection.create_index(field_name="embedding", index_params=milvus_index(env.MILVUS_INDEX_PROFILE))
+        collection.load()
+        return collection
+
+    @staticmethod
+    def adopt(alias: str, name: str) -> None:
+        # o nome atual passa a ser um alias; entre as duas chamadas (milissegundos) o nome não existe
+        utility.rename_collection(alias, name, new_db_name=env.MILVUS_DB_NAME)
+        utility.create_alias(name, alias)
+
+    @staticmethod
+    def alter_alias(name: str, alias: str) -> None:
+        utility.alter_alias(name, alias)
+
+
+class DualWrite:
+    """
+    enquanto uma migração roda, os upserts e as remoções também são aplicados na coleção nova,
+    com o modelo dela; a migração em andamento é relida a cada MIGRATION_REFRESH_SECONDS
+    """
+    def __init__(self, migrations: MigrationFactory = None, catalog: MilvusCatalog = None, refresh: float = None):
+        self._migrations = migrations
+        self.catalog = MilvusCatalog() if catalog is None else catalog
+        self.refresh: float = env.MIGRATION_REFRESH_SECONDS if refresh is None else refresh
+        self.migration: Union[Dict, None] = None
+        self.checked_at = float("-inf")
+        self.collections: Dict[str, Collection] = {}
+        self.models: Dict[Tuple[str, int], OpenAIEmbeddings] = {}
+
+    @property
+    def migrations(self) -> MigrationFactory:
+        # criado sob demanda, para não abrir conexões antes do fork dos workers
+        if self._migrations is None:
+            self._migrations = MigrationFactory()
+        return self._migrations
+
+    def use(self, migrations: MigrationFactory) -> None:
+        self._migrations = migrations
+        self.migration = None
+        self.checked_at = float("-inf")
+
+    def current(self) -> Union[Dict, None]:
+        if monotonic() - self.checked_at >= self.refresh:
+            try:
+                self.migration = self.migrations.running()
+            except Exception as e:
+                logger.error(e)
+                error("mongo", e)
+            self.checked_at = monotonic()
+        return self.migration
+
+    def collection(self, name: str) -> Collection:
+        if name not in self.collections:
+            self.collections[name] = self.catalog.open(name)
+        return self.collections[name]
+
+    def embeddings(self, model: str, dim: int) -> OpenAIEmbeddings:
+        if (model, dim) not in self.models:
+            self.models[(model, dim)] = embeddings_model(model, dim)
+        return self.models[(model, dim)]
+
+    def upsert(self, chunks: List[ChunkTasksDocument], vectors: Dict[str, List[float]] = None) -> int:
+        """
+        grava na coleção nova os chunks que ainda não estão nela (ou estão em outro namespace);
+        compara com o que já foi gravado, então o retry de uma tarefa refaz o que faltou
+        :param vectors: embeddings recém-gravados na coleção ativa, por id; reaproveitados (junto com os já
+        gravados nela) quando a migração só muda o layout de partições
+        :return: quantidade de chunks gravados
+        """
+        migration = self.current()
+        if migration is None or not chunks:
+            return 0
+        target = migration["target"]
+        collection = self.collection(target["collection"])
+        model = self.embeddings(target["model"], target["dim"])
+        size = env.MILVUS_UPSERT_BATCH_SIZE
+
+        known: Dict[str, Dict] = {}
+        ids = [chunk.id for chunk in chunks]
+        for i in range(0, len(ids), size):
+            with stage("milvus_query"):
+                known.update({
+                    row["id"]: row for row in collection.query(expr=f"id in {str(ids[i:i + size])}",
+                                                               output_fields=["id", "ns"])
+                })
+        new_chunks = [chunk for chunk in chunks if chunk.id not in known]
+        moved = [chunk for chunk in chunks if chunk.id in known and known[chunk.id]["ns"] != chunk.namespace]
+
+        copied: Dict[str, List[float]] = {}
+        if same_embeddings(migration["source"], target):
+            copied = dict(vectors or {})
+            copied.update(stored_embeddings(self.collection(migration["source"]["collection"]),
+                                            [chunk.id for chunk in new_chunks if chunk.id not in copied]))
+        embedded: Dict[str, List[float]] = {}
+        for batch in embedding_batches([chunk for chunk in new_chunks if chunk.id not in copied], model.chunk_size):
+            with stage("embedding"):
+                embedded.update(zip([chunk.id for chunk in batch],
+                                    model.embed_documents([chunk.text for chunk in batch])))
+            TOKENS.labels(model=model.model, kind="embedding").inc(sum(chunk.tokens for chunk in batch))
+        embeddings: List[List[float]] = [
+            copied[chunk.id] if chunk.id in copied else embedded[chunk.id] for chunk in new_chunks
+        ]
+        if moved:
+            with stage("milvus_query"):
+                stored = {
+                    row["id"]: row["embedding"] for row in collection.query(
+                        expr=f"id in {str([chunk.id for chunk in moved])}", output_fields=["id", "embedding"]
+                    )
+                }
+            moved = [chunk for chunk in moved if chunk.id in stored]
+            embeddings.extend([list(stored[chunk.id]) for chunk in moved])
+
+        writes = new_chunks + moved
+        for i in range(0, len(writes), size):
+            batch = writes[i:i + size]
+            with stage("milvus_upsert"):
+                collection.upsert(data=[
+                    [chunk.id for chunk in batch],
+                    [chunk.text for chunk in batch],
+                    [chunk.namespace for chunk in batch],
+                    embeddings[i:i + size],
+                ])
+        return len(writes)
+
+    def delete(self, ids: List[str], ns: str = None) -> None:
+        migration = self.current()
+        if migration is None:
+            return
+        collection = self.collection(migration["target"]["collection"])
+        scope = "" if ns is None else f"ns == \"{ns}\" and "
+        for i in range(0, len(ids), env.DELETE_BATCH_SIZE):
+            batch = ids[i:i + env.DELETE_BATCH_SIZE]
+            with stage("milvus_delete"):
+                result = collection.delete(expr=f"{scope}id in {str(batch)}")
+                if scope and result.delete_count < len(batch):
+                    collection.delete(expr=f"id in {str(batch)}")
+
+
+class EmbeddingMigration:
+    """
+    migração online para outro modelo (ou dimensão) de embedding, ou para outro layout de partições por namespace
+    (MILVUS_NAMESPACE_PARTITIONS), retomável pelo checkpoint:
+    1. na primeira migração a coleção física é renomeada e MILVUS_COLLECTION_NAME vira um alias para ela
+    2. os chunks do Mongo (vectors) são re-embedados em páginas pelo _id, com MIGRATION_CONCURRENCY lotes
+       em paralelo, e gravados na coleção do modelo novo; o checkpoint é gravado a cada página. com o mesmo
+       modelo e dimensão, os vetores são copiados da coleção antiga em vez de re-embedados
+    3. enquanto isso, upserts e remoções também vão para a coleção nova (DualWrite)
+    4. a coleção nova é conciliada com o Mongo e o alias passa a apontar para ela, de uma vez; os processos
+       percebem a troca em até MIGRATION_REFRESH_SECONDS e uma última passada re-embeda o que foi gravado
+       nesse intervalo; a coleção antiga é mantida (voltar atrás é trocar o alias de novo)
+    """
+    def __init__(self, collection: Collection, migrations: MigrationFactory = None,
+                 vector_factory: VectorFactory = None, catalog: MilvusCatalog = None, page_size: int = None,
+                 concurrency: int = None, grace: float = None, interval: float = 5.0):
+        self.collection = collection
+        self.migrations = MigrationFactory() if migrations is None else migrations
+        self.vectorFactory = VectorFactory() if vector_factory is None else vector_factory
+        self.catalog = MilvusCatalog() if catalog is None else catalog
+        self.page_size: int = env.MIGRATION_PAGE_SIZE if page_size is None else page_size
+        self.concurrency: int = env.MIGRATION_CONCURRENCY if concurrency is None else concurrency
+        # espera após a troca do alias: todos os processos já releram o alias
+        self.grace: float = 2 * env.MIGRATION_REFRESH_SECONDS if grace is None else grace
+        # segundos entre registros de progresso
+        self.interval = interval
+
+    @staticmethod
+    def tokenizer(model: str) -> tiktoken.Encoding:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+
+    def embeddings(self, target: Dict) -> OpenAIEmbeddings:
+        return embeddings_model(target["model"], target["dim"])
+
+    def prepare(self, migration: Dict) -> Tuple[Collection, Dict]:
+        """
+        adota o alias (primeira migração), cria (ou reabre) a coleção nova e marca a migração como RUNNING
+        :return: a coleção nova e o alvo (modelo, dimensão e coleção)
+        """
+        alias = env.MILVUS_COLLECTION_NAME
+        source = migration.get("source")
+        if source is None:
+            info = describe_collection(self.collection.describe())
+            source = dict(collection=info["collection"], model=info["model"] or env.OPENAI_EMBEDDING_MODEL,
+                          dim=info["dim"], partitions=info["partitions"])
+            if source["collection"] == alias:
+                source["collection"] = collection_name(source["model"], source["dim"], source["partitions"])
+                self.catalog.adopt(alias, source["collection"])
+                logger.info(f"Collection {alias} renamed to {source['collection']}; {alias} is now an alias")
+
+        target = dict(migration["target"])
+        target["dim"] = dimensions(target["model"], target.get("dim"))
+        target["partitions"] = target.get("partitions") or 0
+        target["collection"] = collection_name(target["model"], target["dim"], target["partitions"])
+        if target["collection"] == source["collection"]:
+            raise ValueError(f"{alias} already uses {target['model']} ({target['dim']} dims, "
+                             f"{target['partitions']} partitions)")
+
+        if self.catalog.exists(target["collection"]):
+            collection = self.catalog.open(target["collection"])
+        else:
+            collection = self.catalog.create(
+                target["collection"],
+                milvus_schema(target["dim"], target["model"], partitioned=target["partitions"] > 0),
+                target["partitions"]
+            )
+            logger.info(f"Collection {target['collection']} created for {target['model']} ({target['dim']} dims, "
+                        f"{target['partitions']} partitions)")
+        self.migrations.start(migration["_id"], source, target, self.vectorFactory.mongo.count({}))
+        return collection, target
+
+    def embed(self, model: OpenAIEmbeddings, chunks: List[ChunkTasksDocument]) -> List[List[float]]:
+        def embed_batch(batch: List[ChunkTasksDocument]) -> List[List[float]]:
+            with stage("embedding"):
+                return model.embed_documents([chunk.text for chunk in batch])
+
+        batches = list(embedding_batches(chunks, model.chunk_size))
+        with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(batches)))) as pool:
+            return [embedding for result in pool.map(embed_batch, batches) for embedding in result]
+
+    def backfill(self, migration_id: str, collection: Collection, target: Dict, after: ObjectId,
+                 progress: Progress, source: Collection = None) -> ObjectId:
+        """
+        re-embeda os vetores do Mongo depois do _id after, página a página, gravando o checkpoint
+        :param source: coleção antiga, de onde os vetores são copiados quando o modelo não muda
+        (os que faltarem nela são embedados)
+        :return: o último _id gravado
+        """
+        model = self.embeddings(target)
+        tokenizer = self.tokenizer(target["model"])
+        for page in self.vectorFactory.mongo.pages(
+            {}, {"_id": 1, "id": 1, "content": 1, "namespace": 1}, size=self.page_size, after=after
+        ):
+            chunks = [
+                ChunkTasksDocument(
+                    id=vec["id"],
+                    text=vec["content"],
+                    namespace=vec.get("namespace") or "default",
+                    tokens=len(tokenizer.encode(vec["content"], disallowed_special=()))
+                ) for vec in page if vec.get("id") and vec.get("content")
+            ]
+            copied = {} if source is None else stored_embeddings(source, [chunk.id for chunk in chunks])
+            missing = [chunk for chunk in chunks if chunk.id not in copied]
+            embedded = dict(zip([chunk.id for chunk in missing], self.embed(model, missing)))
+            if len(embedded) != len(missing):
+                raise ValueError("Unable to load embeds")
+            embeddings = [copied[chunk.id] if chunk.id in copied else embedded[chunk.id] for chunk in chunks]
+            size = env.MILVUS_UPSERT_BATCH_SIZE
+            for i in range(0, len(chunks), size):
+                batch = chunks[i:i + size]
+                with stage("milvus_upsert"):
+                    collection.upsert(data=[
+                        [chunk.id for chunk in batch],
+                        [chunk.text for chunk in batch],
+                        [chunk.namespace for chunk in batch],
+                        embeddings[i:i + size],
+                    ])
+
+            tokens = sum(chunk.tokens for chunk in missing)
+            spent = cost(target["model"], tokens)
+            TOKENS.labels(model=target["model"], kind="embedding").inc(tokens)
+            COST.labels(model=target["model"]).inc(spent)
+            after = page[-1]["_id"]
+            progress.advance(len(page))
+            self.migrations.checkpoint(migration_id, after, len(page), tokens, spent, progress.rate)
+        return after
+
+    def reconcile(self, collection: Collection) -> Tuple[int, int]:
+        """
+        remove da coleção nova os ids que saíram do Mongo durante a cópia e corrige o namespace dos que mudaram
+        (alterações feitas enquanto a migração estava parada, sem dual-write)
+        :return: ids removidos e ids movidos
+        """
+        removed = moved = 0
+        iterator = collection.query_iterator(batch_size=self.page_size, expr="id != \"\"", output_fields=["id", "ns"])
+        try:
+            while True:
+                with stage("milvus_query"):
+                    batch = iterator.next()
+                if not batch:
+                    break
+                found = {
+                    vec["id"]: vec.get("namespace") or "default" for vec in self.vectorFactory.mongo.find(
+                        {"id": {"$in": [row["id"] for row in batch]}}, {"_id": 0, "id": 1, "namespace": 1}
+                    )
+                }
+                orphans = [row["id"] for row in batch if row["id"] not in found]
+                for i in range(0, len(orphans), env.DELETE_BATCH_SIZE):
+                    with stage("milvus_delete"):
+                        collection.delete(expr=f"id in {str(orphans[i:i + env.DELETE_BATCH_SIZE])}")
+                changed = [row["id"] for row in batch if row["id"] in found and found[row["id"]] != row["ns"]]
+                if changed:
+                    with stage("milvus_query"):
+                        rows = collection.query(expr=f"id in {str(changed)}", output_fields=["id", "text", "embedding"])
+                    with stage("milvus_upsert"):
+                        collection.upsert(data=[
+                            [row["id"] for row in rows],
+                            [row["text"] for row in rows],
+                            [found[row["id"]] for row in rows],
+                            [list(row["embedding"]) for row in rows],
+                        ])
+                removed += len(orphans)
+                moved += len(changed)
+        finally:
+            iterator.close()
+        return removed, moved
+
+    def run(self, migration_id: str) -> int:
+        """
+        executa (ou retoma do checkpoint) a migração até a troca do alias
+        :return: quantidade de vetores re-embedados (ou copiados) nesta execução
+        """
+        migration = self.migrations.get(migration_id)
+        if migration is None:
+            raise ValueError(f"Migration not found: {migration_id}")
+        if migration["state"] == "SUCCESS":
+            return 0
+
+        collection, target = self.prepare(migration)
+        migration = self.migrations.get(migration_id)
+        source = self.catalog.open(migration["source"]["collection"]) \
+            if same_embeddings(migration["source"], target) else None
+        # done acumula entre execuções; o progresso desta execução conta o que falta
+        progress = Progress(f"Migration {migration_id}", max(0, migration["total"] - migration["done"]),
+                            interval=self.interval)
+        progress.flush()
+        last = self.backfill(migration_id, collection, target, migration.get("checkpoint"), progress, source)
+
+        self.migrations.switching(migration_id)
+        removed, moved = self.reconcile(collection)
+        self.catalog.alter_alias(target["collection"], env.MILVUS_COLLECTION_NAME)
+        self.migrations.switched(migration_id)
+        logger.info(f"[{migration_id}] Alias {env.MILVUS_COLLECTION_NAME} -> {target['collection']}; "
+                    f"reconciled: {removed} removed, {moved} moved")
+        active_collection.check(force=True)
+
+        # gravações de quem ainda usava o modelo antigo durante a troca estão depois do último checkpoint
+        sleep(self.grace)
+        self.backfill(migration_id, collection, target, last, progress, source)
+        self.migrations.finish(migration_id)
+        progress.flush()
+        return progress.done
+
+
+active_collection = ActiveCollection()
+dual_write = DualWrite()
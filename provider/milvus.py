@@ -1,73 +1,136 @@
 import asyncio
-from typing import List
+from typing import List, Dict, Iterator
 import tiktoken
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from pymilvus import connections, db, Collection, Hits, SearchResult
-from models import UpsertTasksDocument, DocumentTasksSearch, Vector
-from schemas import MilvusSchema
+from models import UpsertTasksDocument, DocumentTasksSearch, ChunkTasksDocument, Vector
+from schemas import search_params
 from langchain_openai import OpenAIEmbeddings
 from config import env
 from hashlib import md5
 from loguru import logger
 from factory import VectorFactory
+from metrics import TOKENS, error, stage
+from tracing import span
+from .chunker import TokenChunker
+from .coalescer import EmbeddingCoalescer
+from .deletion import delete_batches
+from .embedding_cache import embedding_cache
+from .embeddings import embedding_batches
+from .hot_index import HotIndex, hot_index
+from .lexical import LexicalIndex, lexical_index
+from .migration import ActiveCollection, MilvusCatalog, active_collection, dual_write
 
 
 class MilvusSearch:
-    def __init__(self):
-        if not db.connections.has_connection("default"):
-            connections.connect(
-                alias="default",
-                host=env.MILVUS_HOST,
-                port=env.MILVUS_PORT
-            )
-        db.using_database(env.MILVUS_DB_NAME)
+    def __init__(self, collection: Collection = None, embeddings_model: OpenAIEmbeddings = None,
+                 coalescer: EmbeddingCoalescer = None, lexical: LexicalIndex = None, hot: HotIndex = None,
+                 active: ActiveCollection = None):
+        if collection is None:
+            if not db.connections.has_connection("default"):
+                connections.connect(
+                    alias="default",
+                    host=env.MILVUS_HOST,
+                    port=env.MILVUS_PORT
+                )
+            db.using_database(env.MILVUS_DB_NAME)
 
-        self.collection = self.get_collection()
-        self.collection.load()
+            collection = self.get_collection()
+            collection.load()
+        self.collection = collection
         self.embeddings_model = OpenAIEmbeddings(
             model=env.OPENAI_EMBEDDING_MODEL,
             openai_api_key=env.OPENAI_API_KEY
-        )
+        ) if embeddings_model is None else embeddings_model
+        self.coalescer = coalescer
+        self.lexical = lexical_index if lexical is None else lexical
+        self.hot = hot_index if hot is None else hot
+        self.active = active_collection if active is None else active
 
     @staticmethod
     def get_collection() -> Collection:
-        return Collection(
-            name=env.MILVUS_COLLECTION_NAME,
-            schema=MilvusSchema,
-        )
+        return MilvusCatalog.get(env.MILVUS_COLLECTION_NAME)
+
+    def use_embeddings(self, active: ActiveCollection) -> None:
+        # o alias passou a apontar para a coleção de outro modelo (migração concluída)
+        self.embeddings_model = active.embeddings()
+        if self.coalescer is not None:
+            self.coalescer.embeddings_model = self.embeddings_model
 
     async def aembedding(self, query: str) -> List[float]:
-        return await self.embeddings_model.aembed_query(query)
+        await self.active.acheck()
+        return await embedding_cache.aembed_query(
+            query, self.embeddings_model if self.coalescer is None else self.coalescer
+        )
 
     async def adelete(self, ids: List[str]) -> None:
         return await asyncio.to_thread(self.delete, ids)
 
     def search(self, data: dict) -> SearchResult:
-        return self.collection.search(**data)
+        with stage("milvus_search"):
+            return self.collection.search(**data)
 
     def delete(self, ids: List[str]) -> None:
         try:
-            self.collection.delete(
-                expr=f"id in {str(ids)}"
-            )
+            delete_batches(self.collection, ids)
+            dual_write.delete(ids)
         except Exception as e:
             logger.error(e)
+            error("milvus", e)
 
-    async def asearch(self, query: str, k: int = 3, ns: str = "default") -> List[DocumentTasksSearch]:
+    @staticmethod
+    def fuse(rankings: List[List[DocumentTasksSearch]], k: int, rrf_k: int = None) -> List[DocumentTasksSearch]:
+        """
+        reciprocal-rank fusion: score(d) = soma de 1 / (rrf_k + posição de d em cada ranking)
+        :return: os k documentos de maior score
+        """
+        rrf_k = env.SEARCH_RRF_K if rrf_k is None else rrf_k
+        scores: Dict[str, float] = {}
+        documents: Dict[str, DocumentTasksSearch] = {}
+        for ranking in rankings:
+            for rank, document in enumerate(ranking, start=1):
+                scores[document.id] = scores.get(document.id, 0.0) + 1 / (rrf_k + rank)
+                documents.setdefault(document.id, document)
+        return [documents[id] for id in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+    async def asearch(self, query: str, k: int = 3, ns: str = "default",
+                      embedding: List[float] = None, mode: str = None) -> List[DocumentTasksSearch]:
+        """
+        busca de contexto no namespace
+        :param mode: vector (ANN no Milvus), lexical (BM25) ou hybrid (os dois em paralelo, fundidos por RRF);
+        padrão SEARCH_MODE
+        :return:
+        """
+        mode = env.SEARCH_MODE if mode is None else mode
+        if mode == "lexical":
+            lexical = await self.lexical.asearch(query=query, k=k, ns=ns)
+            if lexical is not None:
+                return lexical
+        elif mode == "hybrid":
+            candidates = max(k, env.SEARCH_HYBRID_CANDIDATES)
+            rankings = await asyncio.gather(
+                self.avector_search(query=query, k=candidates, ns=ns, embedding=embedding),
+                self.lexical.asearch(query=query, k=candidates, ns=ns)
+            )
+            # namespace fora do índice lexical (LEXICAL_INDEX_MAX_DOCUMENTS): só o ranking do vetor
+            return self.fuse([ranking for ranking in rankings if ranking is not None], k)
+        return await self.avector_search(query=query, k=k, ns=ns, embedding=embedding)
+
+    async def avector_search(self, query: str, k: int = 3, ns: str = "default",
+                             embedding: List[float] = None) -> List[DocumentTasksSearch]:
         try:
-            embedding = await self.aembedding(query)
+            if embedding is None:
+                embedding = await self.aembedding(query)
+            hot = await self.hot.asearch(embedding=embedding, k=k, ns=ns)
+            if hot is not None:
+                return hot
             search_result = await asyncio.to_thread(
                 self.search,
                 dict(
                     data=[embedding],
                     anns_field="embedding",
-                    param={
-                        "metric_type": "COSINE",
-                        'index_type': "IVF_FLAT",
-                        "params": {
-                            "nprobe": 12
-                        }
-                    },
+                    param=search_params(env.MILVUS_INDEX_PROFILE, k),
+                    # com o ns como partition key (MILVUS_NAMESPACE_PARTITIONS), o filtro restringe a busca
+                    # à partição do namespace
                     expr=f"ns == \"{ns}\"",
                     limit=k,
                     output_fields=['id', 'text', 'ns'],
@@ -82,30 +145,50 @@ class MilvusSearch:
                         namespace=hit.entity.get('ns')
                     ) for hit in result
                 ]
+            return []
         except Exception as err:
             logger.error(err)
+            error("milvus", err)
+            # ex.: dimensão diferente logo após a troca do alias; a próxima consulta já usa o modelo novo
+            await self.active.acheck(force=True)
             return []
 
 class MilvusDataStore:
-    def __init__(self):
-        if not db.connections.has_connection("default"):
-            connections.connect(
-                alias="default",
-                host=env.MILVUS_HOST,
-                port=env.MILVUS_PORT
-            )
-        db.using_database(env.MILVUS_DB_NAME)
+    def __init__(self, collection: Collection = None, embeddings_model: OpenAIEmbeddings = None,
+                 vector_factory: VectorFactory = None, active: ActiveCollection = None):
+        if collection is None:
+            if not db.connections.has_connection("default"):
+                connections.connect(
+                    alias="default",
+                    host=env.MILVUS_HOST,
+                    port=env.MILVUS_PORT
+                )
+            db.using_database(env.MILVUS_DB_NAME)
 
-        self.collection = self.get_collection()
-        self.collection.load()
+            collection = self.get_collection()
+            collection.load()
+        self.collection = collection
         self.tokenizer = tiktoken.encoding_for_model(model_name=env.OPENAI_EMBEDDING_MODEL)
+        self.chunker = TokenChunker(self.tokenizer, chunk_size=100, chunk_overlap=20)
         self.embeddings_model = OpenAIEmbeddings(
             model=env.OPENAI_EMBEDDING_MODEL,
             openai_api_key=env.OPENAI_API_KEY
-        )
-        self.vectorFactory = VectorFactory()
+        ) if embeddings_model is None else embeddings_model
+        self.vectorFactory = VectorFactory() if vector_factory is None else vector_factory
+        self.active = active_collection if active is None else active
         self.vectors: List[Vector] = []
 
+    def use_embeddings(self, active: ActiveCollection) -> None:
+        # o tokenizer (e os ids dos chunks) não muda: só o modelo que gera os embeddings
+        self.embeddings_model = active.embeddings()
+
+    def warmup(self) -> None:
+        # carrega o BPE do tokenizer e a coleção antes de consumir mensagens
+        self._tokenizer("warmup")
+        self.chunker.token_bytes
+        self.collection.load()
+        self.vectorFactory.setup()
+
     def _tokenizer(self, text: str) -> int:
         tokens = self.tokenizer.encode(
             text=text,
@@ -114,65 +197,126 @@ class MilvusDataStore:
         return len(tokens)
 
     def split_text(self, content: str, chunk_size: int = 100, chunk_overlap: int = 20) -> List[str]:
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=self._tokenizer,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        return text_splitter.split_text(content)
+        chunker = self.chunker
+        if (chunk_size, chunk_overlap) != (chunker.chunk_size, chunker.chunk_overlap):
+            chunker = TokenChunker(self.tokenizer, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return chunker.split_text(content)
 
     def embeddings_documents(self, documents: List[str]) -> List[List[float]]:
-        return self.embeddings_model.embed_documents(documents)
+        with stage("embedding"):
+            return self.embeddings_model.embed_documents(documents)
 
     @staticmethod
     def get_collection() -> Collection:
-        collection = Collection(name=env.MILVUS_COLLECTION_NAME, schema=MilvusSchema)
-        collection.create_index(
-            field_name="embedding",
-            index_params={
-                'metric_type': 'COSINE',
-                'index_type': "IVF_FLAT",
-                'params': {
-                    "nlist": 128
-                }
-            }
-        )
-        return collection
+        # o índice (perfil MILVUS_INDEX_PROFILE) é criado pelo build.py; não recriar a cada ingestão
+        return MilvusCatalog.get(env.MILVUS_COLLECTION_NAME)
+
+    def chunks(self, documents: List[UpsertTasksDocument]) -> List[ChunkTasksDocument]:
+        chunks: Dict[str, ChunkTasksDocument] = {}
+        splits = self.chunker.split_texts([document.content for document in documents])
+        for document, texts in zip(documents, splits):
+            for text, tokens in texts:
+                id = md5(text.encode()).hexdigest()
+                # o id é o hash do texto: a última ocorrência prevalece, como em upserts sequenciais
+                chunks.pop(id, None)
+                chunks[id] = ChunkTasksDocument(
+                    id=id,
+                    text=text,
+                    namespace=document.namespace,
+                    username=document.username,
+                    tokens=tokens
+                )
+        return list(chunks.values())
+
+    def embedding_batches(self, chunks: List[ChunkTasksDocument]) -> Iterator[List[ChunkTasksDocument]]:
+        # limitado também pelo chunk_size do cliente, para cada lote virar uma única requisição
+        return embedding_batches(chunks, self.embeddings_model.chunk_size)
 
     def upsert(self, document: UpsertTasksDocument) -> bool:
-        documents = self.split_text(content=document.content)
-        if len(documents) == 0:
+        return self.upsert_batch(documents=[document])
+
+    def existing(self, ids: List[str], output_fields: List[str] = None) -> Dict[str, Dict]:
+        # busca em lote os chunks já gravados (o id é o md5 do texto)
+        found: Dict[str, Dict] = {}
+        size = env.MILVUS_UPSERT_BATCH_SIZE
+        for i in range(0, len(ids), size):
+            with stage("milvus_query"):
+                rows = self.collection.query(
+                    expr=f"id in {str(ids[i:i + size])}",
+                    output_fields=["id", "ns"] if output_fields is None else output_fields
+                )
+            for row in rows:
+                found[row["id"]] = row
+        return found
+
+    def upsert_batch(self, documents: List[UpsertTasksDocument]) -> bool:
+        with stage("split"):
+            chunks = self.chunks(documents=documents)
+        if len(chunks) == 0:
             raise ValueError("Unable to load documents")
+        # durante uma migração o alias é relido a cada tarefa: a troca não pode gravar embeddings do modelo antigo
+        self.active.check(force=dual_write.current() is not None)
+
+        known = self.existing([chunk.id for chunk in chunks])
+        new_chunks = [chunk for chunk in chunks if chunk.id not in known]
+        # mesmo texto em outro namespace: reaproveita o embedding gravado, só muda o ns
+        moved = [chunk for chunk in chunks if chunk.id in known and known[chunk.id]["ns"] != chunk.namespace]
 
-        embeddings = self.embeddings_documents(documents=documents)
-        if len(embeddings) == 0:
+        embeddings: List[List[float]] = []
+        for batch in self.embedding_batches(new_chunks):
+            embeddings.extend(self.embeddings_documents(documents=[chunk.text for chunk in batch]))
+            TOKENS.labels(model=self.embeddings_model.model, kind="embedding").inc(sum(chunk.tokens for chunk in batch))
+        if len(embeddings) != len(new_chunks):
             raise ValueError("Unable to load embeds")
+        if moved:
+            stored = self.existing([chunk.id for chunk in moved], output_fields=["id", "embedding"])
+            moved = [chunk for chunk in moved if chunk.id in stored]
+            embeddings.extend([list(stored[chunk.id]["embedding"]) for chunk in moved])
 
-        ids = [md5(doc.encode()).hexdigest() for doc in documents]
-        ns = [document.namespace for _ in ids]
+        writes = new_chunks + moved
+        succ_count = 0
+        err_count = 0
+        size = env.MILVUS_UPSERT_BATCH_SIZE
+        for i in range(0, len(writes), size):
+            batch = writes[i:i + size]
+            with stage("milvus_upsert"):
+                upsert_result = self.collection.upsert(
+                    data=[
+                        [chunk.id for chunk in batch],
+                        [chunk.text for chunk in batch],
+                        [chunk.namespace for chunk in batch],
+                        embeddings[i:i + size],
+                    ]
+                )
+            succ_count += upsert_result.succ_count
+            err_count += upsert_result.err_count
+        mirrored = dual_write.upsert(chunks, dict(zip([chunk.id for chunk in writes], embeddings)))
 
         self.vectors = [
             Vector().create(
-                id=ids[i],
-                content=doc,
-                created_by=document.username,
-                namespace=document.namespace
-            ) for i, doc in enumerate(documents)
+                id=chunk.id,
+                content=chunk.text,
+                created_by=chunk.username,
+                namespace=chunk.namespace
+            ) for chunk in chunks
         ]
+        with span("mongo_upsert", vectors=len(self.vectors)):
+            self.vectorFactory.upsert(request=self.vectors)
 
-        upsert_result = self.collection.upsert(
-            data=[
-                ids,
-                documents,
-                ns,
-                embeddings,
-            ]
-        )
-
-        self.vectorFactory.create(request=self.vectors)
+        # invalida os caches dos namespaces alterados (inclusive os que perderam chunks)
+        upserted: Dict[str, List[str]] = {}
+        deleted: Dict[str, List[str]] = {}
+        for chunk in writes:
+            upserted.setdefault(chunk.namespace, []).append(chunk.id)
+        for chunk in moved:
+            deleted.setdefault(known[chunk.id]["ns"], []).append(chunk.id)
+        for namespace in upserted.keys() | deleted.keys():
+            self.vectorFactory.namespaceFactory.publish(
+                namespace, upserted=upserted.get(namespace), deleted=deleted.get(namespace)
+            )
 
-        logger.info(f"Upsert count: {upsert_result.upsert_count}; errors: {upsert_result.err_count}; "
-                    f"success percentage: {upsert_result.succ_count / upsert_result.insert_count * 100}")
+        logger.info(f"Upsert documents: {len(documents)}; chunks: {len(chunks)}; embedded: {len(new_chunks)}; "
+                    f"moved: {len(moved)}; unchanged: {len(chunks) - len(writes)}; errors: {err_count}"
+                    + (f"; mirrored: {mirrored}" if mirrored else ""))
 
-        return upsert_result.succ_count > 0
+        return len(writes) == 0 or succ_count > 0
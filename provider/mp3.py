@@ -0,0 +1,173 @@
+from io import BytesIO
+from pathlib import Path
+from threading import RLock
+from typing import Dict, List, NamedTuple, Tuple, Union
+
+from loguru import logger
+from pydub import AudioSegment
+
+
+# índices da tabela de bitrates: (versão MPEG, camada) → kbps
+BITRATES = {
+    (1, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (1, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (1, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (2, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (2, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (2, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+SAMPLE_RATES = {
+    1: [44100, 48000, 32000],
+    2: [22050, 24000, 16000],
+    2.5: [11025, 12000, 8000],
+}
+
+
+class Mp3Params(NamedTuple):
+    version: float
+    layer: int
+    sample_rate: int
+    channels: int
+    bitrate: int
+
+
+class Mp3Frame(NamedTuple):
+    params: Mp3Params
+    length: int
+
+
+def header(data: bytes, offset: int) -> Union[Mp3Frame, None]:
+    if offset + 4 > len(data) or data[offset] != 0xFF or (data[offset + 1] & 0xE0) != 0xE0:
+        return None
+    b1, b2, b3 = data[offset + 1], data[offset + 2], data[offset + 3]
+    version = {0: 2.5, 2: 2, 3: 1}.get((b1 >> 3) & 3)
+    layer = {1: 3, 2: 2, 3: 1}.get((b1 >> 1) & 3)
+    bitrate_index, sample_rate_index = b2 >> 4, (b2 >> 2) & 3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    bitrate = BITRATES[(1 if version == 1 else 2, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    return Mp3Frame(
+        params=Mp3Params(version, layer, sample_rate, 1 if (b3 >> 6) == 3 else 2, bitrate // 1000),
+        length=length
+    )
+
+
+def is_vbr_header(data: bytes, offset: int, frame: Mp3Frame) -> bool:
+    # frame Xing/Info/VBRI: metadados do encoder, descrevem só o arquivo original
+    body = data[offset:offset + frame.length]
+    return any(tag in body[:64] for tag in (b"Xing", b"Info", b"VBRI"))
+
+
+def parse(data: bytes) -> Tuple[Union[Mp3Params, None], bytes]:
+    """
+    separa os frames de áudio de um MP3 (sem ID3v1/ID3v2 e sem o frame Xing/Info)
+    :return: (parâmetros comuns a todos os frames ou None se variarem, frames concatenados)
+    """
+    offset = 0
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = ((data[6] & 0x7F) << 21) | ((data[7] & 0x7F) << 14) | ((data[8] & 0x7F) << 7) | (data[9] & 0x7F)
+        offset = 10 + size + (10 if data[5] & 0x10 else 0)
+    end = len(data) - 128 if data[-128:-125] == b"TAG" else len(data)
+
+    params: Union[Mp3Params, None] = None
+    mixed = False
+    frames: List[bytes] = []
+    first = True
+    while offset < end:
+        frame = header(data, offset)
+        if frame is None or offset + frame.length > end:
+            # perdeu o sincronismo: procura o próximo cabeçalho válido
+            offset += 1
+            continue
+        if first and is_vbr_header(data, offset, frame):
+            first = False
+            offset += frame.length
+            continue
+        first = False
+        if params is None:
+            params = frame.params
+        elif frame.params != params:
+            mixed = True
+        frames.append(data[offset:offset + frame.length])
+        offset += frame.length
+
+    return (None if mixed else params), b"".join(frames)
+
+
+class Jingle:
+    """
+    vinheta carregada uma vez por processo; guarda os frames já convertidos
+    para os formatos de MP3 em que foi pedida, para concatenar sem recodificar
+    """
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.params: Union[Mp3Params, None] = None
+        self.frames: bytes = b""
+        self.loaded = False
+        self._segment: Union[AudioSegment, None] = None
+        self.encoded: Dict[Mp3Params, Union[bytes, None]] = {}
+        self.lock = RLock()
+
+    def load(self) -> "Jingle":
+        with self.lock:
+            if not self.loaded:
+                self.params, self.frames = parse(self.path.read_bytes())
+                self.loaded = True
+        return self
+
+    @property
+    def segment(self) -> AudioSegment:
+        # decodificada (ffmpeg) só quando é preciso recodificar: formato diferente do áudio gerado
+        with self.lock:
+            if self._segment is None:
+                self._segment = AudioSegment.from_file(self.path)
+            return self._segment
+
+    def frames_for(self, params: Mp3Params) -> Union[bytes, None]:
+        self.load()
+        if params == self.params:
+            return self.frames
+        with self.lock:
+            if params not in self.encoded:
+                self.encoded[params] = self.transcode(params)
+            return self.encoded[params]
+
+    def transcode(self, params: Mp3Params) -> Union[bytes, None]:
+        if params.layer != 3:
+            return None
+        buffer = BytesIO()
+        self.segment.set_frame_rate(params.sample_rate).set_channels(params.channels).export(
+            buffer, format="mp3", bitrate=f"{params.bitrate}k"
+        )
+        encoded_params, frames = parse(buffer.getvalue())
+        if encoded_params != params:
+            logger.warning(f"Jingle could not be encoded as {params}; using decode/re-encode mixing.")
+            return None
+        return frames
+
+
+def concat(jingle: Jingle, absolute_path: str) -> bool:
+    """
+    junta vinheta + áudio gerado no nível de frames MP3, sem decodificar;
+    False quando os formatos não são compatíveis (o chamador recodifica)
+    """
+    params, frames = parse(Path(absolute_path).read_bytes())
+    if params is None or not frames:
+        return False
+    jingle_frames = jingle.frames_for(params)
+    if jingle_frames is None:
+        return False
+    Path(absolute_path).write_bytes(jingle_frames + frames)
+    return True
+
+
+jingle = Jingle("audios/quiz.mp3")
@@ -0,0 +1,37 @@
+from time import monotonic
+from typing import Callable
+
+from loguru import logger
+
+
+class Progress:
+    """
+    linhas processadas e vazão de uma exportação/importação, reportadas a cada intervalo
+    """
+    def __init__(self, label: str, total: int, report: Callable[["Progress"], None] = None,
+                 interval: float = 5.0):
+        self.label = label
+        self.total = total
+        self.report = report
+        self.interval = interval
+        self.done = 0
+        self.started = self.reported = monotonic()
+
+    @property
+    def elapsed(self) -> float:
+        return monotonic() - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def advance(self, rows: int) -> None:
+        self.done += rows
+        if monotonic() - self.reported >= self.interval:
+            self.flush()
+
+    def flush(self) -> None:
+        self.reported = monotonic()
+        logger.info(f"{self.label}: {self.done}/{self.total} vectors; {self.rate:.0f} vectors/s")
+        if self.report is not None:
+            self.report(self)
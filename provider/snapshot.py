@@ -0,0 +1,290 @@
+import re
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+from loguru import logger
+from orjson import dumps, loads, OPT_APPEND_NEWLINE, OPT_INDENT_2
+from pymilvus import Collection
+
+from config import env
+from factory import VectorFactory
+from metrics import stage
+from models import ChunkTasksDocument, Vector
+from schemas import describe_collection
+from .migration import EmbeddingMigration, dual_write
+from .progress import Progress
+
+FORMAT = 1
+DTYPES = ("float32", "float16")
+NAME = re.compile(r"^[\w-][\w.-]{0,63}$")
+# campos do Mongo guardados junto de cada vetor (id, texto e namespace já estão nas colunas)
+METADATA = ("uuid", "created_by", "created_at")
+
+
+class Snapshot:
+    """
+    snapshot de um namespace no disco, em colunas na ordem das linhas:
+      manifest.json    formato, namespace, modelo de embedding, dim, dtype e linhas (escrito por último)
+      ids.bin          ids (md5 hex, S32)
+      offsets.bin      int64, linhas + 1: início de cada texto em texts.bin
+      texts.bin        textos em UTF-8, concatenados
+      embeddings.bin   matriz linhas x dim em float32 ou float16 (C order)
+      metadata.ndjson  uuid, created_by e created_at do Mongo, um objeto por linha
+    as colunas binárias são abertas como memmap: a matriz não é carregada inteira na memória
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.manifest: Dict = loads((self.path / "manifest.json").read_bytes())
+        self.rows: int = self.manifest["rows"]
+        self.dim: int = self.manifest["dim"]
+        self.ids = self.column("ids.bin", "S32", (self.rows,))
+        self.offsets = self.column("offsets.bin", np.int64, (self.rows + 1,))
+        self.texts = self.column("texts.bin", np.uint8, (int(self.offsets[-1]) if self.rows else 0,))
+        self.embeddings = self.column("embeddings.bin", self.manifest["dtype"], (self.rows, self.dim))
+
+    def column(self, name: str, dtype, shape: Tuple[int, ...]) -> np.ndarray:
+        # memmap não aceita arquivo vazio
+        if 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.path / name, dtype=dtype, mode="r", shape=shape)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(file.stat().st_size for file in self.path.iterdir())
+
+    def text(self, row: int) -> str:
+        return self.texts[self.offsets[row]:self.offsets[row + 1]].tobytes().decode()
+
+    def batches(self, size: int) -> Iterator[Tuple[List[str], List[str], np.ndarray, List[Dict]]]:
+        """
+        ids, textos, embeddings (float32) e metadados, em lotes de size linhas
+        :return:
+        """
+        with open(self.path / "metadata.ndjson", "rb") as metadata:
+            for start in range(0, self.rows, size):
+                stop = min(start + size, self.rows)
+                yield (
+                    [id.decode() for id in self.ids[start:stop]],
+                    [self.text(row) for row in range(start, stop)],
+                    np.asarray(self.embeddings[start:stop], dtype=np.float32),
+                    [loads(metadata.readline()) for _ in range(start, stop)]
+                )
+
+
+class SnapshotWriter:
+    """
+    grava um snapshot em <path>.partial, linha a linha, e o move para <path> ao fechar;
+    um snapshot interrompido nunca fica com o nome (nem o manifest) de um completo
+    """
+    def __init__(self, path: Path, manifest: Dict):
+        self.path = path
+        self.partial = path.with_name(f"{path.name}.partial")
+        self.manifest = manifest
+        self.dtype = np.dtype(manifest["dtype"])
+        self.rows = 0
+        self.offset = 0
+        shutil.rmtree(self.partial, ignore_errors=True)
+        self.partial.mkdir(parents=True)
+        self.files = {
+            name: open(self.partial / name, "wb")
+            for name in ["ids.bin", "offsets.bin", "texts.bin", "embeddings.bin", "metadata.ndjson"]
+        }
+        self.files["offsets.bin"].write(np.zeros(1, dtype=np.int64).tobytes())
+
+    def write(self, ids: List[str], texts: List[str], embeddings: np.ndarray, metadata: List[Dict]) -> None:
+        encoded = [text.encode() for text in texts]
+        offsets = self.offset + np.cumsum([len(text) for text in encoded], dtype=np.int64)
+        self.files["ids.bin"].write(np.asarray(ids, dtype="S32").tobytes())
+        self.files["offsets.bin"].write(offsets.tobytes())
+        self.files["texts.bin"].write(b"".join(encoded))
+        self.files["embeddings.bin"].write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+        self.files["metadata.ndjson"].write(b"".join(dumps(meta, option=OPT_APPEND_NEWLINE) for meta in metadata))
+        self.rows += len(ids)
+        self.offset = int(offsets[-1]) if len(offsets) else self.offset
+
+    def close(self) -> None:
+        for file in self.files.values():
+            file.close()
+        manifest = dict(self.manifest, rows=self.rows)
+        (self.partial / "manifest.json").write_bytes(dumps(manifest, option=OPT_INDENT_2))
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.partial.rename(self.path)
+
+    def abort(self) -> None:
+        for file in self.files.values():
+            file.close()
+        shutil.rmtree(self.partial, ignore_errors=True)
+
+
+class NamespaceSnapshots:
+    """
+    exporta um namespace (ids, textos, metadados e embeddings) do Milvus e do Mongo para um snapshot,
+    e importa snapshots em lotes grandes, sem nenhuma chamada de embedding
+    """
+    def __init__(self, collection: Collection, vector_factory: VectorFactory = None,
+                 directory: str = None, batch_size: int = None, interval: float = 5.0):
+        self.collection = collection
+        self.vectorFactory = VectorFactory() if vector_factory is None else vector_factory
+        self.directory = Path(env.SNAPSHOT_DIR if directory is None else directory)
+        self.batch_size: int = env.SNAPSHOT_BATCH_SIZE if batch_size is None else batch_size
+        # segundos entre registros de progresso
+        self.interval = interval
+
+    def path(self, name: str) -> Path:
+        if not NAME.fullmatch(name) or name.endswith(".partial"):
+            raise ValueError(f"Invalid snapshot name: {name}")
+        return self.directory / name
+
+    def open(self, name: str) -> Union[Snapshot, None]:
+        path = self.path(name)
+        if not (path / "manifest.json").exists():
+            return None
+        return Snapshot(path)
+
+    def all(self) -> List[Snapshot]:
+        if not self.directory.exists():
+            return []
+        return [
+            Snapshot(path) for path in sorted(self.directory.iterdir())
+            if (path / "manifest.json").exists() and not path.name.endswith(".partial")
+        ]
+
+    def embedding(self) -> Tuple[str, int]:
+        # modelo e dimensão da coleção por trás do alias (trocados por uma migração)
+        info = describe_collection(self.collection.describe())
+        return info["model"] or env.OPENAI_EMBEDDING_MODEL, info["dim"]
+
+    def count(self, namespace: str) -> int:
+        result = self.collection.query(expr=f"ns == \"{namespace}\"", output_fields=["count(*)"])
+        return result[0]["count(*)"] if result else 0
+
+    def metadata(self, ids: List[str]) -> List[Dict]:
+        found = {
+            vec["id"]: vec for vec in self.vectorFactory.mongo.find(
+                {"id": {"$in": ids}}, {"_id": 0, "id": 1, **{field: 1 for field in METADATA}}
+            )
+        }
+        return [
+            {field: found.get(id, {}).get(field) for field in METADATA} for id in ids
+        ]
+
+    def export(self, namespace: str, name: str, dtype: str = "float32",
+               report: Callable[[Progress], None] = None) -> Snapshot:
+        """
+        grava o namespace no snapshot name, lendo o Milvus com query_iterator (lotes de SNAPSHOT_BATCH_SIZE)
+        e os metadados do Mongo pelo id de cada lote
+        :param dtype: float32 ou float16 (metade do tamanho)
+        :param report: chamado com o Progress a cada intervalo
+        :return:
+        """
+        if dtype not in DTYPES:
+            raise ValueError(f"Invalid dtype: {dtype} (expected one of {', '.join(DTYPES)})")
+        model, dim = self.embedding()
+        writer = SnapshotWriter(self.path(name), dict(
+            format=FORMAT,
+            namespace=namespace,
+            model=model,
+            dim=dim,
+            dtype=dtype,
+            created_at=datetime.utcnow().isoformat()
+        ))
+        progress = Progress(f"Snapshot {name} export", self.count(namespace), report, self.interval)
+        progress.flush()
+        iterator = self.collection.query_iterator(
+            batch_size=self.batch_size, expr=f"ns == \"{namespace}\"", output_fields=["id", "text", "embedding"]
+        )
+        try:
+            while True:
+                with stage("milvus_query"):
+                    batch = iterator.next()
+                if not batch:
+                    break
+                ids = [row["id"] for row in batch]
+                writer.write(
+                    ids,
+                    [row["text"] for row in batch],
+                    np.asarray([row["embedding"] for row in batch], dtype=np.float32),
+                    self.metadata(ids)
+                )
+                progress.advance(len(batch))
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            iterator.close()
+
+        progress.total = writer.rows
+        progress.flush()
+        return Snapshot(writer.path)
+
+    def moved(self, ids: List[str], namespace: str) -> Dict[str, List[str]]:
+        # ids já gravados em outro namespace: o upsert os move, e os caches do namespace antigo precisam saber
+        with stage("milvus_query"):
+            rows = self.collection.query(expr=f"id in {str(ids)}", output_fields=["id", "ns"])
+        moved: Dict[str, List[str]] = {}
+        for row in rows:
+            if row["ns"] != namespace:
+                moved.setdefault(row["ns"], []).append(row["id"])
+        return moved
+
+    @staticmethod
+    def mirror(ids: List[str], texts: List[str], namespace: str, vectors: List[List[float]]) -> int:
+        """
+        com uma migração em andamento, grava o lote também na coleção nova (DualWrite), como os upserts do worker;
+        os vetores do snapshot são copiados quando a migração mantém o modelo e re-embedados quando não
+        :return: quantidade de chunks gravados na coleção nova
+        """
+        migration = dual_write.current()
+        if migration is None:
+            return 0
+        tokenizer = EmbeddingMigration.tokenizer(migration["target"]["model"])
+        return dual_write.upsert(
+            [
+                ChunkTasksDocument(id=id, text=text, namespace=namespace,
+                                   tokens=len(tokenizer.encode(text, disallowed_special=())))
+                for id, text in zip(ids, texts)
+            ],
+            dict(zip(ids, vectors))
+        )
+
+    def restore(self, name: str, namespace: str = None, report: Callable[[Progress], None] = None) -> int:
+        """
+        importa o snapshot name no Milvus e no Mongo (upsert por id, em lotes de SNAPSHOT_BATCH_SIZE)
+        :param namespace: destino; padrão o namespace exportado
+        :param report: chamado com o Progress a cada intervalo
+        :return: quantidade de vetores importados
+        """
+        snapshot = self.open(name)
+        if snapshot is None:
+            raise ValueError(f"Snapshot not found: {name}")
+        manifest = snapshot.manifest
+        model, dim = self.embedding()
+        # embeddings de outro modelo (ou dimensão) não são comparáveis com as consultas desta base
+        if manifest["model"] != model or manifest["dim"] != dim:
+            raise ValueError(f"Snapshot {name} was built with {manifest['model']} ({manifest['dim']} dims); "
+                             f"this collection uses {model} ({dim} dims)")
+        namespace = manifest["namespace"] if namespace is None else namespace
+
+        progress = Progress(f"Snapshot {name} restore", snapshot.rows, report, self.interval)
+        progress.flush()
+        for ids, texts, embeddings, metadata in snapshot.batches(self.batch_size):
+            moved = self.moved(ids, namespace)
+            vectors = embeddings.tolist()
+            with stage("milvus_upsert"):
+                self.collection.upsert(data=[ids, texts, [namespace] * len(ids), vectors])
+            self.mirror(ids, texts, namespace, vectors)
+            self.vectorFactory.upsert(request=[
+                Vector(id=id, content=text, namespace=namespace, **meta)
+                for id, text, meta in zip(ids, texts, metadata)
+            ])
+            self.vectorFactory.namespaceFactory.publish(namespace, upserted=ids)
+            for other, other_ids in moved.items():
+                self.vectorFactory.namespaceFactory.publish(other, deleted=other_ids)
+            progress.advance(len(ids))
+
+        progress.flush()
+        return progress.done
@@ -1,40 +1,174 @@
+import asyncio
+import os
 import shutil
+import tempfile
 import aiofiles
 
+from pathlib import Path
+from typing import AsyncIterator, Callable, Tuple, Union
+from uuid import uuid4
 from models import TextToVoiceRequest, Audio
-from aiohttp import ClientSession
+from aiohttp import ClientSession, ClientResponse
 from config import env
+from metrics import error, stage
+from .audio_cache import audio_cache
 
 
 class Voice:
-    def __init__(self, request: TextToVoiceRequest):
+    chunk_size = 8192 # 8 KB
+
+    def __init__(self, request: TextToVoiceRequest, session: ClientSession = None, voice_id: str = None):
         self.request = request
+        self.session = session
+        self.voice_id = env.ASKING_VOICE_ID if voice_id is None else voice_id
+        # resposta aberta por stream() (e a sessão criada só para ela), liberadas por aclose()
+        self.response: Union[ClientResponse, None] = None
+        self.owned: Union[ClientSession, None] = None
+
+    @property
+    def url(self) -> str:
+        return f"https://api.elevenlabs.io/v1/text-to-speech/{self.voice_id}/stream"
+
+    @property
+    def payload(self) -> dict:
+        return {
+            "model_id": "eleven_multilingual_v2",
+            "text": self.request.content,
+            "voice_settings": {
+                "similarity_boost": 1,
+                "stability": 1,
+                "style": 1,
+                "use_speaker_boost": True
+            }
+        }
+
+    @property
+    def headers(self) -> dict:
+        return {"Content-Type": "application/json", "xi-api-key": env.ELEVENLABS_API_KEY}
+
+    def cache_key(self, variant: str = "") -> str:
+        return audio_cache.key(self.voice_id, self.payload, variant)
+
+    async def text_to_voice(self, cache: bool = True) -> Audio:
+        if cache:
+            key = self.cache_key()
+            path = audio_cache.get(key)
+            if path is not None:
+                return Audio(
+                    success=True,
+                    absolute_path=str(path),
+                    url=audio_cache.url(key)
+                )
+
+        if self.session is None:
+            async with ClientSession() as sess:
+                return await self.synthesize(sess, cache)
+        return await self.synthesize(self.session, cache)
 
-    async def text_to_voice(self) -> Audio:
-        async with ClientSession() as sess:
-            async with sess.post(f"https://api.elevenlabs.io/v1/text-to-speech/{env.ASKING_VOICE_ID}/stream", json={
-                "model_id": "eleven_multilingual_v2",
-                "text": self.request.content,
-                "voice_settings": {
-                    "similarity_boost": 1,
-                    "stability": 1,
-                    "style": 1,
-                    "use_speaker_boost": True
-                }
-            }, headers={"Content-Type": "application/json", "xi-api-key": env.ELEVENLABS_API_KEY}) as response:
-                if response.status == 200:
-                    chunk_size = 8192 # 8 KB
-                    chunk: bytes
-                    async with aiofiles.tempfile.NamedTemporaryFile(delete=False) as temp_file:
+    async def synthesize(self, sess: ClientSession, cache: bool = True) -> Audio:
+        async with sess.post(self.url, json=self.payload, headers=self.headers) as response:
+            if response.status == 200:
+                chunk: bytes
+                async with aiofiles.tempfile.NamedTemporaryFile(delete=False) as temp_file:
+                    with stage("tts"):
                         async with aiofiles.open(temp_file.name, "wb") as file:
-                            async for chunk in response.content.iter_chunked(chunk_size):
+                            async for chunk in response.content.iter_chunked(self.chunk_size):
                                 await file.write(chunk)
                             await file.close()
-                        await temp_file.close()
+                    await temp_file.close()
 
-                        shutil.move(temp_file.name, f"{temp_file.name}.mp3")
+                    if cache and env.AUDIO_CACHE_ENABLED:
+                        key = self.cache_key()
+                        path = await asyncio.to_thread(audio_cache.put, key, temp_file.name)
                         return Audio(
                             success=True,
-                            absolute_path=f"{temp_file.name}.mp3"
+                            absolute_path=str(path),
+                            url=audio_cache.url(key)
                         )
-                return Audio()
+
+                    shutil.move(temp_file.name, f"{temp_file.name}.mp3")
+                    return Audio(
+                        success=True,
+                        absolute_path=f"{temp_file.name}.mp3",
+                        url=f"{env.LEARN_FRONT_END}/files/{temp_file.name.split('/')[-1]}.mp3"
+                    )
+            error("tts", f"HTTP {response.status}")
+            return Audio()
+
+    async def stream(self, save: bool = False) -> Tuple[Union[AsyncIterator[bytes], None], Union[str, None]]:
+        """
+        devolve os bytes do áudio à medida que chegam do provedor (ou do cache, sem chamar o provedor)
+        e a URL em que o arquivo completo ficará disponível, quando for gravado
+        :param save: grava uma cópia mesmo com o cache desabilitado
+        :return: (None, None) quando o provedor recusa a requisição (antes de qualquer byte enviado);
+        quem recebe o iterador deve chamar aclose() caso ele possa não ser consumido
+        """
+        key = self.cache_key()
+        path = audio_cache.get(key)
+        if path is not None:
+            return self.iter_file(path), audio_cache.url(key)
+
+        sess = ClientSession() if self.session is None else self.session
+        self.owned = sess if sess is not self.session else None
+        try:
+            with stage("tts_first_byte"):
+                self.response = await sess.post(self.url, json=self.payload, headers=self.headers)
+        except Exception:
+            await self.aclose()
+            raise
+        if self.response.status != 200:
+            error("tts", f"HTTP {self.response.status}")
+            await self.aclose()
+            return None, None
+
+        if env.AUDIO_CACHE_ENABLED:
+            part = audio_cache.temporary(key)
+            return self.iter_stream(self.response, part, lambda p: audio_cache.put(key, p)), audio_cache.url(key)
+        if save:
+            absolute_path = f"{tempfile.gettempdir()}/{uuid4().hex}.mp3"
+            part = Path(f"{absolute_path}.part")
+            return (self.iter_stream(self.response, part, lambda p: os.replace(p, absolute_path)),
+                    f"{env.LEARN_FRONT_END}/files/{absolute_path.split('/')[-1]}")
+        return self.iter_stream(self.response), None
+
+    async def aclose(self) -> None:
+        """
+        libera a resposta aberta por stream() e fecha a sessão criada para ela; idempotente. chamado pelo
+        iter_stream ao terminar e pela rota como background do StreamingResponse: um gerador que nunca
+        começou a ser iterado não executa o próprio finally
+        :return:
+        """
+        response, self.response = self.response, None
+        if response is not None:
+            response.release()
+        sess, self.owned = self.owned, None
+        if sess is not None:
+            await sess.close()
+
+    async def iter_file(self, path: Path) -> AsyncIterator[bytes]:
+        async with aiofiles.open(path, "rb") as file:
+            while chunk := await file.read(self.chunk_size):
+                yield chunk
+
+    async def iter_stream(self, response: ClientResponse, part: Path = None,
+                          publish: Callable[[Path], object] = None) -> AsyncIterator[bytes]:
+        file = None
+        completed = False
+        try:
+            if part is not None:
+                # grava em .part e só publica o arquivo quando o stream termina
+                file = await aiofiles.open(part, "wb")
+            chunk: bytes
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                if file is not None:
+                    await file.write(chunk)
+                yield chunk
+            completed = True
+        finally:
+            await self.aclose()
+            if file is not None:
+                await file.close()
+                if completed:
+                    await asyncio.to_thread(publish, part)
+                else:
+                    os.remove(part)
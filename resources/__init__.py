@@ -0,0 +1 @@
+from .registry import Resources, get_resources, get_milvus, get_vector_factory
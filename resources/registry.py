@@ -0,0 +1,182 @@
+import asyncio
+from typing import Union
+
+from aiohttp import ClientSession
+from fastapi import Request
+from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from loguru import logger
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymilvus import connections, db, Collection
+from pymongo import MongoClient
+
+from config import env
+from databases import AsyncMongo, Mongo, aprovision, close_clients, mongo_client, motor_client
+from factory import VectorFactory, NamespaceFactory, DeletionJobFactory, SnapshotJobFactory, MigrationFactory
+from generative import GenBot, GenQuiz, QuizPool, answer_cache
+from provider import (
+    MilvusSearch, EmbeddingCoalescer, NamespaceSnapshots, EmbeddingMigration, ActiveCollection, embedding_cache,
+    jingle, lexical_index, hot_index, active_collection, dual_write
+)
+
+
+class Resources:
+    """
+    recursos caros de construir, criados uma única vez por processo
+    (coleção do Milvus, clientes OpenAI, clientes Mongo/Motor e sessão HTTP)
+    """
+    def __init__(self):
+        self.collection: Union[Collection, None] = None
+        self.embeddings_model: Union[OpenAIEmbeddings, None] = None
+        self.chat_llm: Union[ChatOpenAI, None] = None
+        self.quiz_llm: Union[ChatOpenAI, None] = None
+        # reposição do estoque de quizzes: temperatura maior, para os quizzes de uma mesma chave variarem
+        self.pool_llm: Union[ChatOpenAI, None] = None
+        self.mongo: Union[MongoClient, None] = None
+        self.motor: Union[AsyncIOMotorClient, None] = None
+        self.session: Union[ClientSession, None] = None
+        self.milvus: Union[MilvusSearch, None] = None
+        self.coalescer: Union[EmbeddingCoalescer, None] = None
+
+    def open(self) -> "Resources":
+        if not db.connections.has_connection("default"):
+            connections.connect(
+                alias="default",
+                host=env.MILVUS_HOST,
+                port=env.MILVUS_PORT
+            )
+        db.using_database(env.MILVUS_DB_NAME)
+
+        self.collection = MilvusSearch.get_collection()
+        self.collection.load()
+        self.embeddings_model = OpenAIEmbeddings(
+            model=env.OPENAI_EMBEDDING_MODEL,
+            openai_api_key=env.OPENAI_API_KEY
+        )
+        self.milvus = MilvusSearch(collection=self.collection, embeddings_model=self.embeddings_model)
+        self.mongo = mongo_client()
+        self.chat_llm = GenBot.llmChatOpenAI(temperature=.1)
+        self.quiz_llm = GenQuiz.llmChatOpenAI(temperature=0)
+        self.pool_llm = GenQuiz.llmChatOpenAI(temperature=env.QUIZ_POOL_TEMPERATURE)
+        self.watch()
+        return self
+
+    def watch(self) -> None:
+        # alias do Milvus e migração em andamento: quando o alias troca de coleção, o processo troca de modelo
+        active_collection.use(self.collection)
+        active_collection.subscribe(self.milvus.use_embeddings)
+        dual_write.use(self.migrations())
+
+    async def aopen(self) -> "Resources":
+        self.open()
+        self.motor = motor_client()
+        self.session = ClientSession()
+        if env.MONGO_PROVISION_INDEXES:
+            await self.provision()
+        await self.bind()
+        return self
+
+    async def provision(self) -> None:
+        # índices de todas as coleções; uma falha (ex.: índice existente com outras opções) não impede a subida
+        try:
+            await aprovision(self.motor)
+        except Exception as e:
+            logger.error(f"Unable to provision Mongo indexes: {e}")
+
+    async def bind(self) -> None:
+        """
+        liga os singletons do processo (caches, índices e vinheta) aos clientes abertos
+        :return:
+        """
+        if env.EMBEDDING_COALESCE_ENABLED:
+            self.coalescer = EmbeddingCoalescer(self.embeddings_model)
+            self.milvus.coalescer = self.coalescer
+        embedding_cache.use(AsyncMongo("embeddings", client=self.motor))
+        answer_cache.use(AsyncMongo("namespaces", client=self.motor))
+        # embeddings do modelo anterior não são comparáveis com os do novo
+        active_collection.subscribe(self.switched)
+        namespace_factory = NamespaceFactory(
+            asyncmongo=AsyncMongo("namespaces", client=self.motor),
+            mongo=Mongo("namespaces", client=self.mongo)
+        )
+        lexical_index.use(AsyncMongo("vectors", client=self.motor), namespace_factory)
+        hot_index.use(self.collection, namespace_factory)
+        if env.QUIZ_VOICE_ENABLED:
+            await asyncio.to_thread(self.load_jingle)
+        logger.info("Shared resources initialized.")
+
+    @staticmethod
+    def switched(active: ActiveCollection) -> None:
+        answer_cache.clear()
+        hot_index.clear()
+
+    @staticmethod
+    def load_jingle() -> None:
+        # a vinheta do quiz é lida e decodificada uma vez, fora do caminho das requisições
+        try:
+            jingle.load().segment
+        except Exception as e:
+            logger.error(e)
+
+    def close(self) -> None:
+        # os clientes são os compartilhados do processo
+        close_clients()
+
+    async def aclose(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+        self.close()
+
+    def vector_factory(self) -> VectorFactory:
+        return VectorFactory(
+            asyncmongo=AsyncMongo("vectors", client=self.motor) if self.motor is not None else None,
+            mongo=Mongo("vectors", client=self.mongo) if self.mongo is not None else None
+        )
+
+    def deletion_jobs(self) -> DeletionJobFactory:
+        return DeletionJobFactory(
+            asyncmongo=AsyncMongo("deletion_jobs", client=self.motor) if self.motor is not None else None,
+            mongo=Mongo("deletion_jobs", client=self.mongo) if self.mongo is not None else None
+        )
+
+    def snapshot_jobs(self) -> SnapshotJobFactory:
+        return SnapshotJobFactory(
+            asyncmongo=AsyncMongo("snapshot_jobs", client=self.motor) if self.motor is not None else None,
+            mongo=Mongo("snapshot_jobs", client=self.mongo) if self.mongo is not None else None
+        )
+
+    def snapshots(self) -> NamespaceSnapshots:
+        return NamespaceSnapshots(collection=self.collection, vector_factory=self.vector_factory())
+
+    def migrations(self) -> MigrationFactory:
+        return MigrationFactory(
+            asyncmongo=AsyncMongo("embedding_migrations", client=self.motor) if self.motor is not None else None,
+            mongo=Mongo("embedding_migrations", client=self.mongo) if self.mongo is not None else None
+        )
+
+    def embedding_migration(self) -> EmbeddingMigration:
+        return EmbeddingMigration(
+            collection=self.collection, migrations=self.migrations(), vector_factory=self.vector_factory()
+        )
+
+    def quiz_pool(self) -> QuizPool:
+        return QuizPool(
+            asyncmongo=AsyncMongo("quizzes", client=self.motor) if self.motor is not None else None,
+            mongo=Mongo("quizzes", client=self.mongo) if self.mongo is not None else None,
+            demand=AsyncMongo("quizzes_demand", client=self.motor) if self.motor is not None else None,
+            namespaces=NamespaceFactory(
+                asyncmongo=AsyncMongo("namespaces", client=self.motor),
+                mongo=Mongo("namespaces", client=self.mongo)
+            ) if self.motor is not None and self.mongo is not None else None
+        )
+
+
+def get_resources(request: Request) -> Resources:
+    return request.app.state.resources
+
+
+def get_milvus(request: Request) -> MilvusSearch:
+    return get_resources(request).milvus
+
+
+def get_vector_factory(request: Request) -> VectorFactory:
+    return get_resources(request).vector_factory()
@@ -1,8 +1,13 @@
 from typing import List
 from config import env
-from provider import MilvusSearch, Voice
+from provider import MilvusSearch, Voice, dimensions
 from security import validate_token
-from tasks import upsert as task_learn_upsert
+from tasks import (
+    upsert as task_learn_upsert, upsert_batch as task_learn_upsert_batch,
+    refill_quiz_pool as task_refill_quiz_pool, delete_vectors as task_delete_vectors,
+    export_snapshot as task_export_snapshot, restore_snapshot as task_restore_snapshot,
+    migrate_embeddings as task_migrate_embeddings
+)
 from generative import GenBot, GenQuiz
 from models import (
     UpsertResponse, UpsertRequest, QueryResponse,
@@ -10,12 +15,23 @@ from models import (
     GenQuizResponse, GenQuizRequest, Vector,
     VectorFilterRequest, AllVectorFactoryRequest, VectorDeleteRequest,
     AllDeleteVectorFactoryRequest, VectorDeleteResponse, VectorUsernamesDeleteRequest,
-    VectorUsernamesDeleteResponse, TextToVoiceRequest
+    VectorUsernamesDeleteResponse, TextToVoiceRequest, UpsertBatchRequest, UpsertBatchResponse,
+    VectorDeleteFilter, VectorDeleteJobResponse, VectorDeleteJob, VectorExportRequest,
+    SnapshotExportRequest, SnapshotRestoreRequest, SnapshotJobResponse, SnapshotJob, SnapshotInfo,
+    MigrationRequest, MigrationResponse, Migration
 )
 from loguru import logger
-from fastapi import Depends, HTTPException, Body, Query, APIRouter
+from metrics import error
+from fastapi import Depends, HTTPException, Body, Query, APIRouter, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from orjson import dumps
 from time import time
+from datetime import datetime
+import asyncio
 from factory import VectorFactory
+from databases import InvalidPageToken
+from resources import Resources, get_resources, get_milvus, get_vector_factory
 
 
 api = APIRouter(
@@ -37,19 +53,39 @@ def upsert(request: UpsertRequest = Body(...)):
         return UpsertResponse()
     except Exception as e:
         logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+@api.post(
+    "/upsert/batch",
+    response_model=UpsertBatchResponse,
+    summary="Teach the robot in batch",
+    description="Upload many contents to the vector database in a single job."
+)
+def upsert_batch(request: UpsertBatchRequest = Body(...)):
+    try:
+        job = task_learn_upsert_batch.delay([doc.model_dump() for doc in request.documents])
+
+        logger.info(f"[{job.id}] upsert batch job queued successfully; documents: {len(request.documents)}.")
+        return UpsertBatchResponse(job_id=job.id)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
 @api.get(
     "/semantic-search",
     response_model=QueryResponse,
     summary="Retrieve a list of contexts",
-    description="Retrieve a list of content from the vector database."
+    description="Retrieve a list of content from the vector database. `mode` selects vector (ANN), lexical (BM25) "
+                "or hybrid (both fused by reciprocal-rank fusion) retrieval; defaults to SEARCH_MODE."
 )
-async def semantic_search(q = Query(..., title="query", max_length=50), ns = Query("default", title="namespace", max_length=32)):
+async def semantic_search(q = Query(..., title="query", max_length=50), ns = Query("default", title="namespace", max_length=32),
+                          mode = Query(None, title="mode", pattern="^(vector|lexical|hybrid)$"),
+                          milvus: MilvusSearch = Depends(get_milvus)):
     try:
         stime = time()
-        milvus = MilvusSearch()
-        responses = await milvus.asearch(query=q, ns=ns)
+        responses = await milvus.asearch(query=q, ns=ns, mode=mode)
 
         if env.DEBUG:
             logger.debug(f"Semantic search was executed successfully; time: {time() - stime}")
@@ -65,6 +101,7 @@ async def semantic_search(q = Query(..., title="query", max_length=50), ns = Que
         )
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
 @api.post(
@@ -73,10 +110,10 @@ async def semantic_search(q = Query(..., title="query", max_length=50), ns = Que
     summary="Get a response from the robot",
     description="Retrieve a response from the GPT model, using the context from the vector database."
 )
-async def asking(request: AnswerRequest):
+async def asking(request: AnswerRequest, resources: Resources = Depends(get_resources)):
     try:
         stime = time()
-        gen = GenBot(request.username)
+        gen = GenBot(request.username, milvus=resources.milvus, llm=resources.chat_llm)
         response = await gen.generate(
             q=request.q,
             namespace=request.namespace,
@@ -93,22 +130,73 @@ async def asking(request: AnswerRequest):
         )
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
+@api.post(
+    "/asking/stream",
+    response_class=StreamingResponse,
+    summary="Stream a response from the robot",
+    description="Stream the GPT model response as Server-Sent Events (token events followed by a usage event)."
+)
+async def asking_stream(request: AnswerRequest, resources: Resources = Depends(get_resources)):
+    gen = GenBot(request.username, milvus=resources.milvus, llm=resources.chat_llm)
+
+    async def events():
+        stime = time()
+        try:
+            async for event, data in gen.astream(
+                q=request.q,
+                namespace=request.namespace,
+                personality=request.personality,
+                swear_words=request.swear_words,
+                informal_greeting=request.informal_greeting
+            ):
+                yield f"event: {event}\ndata: {dumps(data).decode()}\n\n"
+
+            if env.DEBUG:
+                logger.debug(f"question streamed successfully; time: {time() - stime}")
+        except Exception as e:
+            logger.error(e)
+            error("api", e)
+            yield f"event: error\ndata: {dumps({'detail': str(e)}).decode()}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @api.post(
     "/text-to-speech",
     response_model=TextToVoiceResponse,
     summary="Text to Speech",
-    description="Transcribe a text to audio."
+    description="Transcribe a text to audio. With `stream` enabled the audio/mpeg bytes are streamed back "
+                "while they are synthesized; the URL of the stored copy (audio cache or `save`) is sent in `X-Voice-Url`."
 )
-async def text_to_speech(request: TextToVoiceRequest):
-    if not env.LEARN_VOICE_ENABLED:
+async def text_to_speech(request: TextToVoiceRequest, resources: Resources = Depends(get_resources)):
+    if not env.ASKING_VOICE_ENABLED:
         return TextToVoiceResponse(
             success=False
         )
     try:
         stime = time()
-        voice = Voice(request)
+        voice = Voice(request, session=resources.session)
+        if request.stream:
+            audio_stream, url = await voice.stream(save=request.save)
+            if audio_stream is None:
+                raise HTTPException(status_code=500, detail="Unable to transform text into audio.")
+
+            if env.DEBUG:
+                logger.debug(f"text to audio stream opened successfully; time: {time() - stime}")
+
+            headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            if url is not None:
+                headers["X-Voice-Url"] = url
+            # libera a resposta do provedor mesmo se o corpo nunca for iterado (ex.: cliente desconectado)
+            return StreamingResponse(audio_stream, media_type="audio/mpeg", headers=headers,
+                                     background=BackgroundTask(voice.aclose))
+
         audio = await voice.text_to_voice()
 
         if audio.absolute_path is None:
@@ -119,10 +207,11 @@ async def text_to_speech(request: TextToVoiceRequest):
 
         return TextToVoiceResponse(
             path=audio.absolute_path,
-            url=f"{env.LEARN_FRONT_END}/files/{audio.absolute_path.split('/')[-1]}"
+            url=audio.url
         )
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
 @api.post(
@@ -131,14 +220,31 @@ async def text_to_speech(request: TextToVoiceRequest):
     summary="Generate a questionnaire",
     description="Generate a questionnaire with alternatives using the GPT model with context."
 )
-async def questionnaire(request: GenQuizRequest):
+async def questionnaire(request: GenQuizRequest, resources: Resources = Depends(get_resources)):
     if request.theme is None:
         return GenQuizResponse(
             success=False
         )
     try:
         stime = time()
-        quiz = await GenQuiz(theme=request.theme, amount=request.amount).generate(request.namespace)
+        quiz = None
+        pool = resources.quiz_pool() if env.QUIZ_POOL_ENABLED else None
+        if pool is not None:
+            quiz = await pool.apop(request.namespace, request.theme, request.amount)
+        hit = quiz is not None
+
+        if quiz is None:
+            quiz = await GenQuiz(
+                theme=request.theme,
+                amount=request.amount,
+                milvus=resources.milvus,
+                llm=resources.quiz_llm,
+                session=resources.session
+            ).generate(request.namespace)
+
+        if pool is not None and await pool.awanted(request.namespace, request.theme, request.amount, hit):
+            job = task_refill_quiz_pool.delay(request.namespace, request.theme, request.amount)
+            logger.info(f"[{job.id}] quiz pool refill job queued successfully.")
 
         if env.DEBUG:
             logger.debug(f"Quiz generated successfully; time: {time() - stime}")
@@ -151,42 +257,77 @@ async def questionnaire(request: GenQuizRequest):
         )
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
 @api.post(
     "/vectors",
     response_model=List[Vector],
     summary="Retrieve a list of vectors",
-    description="Retrieve a list of vectors from the NoSQL database"
+    description="Retrieve a list of vectors from the NoSQL database. When the page is full, the X-Next-After "
+                "header carries the token for the next page (send it as `after`, with the same filter and sort)."
 )
-async def vectors_fetch(request: VectorFilterRequest):
+async def vectors_fetch(request: VectorFilterRequest, response: Response,
+                        vector_factory: VectorFactory = Depends(get_vector_factory)):
     try:
-        return await VectorFactory().afind_all(
+        vectors, after = await vector_factory.afind_page(
             AllVectorFactoryRequest(
                 filter=request.filter,
                 sort=request.sort,
                 skip=request.skip,
-                limit=request.limit
+                limit=request.limit,
+                after=request.after
             )
         )
+        if after is not None:
+            response.headers["X-Next-After"] = after
+        return vectors
+    except InvalidPageToken as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)}")
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
+@api.post(
+    "/vectors/export",
+    response_class=StreamingResponse,
+    summary="Export vectors",
+    description="Stream the vectors matching the filter as NDJSON (one vector per line), optionally gzip-compressed."
+)
+async def vectors_export(request: VectorExportRequest, vector_factory: VectorFactory = Depends(get_vector_factory)):
+    async def lines():
+        try:
+            async for chunk in vector_factory.aexport(request.filter, request.gzip):
+                yield chunk
+        except Exception as e:
+            # a resposta já começou: o erro só interrompe o corpo
+            logger.error(e)
+            error("api", e)
+            raise
+
+    filename = "vectors.ndjson.gz" if request.gzip else "vectors.ndjson"
+    return StreamingResponse(
+        lines(),
+        media_type="application/gzip" if request.gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api.delete(
     "/vectors",
     response_model=VectorDeleteResponse,
     summary="Delete vectors",
     description="Delete a set of vectors using IDs."
 )
-async def delete_vectors_by_ids(request: VectorDeleteRequest):
+async def delete_vectors_by_ids(request: VectorDeleteRequest, resources: Resources = Depends(get_resources)):
     try:
-        await VectorFactory().adelete_all(request=AllDeleteVectorFactoryRequest(ids=request.ids))
-        await MilvusSearch().adelete(ids=request.ids)
+        await resources.vector_factory().adelete_all(request=AllDeleteVectorFactoryRequest(ids=request.ids))
+        await resources.milvus.adelete(ids=request.ids)
 
         return VectorDeleteResponse()
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
 
 
@@ -196,30 +337,226 @@ async def delete_vectors_by_ids(request: VectorDeleteRequest):
     summary="Delete vectors by usernames",
     description="Delete a set of vectors using by usernames."
 )
-async def delete_vectors_by_username(request: VectorUsernamesDeleteRequest):
-    try:
-        vectors = [
-            _ for username in request.usernames
-            for _ in await VectorFactory().afind_all(
-                AllVectorFactoryRequest(
-                    filter={"created_by": username},
-                    sort={"_id": -1},
-                    skip=0,
-                    limit=250
-                )
-            )
-        ]
-        if len(vectors) == 0:
+async def delete_vectors_by_username(request: VectorUsernamesDeleteRequest, resources: Resources = Depends(get_resources)):
+    try:
+        if len(request.usernames) == 0:
             return VectorUsernamesDeleteResponse()
 
-        ids: List[str] = [
-            vec.id for vec in vectors
+        # todos os vetores dos usuários, sem limite, removidos em segundo plano
+        job_id = await queue_deletion(VectorDeleteFilter(usernames=request.usernames), resources)
+        return VectorUsernamesDeleteResponse(job_id=job_id)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+
+async def queue_deletion(filter: VectorDeleteFilter, resources: Resources) -> str:
+    job_id = await resources.deletion_jobs().acreate(filter)
+    task_delete_vectors.apply_async(args=[job_id, filter.model_dump(exclude_none=True, mode="json")], task_id=job_id)
+    logger.info(f"[{job_id}] deletion job queued successfully; filter: {filter.model_dump(exclude_none=True)}.")
+    return job_id
+
+
+@api.post(
+    "/vectors/deletions",
+    response_model=VectorDeleteJobResponse,
+    summary="Delete vectors by filter",
+    description="Queue a job that deletes every vector matching the filter "
+                "(usernames, namespace, ids, created_at range)."
+)
+async def delete_vectors_by_filter(request: VectorDeleteFilter, resources: Resources = Depends(get_resources)):
+    try:
+        return VectorDeleteJobResponse(job_id=await queue_deletion(request, resources))
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+
+@api.get(
+    "/vectors/deletions/{job_id}",
+    response_model=VectorDeleteJob,
+    summary="Deletion job progress",
+    description="State and progress (deleted / total) of a deletion job."
+)
+async def deletion_job(job_id: str, resources: Resources = Depends(get_resources)):
+    try:
+        job = await resources.deletion_jobs().aget(job_id)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@api.get(
+    "/snapshots",
+    response_model=List[SnapshotInfo],
+    summary="List namespace snapshots",
+    description="Completed snapshots available in SNAPSHOT_DIR."
+)
+async def list_snapshots(resources: Resources = Depends(get_resources)):
+    try:
+        snapshots = await asyncio.to_thread(resources.snapshots().all)
+        return [
+            SnapshotInfo(name=snapshot.path.name, bytes=snapshot.nbytes, **snapshot.manifest)
+            for snapshot in snapshots
         ]
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+
+@api.post(
+    "/snapshots",
+    response_model=SnapshotJobResponse,
+    summary="Export a namespace snapshot",
+    description="Queue a job that exports the ids, texts, metadata and embeddings of a namespace "
+                "to a snapshot (float32 or float16 embeddings)."
+)
+async def export_snapshot(request: SnapshotExportRequest, resources: Resources = Depends(get_resources)):
+    name = request.name or f"{request.namespace}-{datetime.utcnow():%Y%m%d%H%M%S}"
+    try:
+        resources.snapshots().path(name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)}")
+    try:
+        job_id = await resources.snapshot_jobs().acreate("export", name, request.namespace, request.dtype)
+        task_export_snapshot.apply_async(args=[job_id, request.namespace, name, request.dtype], task_id=job_id)
+        logger.info(f"[{job_id}] snapshot export queued successfully; namespace: {request.namespace}; name: {name}.")
+        return SnapshotJobResponse(job_id=job_id, name=name)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
 
-        await VectorFactory().adelete_all(request=AllDeleteVectorFactoryRequest(ids=ids))
-        await MilvusSearch().adelete(ids=ids)
 
-        return VectorUsernamesDeleteResponse()
+@api.post(
+    "/snapshots/{name}/restore",
+    response_model=SnapshotJobResponse,
+    summary="Restore a namespace snapshot",
+    description="Queue a job that loads a snapshot into Milvus and Mongo without embedding calls, "
+                "optionally into another namespace."
+)
+async def restore_snapshot(name: str, request: SnapshotRestoreRequest = Body(SnapshotRestoreRequest()),
+                           resources: Resources = Depends(get_resources)):
+    try:
+        snapshot = await asyncio.to_thread(resources.snapshots().open, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)}")
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Snapshot not found")
+    try:
+        namespace = request.namespace or snapshot.manifest["namespace"]
+        job_id = await resources.snapshot_jobs().acreate("restore", name, namespace, snapshot.manifest["dtype"])
+        task_restore_snapshot.apply_async(args=[job_id, name, namespace], task_id=job_id)
+        logger.info(f"[{job_id}] snapshot restore queued successfully; name: {name}; namespace: {namespace}.")
+        return SnapshotJobResponse(job_id=job_id, name=name)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+
+@api.get(
+    "/snapshots/jobs/{job_id}",
+    response_model=SnapshotJob,
+    summary="Snapshot job progress",
+    description="State, progress (done / total) and throughput of a snapshot export or restore job."
+)
+async def snapshot_job(job_id: str, resources: Resources = Depends(get_resources)):
+    try:
+        job = await resources.snapshot_jobs().aget(job_id)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@api.post(
+    "/migrations",
+    response_model=MigrationResponse,
+    summary="Migrate to another embedding model",
+    description="Queue a resumable job that re-embeds every vector into a new collection for the target "
+                "model and dimension, dual-writing new upserts, and then switches reads to it through the "
+                "collection alias. With the current model, it moves the vectors to a collection with another "
+                "namespace partition layout without re-embedding them."
+)
+async def start_migration(request: MigrationRequest, resources: Resources = Depends(get_resources)):
+    try:
+        dim = dimensions(request.model, request.dim)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)}")
+    partitions = env.MILVUS_NAMESPACE_PARTITIONS if request.partitions is None else request.partitions
+    migrations = resources.migrations()
+    try:
+        active = await migrations.aactive()
+        if active is not None:
+            raise HTTPException(status_code=409, detail=f"Migration {active.migration_id} is {active.state}")
+        migration_id = await migrations.acreate(request.model, dim, partitions)
+        task_migrate_embeddings.apply_async(args=[migration_id], task_id=migration_id)
+        logger.info(f"[{migration_id}] embedding migration queued successfully; model: {request.model}; dim: {dim}; "
+                    f"partitions: {partitions}.")
+        return MigrationResponse(migration_id=migration_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+
+@api.post(
+    "/migrations/{migration_id}/resume",
+    response_model=MigrationResponse,
+    summary="Resume an embedding migration",
+    description="Queue a failed migration again; it continues from its last checkpoint. "
+                "force=true also resumes a migration whose worker stopped without recording a failure."
+)
+async def resume_migration(migration_id: str, force: bool = Query(False),
+                           resources: Resources = Depends(get_resources)):
+    migrations = resources.migrations()
+    try:
+        migration = await migrations.aget(migration_id)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+    if migration is None:
+        raise HTTPException(status_code=404, detail="Migration not found")
+    if migration.state == "SUCCESS" or (migration.state != "FAILURE" and not force):
+        raise HTTPException(status_code=409, detail=f"Migration is {migration.state}")
+    try:
+        task_migrate_embeddings.apply_async(args=[migration_id])
+        logger.info(f"[{migration_id}] embedding migration resumed from {migration.checkpoint}.")
+        return MigrationResponse(migration_id=migration_id)
+    except Exception as e:
+        logger.error(e)
+        error("api", e)
+        raise HTTPException(status_code=500, detail=f"{str(e)}")
+
+
+@api.get(
+    "/migrations/{migration_id}",
+    response_model=Migration,
+    summary="Embedding migration progress",
+    description="State, checkpoint, progress (done / total), throughput, tokens and estimated cost of an "
+                "embedding migration."
+)
+async def migration_progress(migration_id: str, resources: Resources = Depends(get_resources)):
+    try:
+        migration = await resources.migrations().aget(migration_id)
     except Exception as e:
         logger.error(e)
+        error("api", e)
         raise HTTPException(status_code=500, detail=f"{str(e)}")
+    if migration is None:
+        raise HTTPException(status_code=404, detail="Migration not found")
+    return migration
@@ -1 +1,4 @@
-from .milvus_schema import Schema as MilvusSchema
\ No newline at end of file
+from .milvus_schema import (
+    Schema as MilvusSchema, PROFILES as INDEX_PROFILES, index as milvus_index, search_params, schema as milvus_schema,
+    partitioning as milvus_partitioning, describe as describe_collection
+)
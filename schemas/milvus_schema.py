@@ -1,33 +1,110 @@
+import re
+from typing import Dict, List, Union
+
 from pymilvus import CollectionSchema, FieldSchema, DataType
 
-fields = [
-    FieldSchema(
-        name="id",
-        dtype=DataType.VARCHAR,
-        max_length=32,
-        is_primary=True,
-    ),
-    FieldSchema(
-        name="text",
-        dtype=DataType.VARCHAR,
-        max_length=526,
-        default_value=""
-    ),
-    FieldSchema(
-        name="ns",
-        dtype=DataType.VARCHAR,
-        max_length=32,
-        default_value="default"
-    ),
-    FieldSchema(
-        name="embedding",
-        dtype=DataType.FLOAT_VECTOR,
-        dim=1536
+# modelo de embedding gravado na descrição das coleções criadas pela migração
+MODEL = re.compile(r"\bmodel=([\w.:-]+)")
+
+# parâmetros de construção (build) e de busca (search) de cada índice; o perfil é escolhido por
+# MILVUS_INDEX_PROFILE e comparado com os demais pelo benchmarks/index_profiles.py
+PROFILES: Dict[str, Dict[str, Dict]] = {
+    "ivf_flat": dict(build={"index_type": "IVF_FLAT", "params": {"nlist": 128}}, search={"nprobe": 12}),
+    # vetores quantizados em 8 bits: ~1/4 da memória do IVF_FLAT
+    "ivf_sq8": dict(build={"index_type": "IVF_SQ8", "params": {"nlist": 128}}, search={"nprobe": 12}),
+    # m precisa dividir a dimensão (1536, 3072, 512 e 256 são múltiplos de 32)
+    "ivf_pq": dict(build={"index_type": "IVF_PQ", "params": {"nlist": 128, "m": 32, "nbits": 8}},
+                   search={"nprobe": 16}),
+    "hnsw": dict(build={"index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}}, search={"ef": 64}),
+}
+METRIC = "COSINE"
+
+
+def profile(name: str) -> Dict[str, Dict]:
+    if name not in PROFILES:
+        raise ValueError(f"Unknown index profile: {name} (expected one of {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+def index(name: str = "ivf_flat") -> Dict:
+    build = profile(name)["build"]
+    return {"metric_type": METRIC, "index_type": build["index_type"], "params": dict(build["params"])}
+
+
+def search_params(name: str = "ivf_flat", k: int = 0) -> Dict:
+    """
+    param do Collection.search para o perfil
+    :param k: limite da busca; o ef do HNSW precisa ser >= k
+    :return:
+    """
+    params = dict(profile(name)["search"])
+    if "ef" in params:
+        params["ef"] = max(params["ef"], k)
+    return {"metric_type": METRIC, "params": params}
+
+
+def fields(dim: int = 1536, partitioned: bool = False) -> List[FieldSchema]:
+    return [
+        FieldSchema(
+            name="id",
+            dtype=DataType.VARCHAR,
+            max_length=32,
+            is_primary=True,
+        ),
+        FieldSchema(
+            name="text",
+            dtype=DataType.VARCHAR,
+            max_length=526,
+            default_value=""
+        ),
+        # partition key: cada namespace vai para uma das partições (hash do ns), e as buscas e remoções
+        # filtradas por ns só visitam essa partição; o ns é sempre gravado, então fica sem valor padrão
+        FieldSchema(
+            name="ns",
+            dtype=DataType.VARCHAR,
+            max_length=32,
+            is_partition_key=True
+        ) if partitioned else FieldSchema(
+            name="ns",
+            dtype=DataType.VARCHAR,
+            max_length=32,
+            default_value="default"
+        ),
+        FieldSchema(
+            name="embedding",
+            dtype=DataType.FLOAT_VECTOR,
+            dim=dim
+        )
+    ]
+
+
+def schema(dim: int = 1536, model: str = None, partitioned: bool = False) -> CollectionSchema:
+    return CollectionSchema(
+        fields=fields(dim, partitioned),
+        description="Knowledge search" if model is None else f"Knowledge search (model={model}, dim={dim})",
+        enable_dynamic_field=True,
     )
-]
 
-Schema = CollectionSchema(
-    fields=fields,
-    description="Knowledge search",
-    enable_dynamic_field=True,
-)
+
+def partitioning(partitions: int = 0) -> Dict:
+    # argumentos do Collection(...) ao criar a coleção: quantidade de partições do partition key
+    return {"num_partitions": partitions} if partitions > 0 else {}
+
+
+def describe(info: Dict) -> Dict[str, Union[str, int, None]]:
+    """
+    coleção física, modelo (None nas coleções anteriores à migração), dimensão e partições por namespace
+    (0 sem partition key) de um Collection.describe()
+    :return:
+    """
+    match = MODEL.search(info.get("description") or "")
+    partitioned = any(field.get("is_partition_key") for field in info["fields"] if field["name"] == "ns")
+    return dict(
+        collection=info["collection_name"],
+        model=match.group(1) if match else None,
+        dim=next(field["params"]["dim"] for field in info["fields"] if field["name"] == "embedding"),
+        partitions=(info.get("num_partitions") or 0) if partitioned else 0
+    )
+
+
+Schema = schema()
@@ -0,0 +1,55 @@
+"""
+snapshots de namespaces (ids, textos, metadados e embeddings) em SNAPSHOT_DIR, restaurados sem chamadas de embedding
+
+uso:
+  python snapshot.py export <namespace> [--name NOME] [--dtype float16]
+  python snapshot.py restore <nome> [--namespace DESTINO]
+  python snapshot.py list
+o progresso (vetores e vetores/s) é registrado no log a cada --interval segundos
+"""
+import argparse
+from datetime import datetime
+
+from loguru import logger
+
+from resources import Resources
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--interval", type=float, default=5.0, help="segundos entre registros de progresso")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="exporta um namespace")
+    export.add_argument("namespace")
+    export.add_argument("--name", help="padrão <namespace>-<data e hora>")
+    export.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    restore = commands.add_parser("restore", help="importa um snapshot")
+    restore.add_argument("name")
+    restore.add_argument("--namespace", help="padrão o namespace exportado")
+    commands.add_parser("list", help="lista os snapshots")
+    args = parser.parse_args()
+
+    resources = Resources().open()
+    snapshots = resources.snapshots()
+    snapshots.interval = args.interval
+
+    try:
+        if args.command == "export":
+            name = args.name or f"{args.namespace}-{datetime.utcnow():%Y%m%d%H%M%S}"
+            snapshot = snapshots.export(args.namespace, name, args.dtype)
+            logger.info(f"Snapshot {name}: {snapshot.rows} vectors, {snapshot.nbytes / 2 ** 20:.1f} MiB "
+                        f"at {snapshot.path}")
+        elif args.command == "restore":
+            rows = snapshots.restore(args.name, args.namespace)
+            logger.info(f"Snapshot {args.name}: {rows} vectors restored")
+        else:
+            for snapshot in snapshots.all():
+                manifest = snapshot.manifest
+                print(f"{snapshot.path.name}\t{manifest['namespace']}\t{manifest['rows']}\t{manifest['dtype']}\t"
+                      f"{manifest['model']}\t{snapshot.nbytes / 2 ** 20:.1f} MiB\t{manifest['created_at']}")
+    finally:
+        resources.close()
+
+
+if __name__ == "__main__":
+    main()
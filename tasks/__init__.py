@@ -1 +1,4 @@
-from .tasks import upsert
\ No newline at end of file
+from .tasks import (
+    celery, upsert, upsert_batch, refill_quiz_pool, delete_vectors, export_snapshot, restore_snapshot,
+    migrate_embeddings
+)
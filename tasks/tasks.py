@@ -1,7 +1,26 @@
-from celery import Celery
+import asyncio
+import os
+from time import perf_counter
+from typing import Callable, Dict, Union, List, Coroutine
+
+from celery import Celery, Task
+from celery.signals import (
+    worker_init, worker_process_init, worker_process_shutdown, worker_shutdown,
+    before_task_publish, task_prerun, task_postrun, task_failure
+)
+from loguru import logger
+from prometheus_client import start_http_server
+
 from config import env
-from models import UpsertTasksDocument
-from provider import MilvusDataStore
+from factory import SnapshotJobFactory
+from metrics import TASK_LATENCY, TASKS_IN_PROGRESS, QueueCollector, error, registry, mark_process_dead
+from models import UpsertTasksDocument, VectorDeleteFilter
+from provider import (
+    EmbeddingMigration, MilvusDataStore, NamespaceSnapshots, Progress, VectorDeletion, active_collection
+)
+from generative import GenQuiz
+from resources import Resources
+from tracing import TaskTracing, setup, shutdown
 
 celery = Celery(
     broker=env.AMQP_DSN,
@@ -9,6 +28,142 @@ celery = Celery(
     broker_connection_retry_on_startup=True
 )
 
+resources: Union[Resources, None] = None
+datastore: Union[MilvusDataStore, None] = None
+deletion: Union[VectorDeletion, None] = None
+snapshots: Union[NamespaceSnapshots, None] = None
+migration: Union[EmbeddingMigration, None] = None
+loop: Union[asyncio.AbstractEventLoop, None] = None
+started: Dict[str, float] = {}
+tracing = TaskTracing()
+
+
+def get_resources() -> Resources:
+    global resources
+    if resources is None:
+        resources = Resources().open()
+    return resources
+
+
+def run(coroutine: Coroutine):
+    """
+    executa a corrotina no event loop do processo; um loop único mantém
+    os clientes assíncronos (Motor, OpenAI) válidos entre tarefas
+    :return:
+    """
+    global loop
+    if loop is None:
+        loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coroutine)
+
+
+def get_datastore() -> MilvusDataStore:
+    """
+    datastore do processo atual; criado uma única vez e reaproveitado entre tarefas
+    :return:
+    """
+    global datastore
+    if datastore is None:
+        resources = get_resources()
+        datastore = MilvusDataStore(
+            collection=resources.collection,
+            embeddings_model=resources.embeddings_model,
+            vector_factory=resources.vector_factory()
+        )
+        active_collection.subscribe(datastore.use_embeddings)
+    return datastore
+
+
+def get_deletion() -> VectorDeletion:
+    global deletion
+    if deletion is None:
+        resources = get_resources()
+        deletion = VectorDeletion(
+            collection=resources.collection,
+            vector_factory=resources.vector_factory(),
+            jobs=resources.deletion_jobs()
+        )
+    return deletion
+
+
+def get_snapshots() -> NamespaceSnapshots:
+    global snapshots
+    if snapshots is None:
+        snapshots = get_resources().snapshots()
+    return snapshots
+
+
+def get_migration() -> EmbeddingMigration:
+    global migration
+    if migration is None:
+        migration = get_resources().embedding_migration()
+    return migration
+
+
+@worker_init.connect
+def init_metrics(**kwargs) -> None:
+    # processo principal do worker: expõe as métricas de todos os processos do pool (PROMETHEUS_MULTIPROC_DIR)
+    if env.METRICS_ENABLED:
+        start_http_server(env.METRICS_WORKER_PORT, registry=registry(QueueCollector(celery)))
+        logger.info(f"Worker metrics exposed on :{env.METRICS_WORKER_PORT}/metrics")
+    # o exportador em lote é reiniciado nos processos filhos após o fork
+    setup("worker")
+
+
+@worker_shutdown.connect
+def shutdown_tracing(**kwargs) -> None:
+    shutdown()
+
+
+@worker_process_init.connect
+def init_worker(**kwargs) -> None:
+    get_datastore().warmup()
+    if env.QUIZ_POOL_ENABLED:
+        # índices do estoque (TTL, pop por versão), uma vez por processo e não a cada reposição
+        get_resources().quiz_pool().setup()
+    if env.QUIZ_VOICE_ENABLED:
+        Resources.load_jingle()
+    logger.info("Worker process initialized.")
+
+
+@worker_process_shutdown.connect
+def shutdown_worker(**kwargs) -> None:
+    if resources is not None:
+        resources.close()
+    if loop is not None:
+        loop.close()
+    mark_process_dead(os.getpid())
+    shutdown()
+
+
+@before_task_publish.connect
+def task_published(headers: dict = None, **kwargs) -> None:
+    # vale para a API e para o worker (retries): o span atual vira o pai da execução
+    if headers is not None:
+        tracing.publish(headers)
+
+
+@task_prerun.connect
+def task_started(task_id: str, task: Task, **kwargs) -> None:
+    started[task_id] = perf_counter()
+    TASKS_IN_PROGRESS.labels(task=task.name).inc()
+    tracing.start(task_id, task)
+
+
+@task_postrun.connect
+def task_finished(task_id: str, task: Task, state: str = None, **kwargs) -> None:
+    TASKS_IN_PROGRESS.labels(task=task.name).dec()
+    start = started.pop(task_id, None)
+    if start is not None:
+        TASK_LATENCY.labels(task=task.name, state=state or "UNKNOWN").observe(perf_counter() - start)
+    tracing.finish(task_id, state)
+
+
+@task_failure.connect
+def task_failed(task_id: str = None, exception: BaseException = None, **kwargs) -> None:
+    error("worker", exception if exception is not None else "TaskFailure")
+    tracing.fail(task_id, exception)
+
 
 @celery.task(name="upsert", autoretry_for=(Exception,), retry_backoff=3)
 def upsert(data: dict) -> bool:
@@ -16,5 +171,128 @@ def upsert(data: dict) -> bool:
     upsert vetores
     :return:
     """
-    datastore = MilvusDataStore()
-    return datastore.upsert(document=UpsertTasksDocument(**data))
+    return get_datastore().upsert(document=UpsertTasksDocument(**data))
+
+
+@celery.task(name="upsert_batch", autoretry_for=(Exception,), retry_backoff=3)
+def upsert_batch(data: List[dict]) -> bool:
+    """
+    upsert de vários documentos com embeddings e escritas em lote
+    :return:
+    """
+    return get_datastore().upsert_batch(documents=[UpsertTasksDocument(**doc) for doc in data])
+
+
+@celery.task(name="delete_vectors", bind=True, max_retries=5)
+def delete_vectors(self: Task, job_id: str, filter: dict) -> int:
+    """
+    remove todos os vetores do filtro, em páginas, registrando o progresso no job
+    :return: quantidade de vetores removidos
+    """
+    deletion = get_deletion()
+    try:
+        return deletion.run(job_id, VectorDeleteFilter(**filter))
+    except Exception as e:
+        logger.error(e)
+        final = self.request.retries >= self.max_retries
+        deletion.jobs.fail(job_id, str(e), final=final)
+        if final:
+            raise
+        raise self.retry(exc=e, countdown=3 * 2 ** self.request.retries)
+
+
+def snapshot_progress(jobs: SnapshotJobFactory, job_id: str) -> Callable[[Progress], None]:
+    def report(progress: Progress) -> None:
+        jobs.progress(job_id, progress.done, progress.total, progress.rate)
+    return report
+
+
+@celery.task(name="export_snapshot")
+def export_snapshot(job_id: str, namespace: str, name: str, dtype: str) -> int:
+    """
+    exporta o namespace (ids, textos, metadados e embeddings) para o snapshot name
+    :return: quantidade de vetores exportados
+    """
+    jobs = get_resources().snapshot_jobs()
+    try:
+        jobs.start(job_id)
+        snapshot = get_snapshots().export(namespace, name, dtype, report=snapshot_progress(jobs, job_id))
+        jobs.finish(job_id)
+        return snapshot.rows
+    except Exception as e:
+        logger.error(e)
+        jobs.fail(job_id, str(e))
+        raise
+
+
+@celery.task(name="restore_snapshot")
+def restore_snapshot(job_id: str, name: str, namespace: str = None) -> int:
+    """
+    importa o snapshot name no Milvus e no Mongo, sem chamadas de embedding
+    :return: quantidade de vetores importados
+    """
+    jobs = get_resources().snapshot_jobs()
+    try:
+        jobs.start(job_id)
+        rows = get_snapshots().restore(name, namespace, report=snapshot_progress(jobs, job_id))
+        jobs.finish(job_id)
+        return rows
+    except Exception as e:
+        logger.error(e)
+        jobs.fail(job_id, str(e))
+        raise
+
+
+@celery.task(name="migrate_embeddings", bind=True, max_retries=5)
+def migrate_embeddings(self: Task, migration_id: str) -> int:
+    """
+    re-embeda os vetores na coleção do modelo novo e troca o alias; um retry (ou uma nova execução)
+    continua do último checkpoint
+    :return: quantidade de vetores re-embedados
+    """
+    migration = get_migration()
+    try:
+        return migration.run(migration_id)
+    except Exception as e:
+        logger.error(e)
+        migration.migrations.fail(migration_id, str(e))
+        if self.request.retries >= self.max_retries:
+            raise
+        raise self.retry(exc=e, countdown=3 * 2 ** self.request.retries)
+
+
+@celery.task(name="refill_quiz_pool")
+def refill_quiz_pool(namespace: str, theme: str, amount: int) -> int:
+    """
+    repõe o estoque de quizzes prontos do (namespace, tema, valor) até QUIZ_POOL_SIZE, na versão atual
+    do namespace (os de versões anteriores são removidos)
+    :return: quantidade de quizzes gerados
+    """
+    resources = get_resources()
+    pool = resources.quiz_pool()
+    if not pool.lock(namespace, theme, amount):
+        return 0
+
+    created = 0
+    try:
+        version = pool.version(namespace)
+        pool.prune(namespace, theme, amount, version)
+        missing = env.QUIZ_POOL_SIZE - pool.count(namespace, theme, amount, version)
+        for _ in range(missing):
+            quiz = run(
+                GenQuiz(
+                    theme=theme,
+                    amount=amount,
+                    milvus=resources.milvus,
+                    llm=resources.pool_llm
+                ).generate(namespace)
+            )
+            pool.push(namespace, theme, amount, quiz, version)
+            created += 1
+    except Exception as e:
+        logger.error(e)
+    finally:
+        pool.unlock(namespace, theme, amount)
+
+    logger.info(f"Quiz pool ({namespace}, {theme}, {amount}) refilled with {created} quizzes.")
+    return created
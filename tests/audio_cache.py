@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from provider.audio_cache import AudioCache
+
+
+class AudioCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = AudioCache(self.directory.name, max_bytes=1000)
+        self.clock = 1_000_000
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def put(self, key: str, size: int) -> Path:
+        source = Path(self.directory.name) / f"{key}.source"
+        source.write_bytes(b"x" * size)
+        path = self.cache.put(key, source)
+        # mtimes crescentes e explícitos: a ordem LRU não depende da resolução do relógio do sistema de arquivos
+        self.clock += 10
+        os.utime(path, (self.clock, self.clock))
+        return path
+
+    def stored(self) -> int:
+        return sum(path.stat().st_size for path in Path(self.directory.name).glob("*.mp3"))
+
+    def test_counter_follows_puts_and_overwrites(self):
+        for i in range(5):
+            self.put(f"k{i}", 100)
+        self.assertEqual(self.cache.bytes, 500)
+        self.put("k0", 40)
+        self.assertEqual(self.cache.bytes, 440)
+        self.assertEqual(self.cache.bytes, self.stored())
+
+    def test_evicts_least_recently_used_when_over_limit(self):
+        for i in range(9):
+            self.put(f"k{i}", 100)
+        # acesso renova o mtime: k0 passa a ser o mais recente
+        self.assertIsNotNone(self.cache.get("k0"))
+        self.put("k9", 300)
+        self.assertLessEqual(self.cache.bytes, 1000)
+        self.assertEqual(self.cache.bytes, self.stored())
+        self.assertTrue(self.cache.path("k0").exists())
+        self.assertFalse(self.cache.path("k1").exists())
+        self.assertFalse(self.cache.path("k2").exists())
+        self.assertTrue(self.cache.path("k9").exists())
+
+    def test_resync_counts_files_written_by_other_processes(self):
+        self.put("k0", 100)
+        # outro processo grava no mesmo diretório, fora do contador deste
+        AudioCache(self.directory.name, max_bytes=1000).put("other", self.source(950))
+        self.assertEqual(self.cache.bytes, 100)
+        self.cache.resync = 0
+        self.put("k1", 100)
+        self.assertEqual(self.cache.bytes, self.stored())
+        self.assertLessEqual(self.cache.bytes, 1000)
+
+    def source(self, size: int) -> Path:
+        path = Path(self.directory.name) / "external.source"
+        path.write_bytes(b"y" * size)
+        return path
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import random
+import unittest
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.tokenizer import encoding
+from provider.chunker import TokenChunker
+
+WORDS = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit. Ação coração não é já 123 4567 it's we're "
+         "don't ; ! ? - — “citação” 日本語 🙂 x... tab\tafter").split(" ")
+SEPARATORS = [" ", "  ", "", "\n", ".\n\n", " \n", "\n\n", " \n\n "]
+
+
+def document(rng: random.Random, size: int) -> str:
+    return "".join(rng.choice(WORDS) + rng.choice(SEPARATORS) for _ in range(size))
+
+
+class TokenChunkerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.rng = random.Random(13)
+        cls.tokenizer = encoding(document(cls.rng, 5000))
+        cls.chunker = TokenChunker(cls.tokenizer, chunk_size=100, chunk_overlap=20)
+        cls.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=100,
+            chunk_overlap=20,
+            length_function=lambda text: len(cls.tokenizer.encode(text=text, disallowed_special=())),
+            separators=["\n\n", "\n", " ", ""]
+        )
+        cls.documents = [document(cls.rng, cls.rng.randint(1, 2000)) for _ in range(40)] + [
+            "", "   \n\n ", "a" * 3000, "palavra " * 800, "linha\n" * 500, "fim com espaço   "
+        ]
+
+    def test_split_text_matches_langchain(self):
+        for text in self.documents:
+            self.assertEqual(self.splitter.split_text(text), self.chunker.split_text(text))
+
+    def test_split_texts_batch(self):
+        batch = self.chunker.split_texts(self.documents)
+        self.assertEqual(len(batch), len(self.documents))
+        for text, chunks in zip(self.documents, batch):
+            self.assertEqual(self.splitter.split_text(text), [chunk for chunk, _ in chunks])
+            for chunk, tokens in chunks:
+                self.assertEqual(len(self.tokenizer.encode_ordinary(chunk)), tokens)
+
+
+if __name__ == "__main__":
+    unittest.main()
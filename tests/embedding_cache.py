@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from benchmarks.fakes import Embeddings, Latency, MongoClient
+from databases import AsyncMongo
+from provider.embedding_cache import EmbeddingCache
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, latency: Latency):
+        super().__init__(latency)
+        self.calls = 0
+
+    async def aembed_query(self, text: str):
+        self.calls += 1
+        return await super().aembed_query(text)
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.motor = MongoClient({}, Latency(scale=0.0), asynchronous=True)
+        self.model = CountingEmbeddings(Latency(scale=0.0))
+
+    def cache(self, maxsize: int = 2, ttl: int = 60) -> EmbeddingCache:
+        cache = EmbeddingCache(maxsize=maxsize, ttl=ttl)
+        cache.use(AsyncMongo("embeddings", client=self.motor))
+        return cache
+
+    def test_local_lru_evicts_least_recently_used(self):
+        cache = self.cache(maxsize=2)
+        cache.set_local("a", [1.0])
+        cache.set_local("b", [2.0])
+        self.assertEqual(cache.get_local("a"), [1.0])
+        cache.set_local("c", [3.0])
+        self.assertEqual(list(cache.entries), ["a", "c"])
+        self.assertIsNone(cache.get_local("b"))
+
+    def test_local_entries_expire_after_ttl(self):
+        cache = self.cache(ttl=60)
+        with mock.patch("provider.embedding_cache.monotonic", return_value=1000.0):
+            cache.set_local("a", [1.0])
+        with mock.patch("provider.embedding_cache.monotonic", return_value=1059.0):
+            self.assertEqual(cache.get_local("a"), [1.0])
+        with mock.patch("provider.embedding_cache.monotonic", return_value=1061.0):
+            self.assertIsNone(cache.get_local("a"))
+        self.assertNotIn("a", cache.entries)
+
+    def test_local_then_shared_hits(self):
+        async def run():
+            first = self.cache()
+            embedding = await first.aembed_query("Qual é a   capital?", self.model)
+            self.assertEqual(await first.aembed_query("qual é a capital?", self.model), embedding)
+            # outro processo: sem a entrada local, encontra a do Mongo
+            second = self.cache()
+            self.assertEqual(await second.aembed_query("Qual é a capital?", self.model), embedding)
+            return first, second
+
+        first, second = asyncio.run(run())
+        self.assertEqual(self.model.calls, 1)
+        self.assertEqual((first.misses, first.hits), (1, 1))
+        self.assertEqual((second.shared_hits, second.misses), (1, 0))
+
+    def test_expired_shared_entry_is_embedded_again(self):
+        async def run():
+            await self.cache(ttl=-1).aembed_query("pergunta", self.model)
+            await self.cache().aembed_query("pergunta", self.model)
+
+        asyncio.run(run())
+        self.assertEqual(self.model.calls, 2)
+
+    def test_concurrent_identical_queries_embed_once(self):
+        async def run():
+            cache = self.cache()
+            return await asyncio.gather(*[cache.aembed_query("mesma pergunta", self.model) for _ in range(5)])
+
+        results = asyncio.run(run())
+        self.assertEqual(self.model.calls, 1)
+        self.assertTrue(all(result == results[0] for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+import asyncio
+import unittest
+from typing import List
+from unittest import mock
+
+from benchmarks.fakes import Embeddings, Latency, OfflineResources, Services, use_tokenizer
+from config import env
+from models import UpsertTasksDocument
+from provider import MilvusDataStore
+
+SENTENCES = [
+    f"Capítulo {i}: o documento {i} trata de python, rust e bancos vetoriais com exemplos numerados {i * 7}."
+    for i in range(60)
+]
+
+
+class CountingEmbeddings(Embeddings):
+    def __init__(self, latency: Latency):
+        super().__init__(latency)
+        self.calls = 0
+        self.texts: List[str] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts.extend(texts)
+        return super().embed_documents(texts)
+
+
+class UpsertTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_tokenizer(" ".join(SENTENCES))
+
+    def setUp(self):
+        patch = mock.patch.object(env, "QUIZ_VOICE_ENABLED", False)
+        patch.start()
+        self.addCleanup(patch.stop)
+        latency = Latency(scale=0.0)
+        self.services = Services(latency)
+        self.resources = asyncio.run(OfflineResources(self.services).aopen())
+        self.embeddings = CountingEmbeddings(latency)
+        self.store = MilvusDataStore(
+            collection=self.resources.collection,
+            embeddings_model=self.embeddings,
+            vector_factory=self.resources.vector_factory()
+        )
+
+    def mongo(self, name: str) -> List[dict]:
+        return list(self.services.databases[env.MONGO_DB_NAME][name].documents.values())
+
+    def events(self, namespace: str) -> List[dict]:
+        return [event for event in self.mongo("namespace_events") if event["namespace"] == namespace]
+
+    @staticmethod
+    def document(start: int, stop: int, namespace: str = "default") -> UpsertTasksDocument:
+        return UpsertTasksDocument(content=" ".join(SENTENCES[start:stop]), namespace=namespace, username="tester")
+
+    def test_batch_upsert_stores_every_document(self):
+        documents = [self.document(0, 20, "a"), self.document(20, 40, "b"), self.document(40, 60, "a")]
+        chunks = self.store.chunks(documents)
+        self.assertTrue(self.store.upsert_batch(documents))
+
+        rows = self.services.collection.rows
+        self.assertEqual(set(rows), {chunk.id for chunk in chunks})
+        self.assertEqual({id: ns for id, (_, ns, _) in rows.items()}, {chunk.id: chunk.namespace for chunk in chunks})
+        vectors = {vector["id"]: vector for vector in self.mongo("vectors")}
+        self.assertEqual(set(vectors), set(rows))
+        self.assertTrue(all(vector["created_by"] == "tester" for vector in vectors.values()))
+        # os chunks dos três documentos vão juntos numa só chamada de embedding
+        self.assertEqual(self.embeddings.calls, 1)
+        self.assertEqual(len(self.embeddings.texts), len(chunks))
+        self.assertEqual({event["namespace"] for event in self.mongo("namespace_events")}, {"a", "b"})
+
+    def test_unchanged_content_is_not_embedded_again(self):
+        document = self.document(0, 30)
+        self.assertTrue(self.store.upsert(document))
+        embedded = len(self.embeddings.texts)
+        rows = dict(self.services.collection.rows)
+
+        self.assertTrue(self.store.upsert(document))
+        self.assertEqual(len(self.embeddings.texts), embedded)
+        self.assertEqual(set(self.services.collection.rows), set(rows))
+
+    def test_changed_content_embeds_only_new_chunks(self):
+        self.store.upsert(self.document(0, 30))
+        before = set(self.services.collection.rows)
+        embedded = len(self.embeddings.texts)
+
+        document = self.document(0, 40)
+        self.store.upsert(document)
+        new = [chunk for chunk in self.store.chunks([document]) if chunk.id not in before]
+        self.assertTrue(new)
+        self.assertEqual(self.embeddings.texts[embedded:], [chunk.text for chunk in new])
+
+    def test_namespace_move_reuses_stored_embedding(self):
+        document = self.document(0, 20, "a")
+        self.store.upsert(document)
+        embedded = len(self.embeddings.texts)
+        stored = {id: embedding for id, (_, _, embedding) in self.services.collection.rows.items()}
+
+        self.store.upsert(self.document(0, 20, "b"))
+        self.assertEqual(len(self.embeddings.texts), embedded)
+        rows = self.services.collection.rows
+        self.assertEqual({ns for _, ns, _ in rows.values()}, {"b"})
+        self.assertTrue(all((rows[id][2] == embedding).all() for id, embedding in stored.items()))
+        # o namespace antigo é avisado de que perdeu os chunks
+        deleted = {id for event in self.events("a") for id in event.get("deleted", [])}
+        self.assertEqual(deleted, set(stored))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+import asyncio
+import unittest
+from typing import Dict, Tuple
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fakes import Embeddings, Latency, MilvusCollection, OfflineResources, Services, use_tokenizer
+from config import env
+from models import UpsertTasksDocument
+from provider import EmbeddingMigration, MilvusDataStore, active_collection, dual_write
+
+SENTENCES = [
+    f"Parágrafo {i}: a migração online re-embeda o documento {i} enquanto a API segue atendendo {i * 5}."
+    for i in range(40)
+]
+MODEL = "text-embedding-3-small"
+
+
+class SmallEmbeddings(Embeddings):
+    dim = 512
+
+
+class Catalog:
+    """
+    MilvusCatalog em memória: coleções físicas por nome e aliases
+    """
+    def __init__(self, collection: MilvusCollection, latency: Latency):
+        self.latency = latency
+        self.collections: Dict[str, MilvusCollection] = {env.MILVUS_COLLECTION_NAME: collection}
+        self.aliases: Dict[str, str] = {}
+
+    def exists(self, name: str) -> bool:
+        return name in self.collections
+
+    def open(self, name: str) -> MilvusCollection:
+        return self.collections[self.aliases.get(name, name)]
+
+    def create(self, name: str, schema, partitions: int = 0) -> MilvusCollection:
+        collection = MilvusCollection(self.latency)
+        collection.schema = schema
+        self.collections[name] = collection
+        return collection
+
+    def adopt(self, alias: str, name: str) -> None:
+        self.collections[name] = self.collections.pop(alias)
+        self.aliases[alias] = name
+
+    def alter_alias(self, name: str, alias: str) -> None:
+        self.aliases[alias] = name
+
+    def resolve(self, name: str) -> Tuple[str, MilvusCollection]:
+        physical = self.aliases.get(name, name)
+        return physical, self.collections[physical]
+
+
+class Alias:
+    """
+    Collection aberta pelo alias: cada chamada vai para a coleção física atual
+    """
+    def __init__(self, catalog: Catalog, name: str):
+        self.catalog = catalog
+        self.name = name
+
+    def __getattr__(self, attr: str):
+        return getattr(self.catalog.resolve(self.name)[1], attr)
+
+    def describe(self) -> Dict:
+        physical, collection = self.catalog.resolve(self.name)
+        return dict(
+            collection_name=physical,
+            description=collection.schema.description,
+            fields=[dict(name=field.name, params=field.params) for field in collection.schema.fields]
+        )
+
+
+class EmbeddingMigrationTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_tokenizer(" ".join(SENTENCES))
+
+    def setUp(self):
+        latency = Latency(scale=0.0)
+        services = Services(latency)
+        self.catalog = Catalog(services.collection, latency)
+        services.collection = Alias(self.catalog, env.MILVUS_COLLECTION_NAME)
+
+        def embeddings_model(model: str = None, dim: int = None) -> Embeddings:
+            if model != MODEL:
+                return Embeddings(latency)
+            embeddings = SmallEmbeddings(latency)
+            embeddings.model = model
+            return embeddings
+
+        for patch in [
+            mock.patch.object(env, "QUIZ_VOICE_ENABLED", False),
+            mock.patch("provider.migration.embeddings_model", embeddings_model),
+            mock.patch.multiple(active_collection, refresh=0.0, listeners=[]),
+            mock.patch.multiple(dual_write, catalog=self.catalog, refresh=0.0, collections={}, models={}),
+        ]:
+            patch.start()
+            self.addCleanup(patch.stop)
+        # os singletons voltam à coleção padrão para os próximos testes do processo
+        self.addCleanup(active_collection.use, None)
+
+        self.resources = asyncio.run(OfflineResources(services).aopen())
+        self.vector_factory = self.resources.vector_factory()
+        self.store = MilvusDataStore(
+            collection=self.resources.collection,
+            embeddings_model=self.resources.embeddings_model,
+            vector_factory=self.vector_factory
+        )
+        active_collection.subscribe(self.store.use_embeddings)
+        self.store.upsert_batch([
+            UpsertTasksDocument(content=" ".join(SENTENCES[i:i + 5]), namespace=f"ns-{i % 2}")
+            for i in range(0, 20, 5)
+        ])
+        self.migrations = self.resources.migrations()
+        self.migration = EmbeddingMigration(
+            self.resources.collection, self.migrations, self.vector_factory, self.catalog,
+            page_size=3, concurrency=2, grace=0.0, interval=60.0
+        )
+
+    def create(self) -> str:
+        return asyncio.run(self.migrations.acreate(MODEL, 512))
+
+    def upsert(self, start: int, stop: int, namespace: str) -> None:
+        self.store.upsert_batch([UpsertTasksDocument(content=" ".join(SENTENCES[start:stop]), namespace=namespace)])
+
+    def assertMirrors(self, collection: MilvusCollection) -> None:
+        vectors = {vector["id"]: vector for vector in self.vector_factory.mongo.find({})}
+        self.assertEqual(set(collection.rows), set(vectors))
+        model = SmallEmbeddings(Latency(scale=0.0))
+        for id, (text, ns, embedding) in collection.rows.items():
+            self.assertEqual(ns, vectors[id]["namespace"])
+            np.testing.assert_allclose(embedding, model.vector(text), atol=1e-6)
+
+    def test_run_reembeds_and_swaps_alias(self):
+        source = dict(self.catalog.resolve(env.MILVUS_COLLECTION_NAME)[1].rows)
+        migration_id = self.create()
+        self.assertEqual(self.migration.run(migration_id), len(source))
+
+        migration = self.migrations.get(migration_id)
+        self.assertEqual(migration["state"], "SUCCESS")
+        physical, target = self.catalog.resolve(env.MILVUS_COLLECTION_NAME)
+        self.assertEqual(physical, migration["target"]["collection"])
+        self.assertMirrors(target)
+        # a coleção antiga fica intacta: voltar atrás é trocar o alias de novo
+        self.assertEqual(set(self.catalog.collections[migration["source"]["collection"]].rows), set(source))
+        self.assertEqual((active_collection.model, active_collection.dim), (MODEL, 512))
+
+        # depois da troca, os upserts já usam o modelo novo
+        self.upsert(20, 25, "ns-2")
+        self.assertIsInstance(self.store.embeddings_model, SmallEmbeddings)
+        self.assertMirrors(target)
+
+    def test_dual_write_while_running(self):
+        migration_id = self.create()
+        target, _ = self.migration.prepare(self.migrations.get(migration_id))
+        self.assertEqual(self.migrations.get(migration_id)["state"], "RUNNING")
+
+        # gravações novas e mudanças de namespace chegam à coleção nova antes do backfill
+        self.upsert(25, 30, "ns-3")
+        self.upsert(0, 5, "ns-3")
+        mirrored = {id: ns for id, (_, ns, _) in target.rows.items()}
+        written = {chunk.id: "ns-3" for chunk in self.store.chunks([
+            UpsertTasksDocument(content=" ".join(SENTENCES[start:stop]), namespace="ns-3")
+            for start, stop in [(25, 30), (0, 5)]
+        ])}
+        self.assertEqual(mirrored, written)
+        removed = list(written)[:2]
+        dual_write.delete(removed, "ns-3")
+        self.assertFalse(set(removed) & set(target.rows))
+        self.vector_factory.mongo.delete_many({"id": {"$in": removed}})
+        self.resources.collection.delete(expr=f"id in {str(removed)}")
+
+        self.migration.run(migration_id)
+        self.assertMirrors(target)
+        self.assertFalse(set(removed) & set(target.rows))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import gzip
+import unittest
+from datetime import datetime, timedelta
+from hashlib import md5
+from typing import Dict, List
+
+from orjson import loads
+
+from benchmarks.fakes import Latency, MongoClient
+from databases import AsyncMongo, Mongo
+from databases.pagination import InvalidPageToken
+from factory import VectorFactory
+
+
+class KeysetPaginationTest(unittest.TestCase):
+    def setUp(self):
+        databases = {}
+        self.motor = MongoClient(databases, Latency(scale=0.0), asynchronous=True)
+        self.mongo = MongoClient(databases, Latency(scale=0.0))
+        self.vectors = AsyncMongo("vectors", client=self.motor)
+        start = datetime(2024, 1, 1)
+        # created_at repetido de 4 em 4: o desempate pelo _id não pode perder nem repetir documentos
+        asyncio.run(self.vectors.collection.insert_many([
+            dict(id=md5(str(i).encode()).hexdigest(), content=f"texto {i}", namespace="a" if i % 3 else "b",
+                 created_by="tester", created_at=start + timedelta(minutes=i // 4))
+            for i in range(95)
+        ]))
+
+    def walk(self, filter: Dict = None, sort: Dict = None, limit: int = 10,
+             delete_seen: bool = False) -> List[str]:
+        async def run():
+            seen: List[str] = []
+            after = None
+            while True:
+                docs, after = await self.vectors.page(filter, sort, after, limit=limit,
+                                                      keyset=VectorFactory.KEYSET)
+                seen.extend(doc["id"] for doc in docs)
+                if delete_seen:
+                    await self.vectors.collection.delete_many({"id": {"$in": [doc["id"] for doc in docs]}})
+                if after is None:
+                    return seen
+        return asyncio.run(run())
+
+    def full(self, filter: Dict = None, sort: Dict = None) -> List[str]:
+        return [doc["id"] for doc in asyncio.run(self.vectors.all(filter, sort, limit=1000))]
+
+    def test_pages_match_the_full_listing(self):
+        for sort in [None, {"_id": 1}, {"id": 1}, {"created_at": 1}, {"created_at": -1}]:
+            with self.subTest(sort=sort):
+                # a listagem completa na ordem do cursor: a chave pedida e o _id como desempate
+                field, direction = next(iter((sort or {"_id": -1}).items()))
+                expected = self.full({"namespace": "a"}, {field: direction, "_id": direction})
+                self.assertEqual(self.walk({"namespace": "a"}, sort), expected)
+
+    def test_removing_read_pages_does_not_skip_documents(self):
+        expected = self.full(sort={"created_at": 1})
+        seen = self.walk(sort={"created_at": 1}, limit=7, delete_seen=True)
+        self.assertEqual(sorted(seen), sorted(expected))
+
+    def test_invalid_tokens(self):
+        async def run():
+            _, after = await self.vectors.page(sort={"created_at": 1}, limit=5, keyset=VectorFactory.KEYSET)
+            with self.assertRaises(InvalidPageToken):
+                await self.vectors.page(sort={"id": 1}, after=after, keyset=VectorFactory.KEYSET)
+            with self.assertRaises(InvalidPageToken):
+                await self.vectors.page(after="garbage", keyset=VectorFactory.KEYSET)
+            with self.assertRaises(InvalidPageToken):
+                await self.vectors.page(sort={"created_by": 1}, after=after, keyset=VectorFactory.KEYSET)
+            # ordenação sem cursor: continua por skip, sem token
+            docs, after = await self.vectors.page(sort={"created_by": 1}, skip=90, limit=10,
+                                                  keyset=VectorFactory.KEYSET)
+            self.assertEqual((len(docs), after), (5, None))
+
+        asyncio.run(run())
+
+    def test_export_streams_every_vector(self):
+        factory = VectorFactory(asyncmongo=self.vectors, mongo=Mongo("vectors", client=self.mongo))
+
+        async def run(compress: bool) -> bytes:
+            return b"".join([chunk async for chunk in factory.aexport({"namespace": "b"}, compress, chunk_size=256)])
+
+        plain = asyncio.run(run(False))
+        self.assertEqual(gzip.decompress(asyncio.run(run(True))), plain)
+        lines = [loads(line) for line in plain.splitlines()]
+        self.assertEqual([line["id"] for line in lines], self.full({"namespace": "b"}, {"_id": 1}))
+        self.assertTrue(all("_id" not in line for line in lines))
+
+
+if __name__ == "__main__":
+    unittest.main()
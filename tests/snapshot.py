@@ -0,0 +1,118 @@
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from benchmarks.fakes import Embeddings, Latency, OfflineResources, Services, use_tokenizer
+from config import env
+from models import UpsertTasksDocument
+from provider import MilvusDataStore, NamespaceSnapshots
+
+SENTENCES = [
+    f"Seção {i}: backups do namespace {i} guardam textos, metadados e embeddings sem chamar a OpenAI {i * 3}."
+    for i in range(40)
+]
+
+
+class SnapshotTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        use_tokenizer(" ".join(SENTENCES))
+
+    def setUp(self):
+        patch = mock.patch.object(env, "QUIZ_VOICE_ENABLED", False)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.source = self.open()
+        store = MilvusDataStore(
+            collection=self.source.collection,
+            embeddings_model=self.source.embeddings_model,
+            vector_factory=self.source.vector_factory()
+        )
+        store.upsert_batch([
+            UpsertTasksDocument(content=" ".join(SENTENCES[:20]), namespace="a", username="alice"),
+            UpsertTasksDocument(content=" ".join(SENTENCES[20:]), namespace="b", username="bob"),
+        ])
+
+    def open(self) -> OfflineResources:
+        return asyncio.run(OfflineResources(Services(Latency(scale=0.0))).aopen())
+
+    def snapshots(self, resources: OfflineResources) -> NamespaceSnapshots:
+        return NamespaceSnapshots(
+            collection=resources.collection,
+            vector_factory=resources.vector_factory(),
+            directory=self.directory.name,
+            batch_size=7
+        )
+
+    @staticmethod
+    def rows(resources: OfflineResources, namespace: str) -> dict:
+        return {id: row for id, row in resources.collection.rows.items() if row[1] == namespace}
+
+    @staticmethod
+    def vectors(resources: OfflineResources, namespace: str) -> dict:
+        documents = resources.services.databases[env.MONGO_DB_NAME]["vectors"].documents.values()
+        return {vector["id"]: vector for vector in documents if vector["namespace"] == namespace}
+
+    def test_export_then_restore_round_trip(self):
+        snapshot = self.snapshots(self.source).export("a", "backup-a")
+        source = self.rows(self.source, "a")
+        self.assertEqual(snapshot.rows, len(source))
+
+        target = self.open()
+        # os embeddings vêm do snapshot: nenhuma chamada ao modelo
+        with mock.patch.object(Embeddings, "embed_documents", side_effect=AssertionError("embedded")):
+            self.assertEqual(self.snapshots(target).restore("backup-a"), len(source))
+        restored = self.rows(target, "a")
+        self.assertEqual(set(restored), set(source))
+        for id, (text, _, embedding) in source.items():
+            self.assertEqual(restored[id][0], text)
+            np.testing.assert_array_equal(restored[id][2], embedding)
+        self.assertEqual(self.rows(target, "b"), {})
+        vectors = self.vectors(target, "a")
+        self.assertEqual(set(vectors), set(source))
+        self.assertTrue(all(vector["created_by"] == "alice" for vector in vectors.values()))
+
+    def test_float16_restore_into_other_namespace(self):
+        self.snapshots(self.source).export("a", "half", dtype="float16")
+        source = self.rows(self.source, "a")
+
+        target = self.open()
+        self.snapshots(target).restore("half", namespace="copy")
+        restored = self.rows(target, "copy")
+        self.assertEqual(set(restored), set(source))
+        for id, (_, _, embedding) in source.items():
+            np.testing.assert_allclose(restored[id][2], embedding, atol=1e-3)
+        self.assertEqual(set(self.vectors(target, "copy")), set(source))
+
+    def test_restore_over_existing_ids_notifies_old_namespace(self):
+        snapshots = self.snapshots(self.source)
+        snapshots.export("a", "move")
+        ids = set(self.rows(self.source, "a"))
+        snapshots.restore("move", namespace="copy")
+        self.assertEqual(self.rows(self.source, "a"), {})
+        self.assertEqual(set(self.rows(self.source, "copy")), ids)
+        events = self.source.services.databases[env.MONGO_DB_NAME]["namespace_events"].documents.values()
+        deleted = {id for event in events if event["namespace"] == "a" for id in event.get("deleted", [])}
+        self.assertEqual(deleted, ids)
+
+    def test_restore_rejects_other_embedding_model(self):
+        self.snapshots(self.source).export("a", "other-model")
+        snapshots = self.snapshots(self.open())
+        with mock.patch.object(NamespaceSnapshots, "embedding", return_value=("text-embedding-3-large", 3072)):
+            with self.assertRaises(ValueError):
+                snapshots.restore("other-model")
+
+    def test_invalid_names_are_rejected(self):
+        snapshots = self.snapshots(self.source)
+        for name in ["../a", "a.partial", ""]:
+            with self.assertRaises(ValueError):
+                snapshots.export("a", name)
+
+
+if __name__ == "__main__":
+    unittest.main()
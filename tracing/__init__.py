@@ -0,0 +1,2 @@
+from .middleware import TracingMiddleware
+from .otel import MongoCommandSpans, TaskTracing, tracer, setup, shutdown, span
@@ -0,0 +1,45 @@
+from typing import List, Tuple
+
+from opentelemetry import propagate
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .otel import tracer
+
+
+class TracingMiddleware:
+    """
+    abre um trace por requisição HTTP (ou continua o do traceparent recebido); o span fica aberto até
+    o fim do corpo da resposta e recebe o nome da rota depois do roteamento
+    """
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    @staticmethod
+    def carrier(headers: List[Tuple[bytes, bytes]]) -> dict:
+        return {key.decode("latin-1"): value.decode("latin-1") for key, value in headers}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = propagate.extract(self.carrier(scope.get("headers", [])))
+        with tracer.start_as_current_span(
+            f"{scope['method']} {scope['path']}", context=parent, kind=SpanKind.SERVER,
+            attributes={"http.method": scope["method"], "http.target": scope["path"]}
+        ) as current:
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    current.set_attribute("http.status_code", message["status"])
+                    if message["status"] >= 500:
+                        current.set_status(Status(StatusCode.ERROR))
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if route is not None:
+                    current.update_name(f"{scope['method']} {route.path}")
+                    current.set_attribute("http.route", route.path)
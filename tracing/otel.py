@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+from threading import Lock
+from time import time_ns
+from typing import Any, Dict, Iterator, List, Tuple, Union
+
+from celery import Task
+from loguru import logger
+from opentelemetry import context, propagate, trace
+from opentelemetry.propagators.textmap import Getter
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import Span, SpanKind, Status, StatusCode
+from pymongo import monitoring
+
+from config import env
+
+tracer = trace.get_tracer("chorume-learn")
+provider: Union[TracerProvider, None] = None
+lock = Lock()
+
+# instante da publicação da tarefa (ns), para o span de espera na fila
+SENT_AT = "x-sent-at"
+
+
+def exporter() -> SpanExporter:
+    if env.TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter(endpoint=env.TRACING_OTLP_ENDPOINT)
+    if env.TRACING_EXPORTER == "file":
+        return ConsoleSpanExporter(
+            out=open(env.TRACING_FILE, "a"),
+            formatter=lambda span: span.to_json(indent=None) + "\n"
+        )
+    return ConsoleSpanExporter()
+
+
+def setup(component: str) -> None:
+    """
+    configura o provider global (uma vez por processo); com TRACING_ENABLED desligado os spans
+    continuam sendo abertos, mas são no-op
+    :param component: api ou worker, sufixo do service.name
+    :return:
+    """
+    global provider
+    if not env.TRACING_ENABLED:
+        return
+    with lock:
+        if provider is not None:
+            return
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": f"{env.TRACING_SERVICE_NAME}-{component}"}),
+            sampler=ParentBased(TraceIdRatioBased(env.TRACING_SAMPLE_RATIO))
+        )
+        provider.add_span_processor(BatchSpanProcessor(exporter()))
+        trace.set_tracer_provider(provider)
+    logger.info(f"Tracing enabled; exporter: {env.TRACING_EXPORTER}; service: {env.TRACING_SERVICE_NAME}-{component}")
+
+
+def shutdown() -> None:
+    # envia os spans pendentes antes do processo sair
+    if provider is not None:
+        provider.shutdown()
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    with tracer.start_as_current_span(name, attributes=attributes or None) as current:
+        yield current
+
+
+class RequestGetter(Getter):
+    """
+    lê o contexto propagado dos atributos de task.request (os headers da mensagem viram atributos)
+    """
+    def get(self, carrier: Any, key: str) -> Union[List[str], None]:
+        value = getattr(carrier, key, None)
+        if value is None:
+            return None
+        return [value] if isinstance(value, str) else list(value)
+
+    def keys(self, carrier: Any) -> List[str]:
+        return []
+
+
+class TaskTracing:
+    """
+    liga os spans do worker ao request HTTP que publicou a tarefa: o contexto vai nos headers da mensagem
+    (traceparent), e cada execução vira um span "queue" (publicação até o início) seguido do span da tarefa
+    """
+    getter = RequestGetter()
+
+    def __init__(self):
+        self.running: Dict[str, Tuple[Span, object]] = {}
+
+    @staticmethod
+    def publish(headers: Dict) -> None:
+        propagate.inject(headers)
+        headers[SENT_AT] = time_ns()
+
+    def start(self, task_id: str, task: Task) -> None:
+        parent = propagate.extract(task.request, getter=self.getter)
+        now = time_ns()
+        sent_at = getattr(task.request, SENT_AT, None)
+        if isinstance(sent_at, int) and sent_at < now:
+            tracer.start_span(
+                f"queue {task.name}", context=parent, kind=SpanKind.CONSUMER, start_time=sent_at,
+                attributes={"celery.task_id": task_id, "celery.retries": task.request.retries or 0}
+            ).end(end_time=now)
+        current = tracer.start_span(
+            f"run {task.name}", context=parent, kind=SpanKind.CONSUMER, start_time=now,
+            attributes={"celery.task_id": task_id, "celery.retries": task.request.retries or 0}
+        )
+        self.running[task_id] = (current, context.attach(trace.set_span_in_context(current)))
+
+    def finish(self, task_id: str, state: str = None) -> None:
+        running = self.running.pop(task_id, None)
+        if running is None:
+            return
+        current, token = running
+        current.set_attribute("celery.state", state or "UNKNOWN")
+        context.detach(token)
+        current.end()
+
+    def fail(self, task_id: str, exception: BaseException = None) -> None:
+        running = self.running.get(task_id)
+        if running is None or exception is None:
+            return
+        current, _ = running
+        current.record_exception(exception)
+        current.set_status(Status(StatusCode.ERROR, str(exception)))
+
+
+class MongoCommandSpans(monitoring.CommandListener):
+    """
+    span por comando do Mongo, só dentro de um trace já aberto (as threads do Motor não herdam o contexto
+    e virariam traces soltos)
+    """
+    def __init__(self):
+        self.spans: Dict[Tuple[int, Any], Span] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if not trace.get_current_span().get_span_context().is_valid:
+            return
+        self.spans[(event.request_id, event.connection_id)] = tracer.start_span(
+            f"mongo {event.command_name}", kind=SpanKind.CLIENT,
+            attributes={"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name}
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        current = self.spans.pop((event.request_id, event.connection_id), None)
+        if current is not None:
+            current.end()
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        current = self.spans.pop((event.request_id, event.connection_id), None)
+        if current is not None:
+            current.set_status(Status(StatusCode.ERROR, str(event.failure.get("errmsg", ""))))
+            current.end()